@@ -0,0 +1,550 @@
+"""Helpers shared by the API servers in app.py and async_app.py
+
+Both servers serve the same endpoints, one with Flask and one with Quart on
+an event loop. Reading the query parameters, encoding streamed json rows and
+the caches that follow the change watcher are the same for both and live
+here, the servers only differ in how they handle requests and wait on the
+database and render workers.
+"""
+
+# Import Modules
+from werkzeug.http import http_date
+from bson import ObjectId
+from bson.errors import InvalidId
+from datetime import datetime, timezone
+from typing import AsyncIterator, Iterator
+import json
+import threading
+
+# Use orjson to encode streamed rows if it is installed, it is a lot faster
+# than the json module
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Import data analysis module, image encoding, caches, change watcher, the
+# datapoint container and the tile renderer
+import data_analysis as da
+import image_encoding as ie
+from cache_utils import RenderCache, ObjectCache
+from change_watcher import EventBroadcaster
+from datapoints import Datapoints
+from heatmap_tiles import HeatmapTiles
+
+# Output formats of the endpoints that can stream their rows
+stream_formats = ("json", "ndjson", "array")
+
+# Largest page or result size a request can ask for with ?limit=n
+max_limit = 10000
+
+# Endpoints whose cache keys have the bssid second, dropped when the bssid
+# is seen in new scans
+bssid_images = ("bssidplot", "heatmap", "heatmaptile")
+
+def time_window(args) -> tuple[datetime | None, datetime | None]:
+    """Get the time window from the from and to query parameters.
+
+    Both parameters are optional and in ISO 8601 format. Times with an
+    offset or a trailing Z are converted to UTC, times without one are taken
+    as UTC, and both are returned naive like the times MongoDB returns.
+
+    Args:
+        args (MultiDict): Query parameters of the request
+
+    Raises:
+        ValueError: If a parameter isn't a valid ISO 8601 time
+
+    Returns:
+        tuple[datetime | None, datetime | None]: Start and end of the window
+    """
+
+    start, end = args.get("from"), args.get("to")
+    return (
+        _parse_time(start) if start else None,
+        _parse_time(end) if end else None
+    )
+
+def _parse_time(value: str) -> datetime:
+    # fromisoformat only reads a trailing Z from Python 3.11 on
+    if value[-1:] in ("Z", "z"):
+        value = value[:-1] + "+00:00"
+    time_ = datetime.fromisoformat(value)
+    if time_.tzinfo is not None:
+        time_ = time_.astimezone(timezone.utc).replace(tzinfo=None)
+    return time_
+
+def area_params(args) -> tuple[str, tuple] | None:
+    """Get the area from the bbox or the near and radius query parameters.
+
+    An area is either ?bbox=south,west,north,east or
+    ?near=latitude,longitude&radius=meters, the radius defaults to 100.
+
+    Args:
+        args (MultiDict): Query parameters of the request
+
+    Raises:
+        ValueError: If the parameters aren't valid coordinates
+
+    Returns:
+        tuple[str, tuple] | None: Name of the area query, bbox or radius,
+            and its arguments, None if no area is given
+    """
+
+    if "bbox" in args:
+        south, west, north, east = map(float, args["bbox"].split(","))
+        if not (-90 <= south <= north <= 90 and -180 <= west <= east <= 180):
+            raise ValueError("bbox must be south,west,north,east in degrees")
+        return "bbox", (south, west, north, east)
+
+    if "near" in args:
+        latitude, longitude = map(float, args["near"].split(","))
+        radius = float(args.get("radius", 100))
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180 and radius > 0):
+            raise ValueError("near must be latitude,longitude in degrees and radius positive")
+        return "radius", (latitude, longitude, radius)
+
+    return None
+
+def limit_param(args, default: int | None = None) -> int | None:
+    """Get the limit query parameter, capped at max_limit.
+
+    Args:
+        args (MultiDict): Query parameters of the request
+        default (int | None): Limit if none is given
+
+    Raises:
+        ValueError: If the limit isn't a positive integer
+
+    Returns:
+        int | None: The limit, or the default if none is given
+    """
+
+    value = args.get("limit")
+    if value is None:
+        return default
+    try:
+        limit = int(value)
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        raise ValueError("limit must be a positive integer")
+    return min(limit, max_limit)
+
+def stream_params(args) -> tuple[str, int | None, ObjectId | None]:
+    """Get the output format and pagination from the query parameters.
+
+    The format parameter is json (default), ndjson or array, limit is the
+    maximum number of rows, at most max_limit, and after is the resume token
+    of the last page.
+
+    Args:
+        args (MultiDict): Query parameters of the request
+
+    Raises:
+        ValueError: If a parameter is invalid
+
+    Returns:
+        tuple[str, int | None, ObjectId | None]: Format, limit and after
+    """
+
+    output_format = args.get("format", "json")
+    if output_format not in stream_formats:
+        raise ValueError(f"Unknown format {output_format}")
+
+    limit = limit_param(args)
+
+    after = args.get("after")
+    try:
+        after = ObjectId(after) if after else None
+    except InvalidId as e:
+        raise ValueError(str(e))
+
+    return output_format, limit, after
+
+def json_default(value):
+    """Encode the values the json encoders can't, like jsonify does.
+
+    Args:
+        value: Value to encode
+
+    Raises:
+        TypeError: If the value can't be encoded
+
+    Returns:
+        str: The encoded value
+    """
+
+    if isinstance(value, datetime):
+        return http_date(value)
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def encode_json(value) -> bytes:
+    """Encode a value as compact json.
+
+    Args:
+        value: Value to encode
+
+    Returns:
+        bytes: The json
+    """
+
+    if orjson is not None:
+        return orjson.dumps(
+            value,
+            default=json_default,
+            option=orjson.OPT_PASSTHROUGH_DATETIME
+        )
+    return json.dumps(value, default=json_default, separators=(",", ":")).encode()
+
+def stream_mimetype(output_format: str) -> str:
+    """Get the mimetype of a streamed output format.
+
+    Args:
+        output_format (str): ndjson or array
+
+    Returns:
+        str: The mimetype
+    """
+
+    return "application/x-ndjson" if output_format == "ndjson" else "application/json"
+
+def stream_chunks(
+    rows: Iterator[tuple[ObjectId, object]],
+    output_format: str,
+    limit: int | None
+) -> Iterator[bytes]:
+    """Encode rows as NDJSON or as a JSON array, one chunk per row.
+
+    If the page is full, a last {"next": token} row is added with the resume
+    token to pass as the after parameter for the next page.
+
+    Args:
+        rows (Iterator[tuple[ObjectId, object]]): Resume token and row pairs
+        output_format (str): ndjson for one row per line or array
+        limit (int | None): Page size the rows were limited to
+
+    Returns:
+        Iterator[bytes]: Chunks of the response body
+    """
+
+    ndjson = output_format == "ndjson"
+
+    # Start the array
+    if not ndjson:
+        yield b"["
+
+    # Encode and send every row as soon as it leaves the cursor
+    count, token = 0, None
+    for token, row in rows:
+        yield _row_chunk(row, ndjson, count)
+        count += 1
+
+    # Add the resume token if there can be more rows and end the array
+    end = _end_chunk(token, ndjson, limit is not None and count == limit)
+    if end:
+        yield end
+
+async def stream_chunks_async(
+    rows: AsyncIterator[tuple[ObjectId, object]],
+    output_format: str,
+    limit: int | None
+) -> AsyncIterator[bytes]:
+    """Encode rows from an async cursor like stream_chunks.
+
+    Args:
+        rows (AsyncIterator[tuple[ObjectId, object]]): Resume token and row
+            pairs
+        output_format (str): ndjson for one row per line or array
+        limit (int | None): Page size the rows were limited to
+
+    Returns:
+        AsyncIterator[bytes]: Chunks of the response body
+    """
+
+    ndjson = output_format == "ndjson"
+
+    # Start the array
+    if not ndjson:
+        yield b"["
+
+    # Encode and send every row as soon as it leaves the cursor
+    count, token = 0, None
+    async for token, row in rows:
+        yield _row_chunk(row, ndjson, count)
+        count += 1
+
+    # Add the resume token if there can be more rows and end the array
+    end = _end_chunk(token, ndjson, limit is not None and count == limit)
+    if end:
+        yield end
+
+def _row_chunk(row, ndjson: bool, count: int) -> bytes:
+    # One row per line, or separated by commas in the array
+    if ndjson:
+        return encode_json(row) + b"\n"
+    return (b"," if count else b"") + encode_json(row)
+
+def _end_chunk(token, ndjson: bool, full: bool) -> bytes:
+    # The resume token of a full page, and the end of the array
+    if ndjson:
+        return encode_json({"next": token}) + b"\n" if full else b""
+    return (b"," + encode_json({"next": token}) if full else b"") + b"]"
+
+def datapoints_in_area(
+    datapoints: Datapoints,
+    area: tuple[str, tuple] | None
+) -> Datapoints:
+    """Take the datapoints in an area from their spatial index.
+
+    Args:
+        datapoints (Datapoints): Datapoints of a bssid
+        area (tuple[str, tuple] | None): Area from area_params, None for all
+
+    Returns:
+        Datapoints: The datapoints in the area
+    """
+
+    if area is None:
+        return datapoints
+    kind, area_args = area
+    return datapoints.take(getattr(datapoints.geo_index, kind)(*area_args))
+
+class ApiState:
+    """Caches of a server that are dropped for the bssids seen in new scans."""
+
+    def __init__(self, cache_size: int = 64, cache_dir: str | None = None):
+        """Make the caches of a server.
+
+        Args:
+            cache_size (int): Size of the in memory image cache in MB
+            cache_dir (str | None): Directory for the on disk image cache
+                tier, None to only cache in memory
+        """
+
+        # Make the cache for rendered images
+        self.png_cache = RenderCache(cache_size * 1024 * 1024, cache_dir)
+
+        # Make the caches for the datapoints of a bssid, which keep their
+        # spatial index between area requests, and for heatmap tile
+        # renderers, which keep the projection and spatial index of the
+        # scans between tile requests
+        self.datapoints_cache = ObjectCache()
+        self.heatmap_tiles = ObjectCache()
+
+        # The change watcher is set when the server watches for new scans,
+        # while it runs the data version of each bssid is cached until the
+        # bssid is seen in new scans
+        self.watcher = None
+        self.events = EventBroadcaster()
+        self.bssid_versions = ObjectCache(4096)
+        self._versions_lock = threading.Lock()
+
+    def cached_version(self, bssid: str) -> int | None:
+        """Get the cached data version of a bssid.
+
+        Args:
+            bssid (str): BSSID to get the version of
+
+        Returns:
+            int | None: Data version, None if it isn't cached
+        """
+
+        return self.bssid_versions.get((bssid,))
+
+    def watch_mark(self):
+        """Mark the scans reported so far, before counting a data version.
+
+        Returns:
+            int | None: Number of the latest reported data frame, None if
+                the watcher doesn't run
+        """
+
+        watcher = self.watcher
+        return watcher.last_number if watcher is not None and watcher.running else None
+
+    def store_version(self, bssid: str, version: int, mark) -> None:
+        """Cache a data version if no new scans were reported while counting.
+
+        Args:
+            bssid (str): BSSID of the version
+            version (int): Data version counted after watch_mark
+            mark (int | None): Mark from watch_mark
+        """
+
+        # Otherwise the version may already be outdated
+        with self._versions_lock:
+            if mark is not None and self.watch_mark() == mark:
+                self.bssid_versions.put((bssid,), version)
+
+    def bssid_version(self, client, bssid: str) -> int:
+        """Get the data version of a bssid, cached while the change watcher runs.
+
+        Args:
+            client: Shared db client
+            bssid (str): BSSID to get the version of
+
+        Returns:
+            int: Data version of the bssid
+        """
+
+        version = self.cached_version(bssid)
+        if version is None:
+            mark = self.watch_mark()
+            version = da.get_bssid_data_version(client, bssid)
+            self.store_version(bssid, version, mark)
+        return version
+
+    def on_bssids_scanned(self, number: int, bssids: list[str]) -> list[tuple]:
+        """Drop the cached results of bssids seen in new scans and send events.
+
+        Called from the change watcher thread.
+
+        Args:
+            number (int): Number of the latest data frame
+            bssids (list[str]): BSSIDs seen in the new data frames
+
+        Returns:
+            list[tuple]: Cache keys of the dropped heatmaps, to render them
+                again for the new scans
+        """
+
+        scanned = set(bssids)
+
+        # Drop the versions, datapoints, tile renderers and images of the
+        # bssids
+        with self._versions_lock:
+            self.bssid_versions.discard(lambda key: key[0] in scanned)
+        self.datapoints_cache.discard(lambda key: key[0] in scanned)
+        self.heatmap_tiles.discard(lambda key: key[0] in scanned)
+        dropped = self.png_cache.discard(
+            lambda key: key[0] in bssid_images and key[1] in scanned
+        )
+
+        # Tell the clients following the bssids
+        for bssid in bssids:
+            self.events.publish({"bssid": bssid, "number": number})
+
+        return [key for key in dropped if key[0] == "heatmap"]
+
+    def load_datapoints(self, client, bssid: str, version: int) -> Datapoints:
+        """Get the datapoints of a bssid, cached until the bssid is seen in new scans.
+
+        Args:
+            client: Shared db client
+            bssid (str): BSSID to get datapoints for
+            version (int): Data version of the bssid
+
+        Returns:
+            Datapoints: The datapoints
+        """
+
+        key = (bssid, version)
+        datapoints = self.datapoints_cache.get(key)
+        if datapoints is None:
+            datapoints = da.get_rssi_location_datapoints(client, bssid)
+            self.datapoints_cache.put(key, datapoints)
+        return datapoints
+
+    def heatmap_datapoints(
+        self,
+        client,
+        bssid: str,
+        area: tuple[str, tuple] | None,
+        version: int
+    ) -> Datapoints:
+        """Get the datapoints of a heatmap, only the ones in the area if given.
+
+        Args:
+            client: Shared db client
+            bssid (str): BSSID of the heatmap
+            area (tuple[str, tuple] | None): Area from area_params
+            version (int): Data version of the bssid
+
+        Returns:
+            Datapoints: The datapoints
+        """
+
+        # Take the datapoints in the area from their spatial index
+        return datapoints_in_area(
+            self.load_datapoints(client, bssid, version), area
+        )
+
+    def tile_renderer(
+        self,
+        client,
+        bssid: str,
+        locator: str,
+        version: int
+    ) -> HeatmapTiles:
+        """Get the heatmap tile renderer of a bssid, cached like the datapoints.
+
+        Args:
+            client: Shared db client
+            bssid (str): BSSID of the heatmap
+            locator (str): Name of the locator in da.locators
+            version (int): Data version of the bssid
+
+        Raises:
+            ValueError: If no scan has the weight to locate the access point
+
+        Returns:
+            HeatmapTiles: The tile renderer
+        """
+
+        # Make it from the datapoints and estimated access point location
+        key = (bssid, locator, version)
+        tiles = self.heatmap_tiles.get(key)
+        if tiles is None:
+            datapoints = self.load_datapoints(client, bssid, version)
+            tiles = HeatmapTiles(
+                da.locate_accesspoint(datapoints, locator), datapoints
+            )
+            self.heatmap_tiles.put(key, tiles)
+        return tiles
+
+    def prewarm_key(self, key: tuple, version: int) -> tuple | None:
+        """Get the key of an outdated heatmap for the latest data version.
+
+        Args:
+            key (tuple): Cache key of the outdated heatmap
+            version (int): Latest data version of its bssid
+
+        Returns:
+            tuple | None: Cache key of the heatmap to render, None if it is
+                already cached
+        """
+
+        _, bssid, locator, area, _, image_format = key
+        key = ("heatmap", bssid, locator, area, version, image_format)
+        return None if self.png_cache.get(key) is not None else key
+
+    def image_key(self, key: tuple, accept_mimetypes) -> tuple[tuple, str, str]:
+        """Add the image format the client prefers to a cache key.
+
+        Args:
+            key (tuple): Cache key of the image including the data version
+            accept_mimetypes (MIMEAccept): Accept header of the request
+
+        Returns:
+            tuple[tuple, str, str]: Cache key with the format, name of the
+                format in ie.image_formats and ETag of the image
+        """
+
+        image_format = ie.negotiate_format(accept_mimetypes)
+        key = (*key, image_format)
+        return key, image_format, self.png_cache.etag(key)
+
+    def watch_metrics(self) -> dict:
+        """Get the change watcher and event metrics.
+
+        Returns:
+            dict: Watcher metrics, None if it doesn't run, and event metrics
+        """
+
+        return {
+            "watcher": self.watcher and self.watcher.metrics(),
+            "events": self.events.metrics()
+        }
@@ -6,19 +6,74 @@ data analysis methods and return the requested data to the main interface.
 
 # Import Modules
 from flask import Flask, request, Response, jsonify
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
+from concurrent.futures import ThreadPoolExecutor
 import argparse
-from io import BytesIO
+import atexit
+import queue
+import threading
+from typing import Iterator
 
-# Import data analysis module
+# Import data analysis module, api helpers, image encoding, render pool and
+# change watcher
 import data_analysis as da
+import api_utils as au
+import image_encoding as ie
+from change_watcher import ChangeWatcher, BackgroundUpdater, format_event, keepalive
+from heatmap_tiles import max_zoom
+from render_pool import (
+    RenderPool, RenderPoolFull, render_graph, render_heatmap, render_coverage
+)
 
 
 # Docker flag for when run in a docker network
 parser = argparse.ArgumentParser()
 parser.add_argument('--docker', action="store_true", default=False, dest="docker")
+parser.add_argument('--pool-size', type=int, default=50, dest="pool_size")
+parser.add_argument('--pool-timeout', type=int, default=5000, dest="pool_timeout",
+                    help="Timeout in milliseconds for connecting and waiting on the pool")
+parser.add_argument('--ensure-indexes', action="store_true", default=False,
+                    dest="ensure_indexes",
+                    help="Create the database indexes and verify the query plans on startup")
+parser.add_argument('--cache-size', type=int, default=64, dest="cache_size",
+                    help="Size of the in memory image cache in MB")
+parser.add_argument('--cache-dir', default=None, dest="cache_dir",
+                    help="Directory for the on disk image cache tier")
+parser.add_argument('--render-workers', type=int, default=4, dest="render_workers",
+                    help="Number of render worker processes")
+parser.add_argument('--max-queue', type=int, default=16, dest="max_queue",
+                    help="Render jobs that may wait before requests get 503")
+parser.add_argument('--incremental-heatmaps', type=int, default=4,
+                    dest="incremental_heatmaps",
+                    help="Heatmaps each render worker keeps to only draw new scans, 0 to disable")
+parser.add_argument('--png-level', type=int, default=ie.settings["png_compress_level"],
+                    dest="png_level", help="PNG compression level from 0 to 9")
+parser.add_argument('--no-png-palette', action="store_false", default=True,
+                    dest="png_palette", help="Write heatmaps as RGB instead of palette PNGs")
+parser.add_argument('--webp-quality', type=int, default=ie.settings["webp_quality"],
+                    dest="webp_quality", help="WebP quality from 0 to 100")
+parser.add_argument('--webp-lossless', action="store_true", default=False,
+                    dest="webp_lossless", help="Write lossless WebP images")
+parser.add_argument('--jpeg-quality', type=int, default=ie.settings["jpeg_quality"],
+                    dest="jpeg_quality", help="JPEG quality from 0 to 100")
+parser.add_argument('--watch', action="store_true", default=False,
+                    help="Follow new scans to drop outdated cache entries and send events")
+parser.add_argument('--poll-interval', type=float, default=2.0, dest="poll_interval",
+                    help="Seconds between polls for new scans without a replica set")
+parser.add_argument('--prewarm', action="store_true", default=False,
+                    help="Render the dropped heatmaps again when their bssid is scanned")
+parser.add_argument('--stats-interval', type=float, default=10.0, dest="stats_interval",
+                    help="Longest time in seconds between updates of the bssid statistics and GeoJSON locations")
 args = parser.parse_args()
 
+# Set the encoder settings, the render workers get a copy when they start
+ie.configure(
+    png_compress_level=args.png_level,
+    png_palette=args.png_palette,
+    webp_quality=args.webp_quality,
+    webp_lossless=args.webp_lossless,
+    jpeg_quality=args.jpeg_quality
+)
+
 # Set the credentials for the mongo database
 db_username = "root"
 db_password = "password"
@@ -28,21 +83,294 @@ db_host = "localhost"
 # docker dns resolution over the provided network
 if args.docker: db_host = "mongo"
 
+# Configure the shared database connection pool and close it on shutdown
+da.configure_pool(
+    maxPoolSize=args.pool_size,
+    waitQueueTimeoutMS=args.pool_timeout,
+    connectTimeoutMS=args.pool_timeout,
+    serverSelectionTimeoutMS=args.pool_timeout
+)
+atexit.register(da.close_clients)
+
+# Make the caches of rendered images, datapoints and tile renderers, the
+# change watcher is set on it when it is started with --watch
+api = au.ApiState(args.cache_size, args.cache_dir)
+prewarm_executor = None
+
+# The render pool is started on first use, the worker processes import this
+# module again and must not start pools of their own
+render_pool = None
+render_pool_lock = threading.Lock()
+
 # Define the flask application
 app = Flask(__name__)
 
+@app.before_request
+def before_request():
+    """Start the background updaters on the first request."""
+
+    if not updaters_started:
+        start_updaters()
+
+def stream_rows(
+    rows: Iterator[tuple],
+    output_format: str,
+    limit: int | None
+) -> Response:
+    """Stream rows as chunked NDJSON or as a streamed JSON array.
+
+    Args:
+        rows (Iterator[tuple[ObjectId, object]]): Resume token and row pairs
+        output_format (str): ndjson for one row per line or array
+        limit (int | None): Page size the rows were limited to
+
+    Returns:
+        Response: The streamed response
+    """
+
+    return Response(
+        au.stream_chunks(rows, output_format, limit),
+        mimetype=au.stream_mimetype(output_format)
+    )
+
+def on_bssids_scanned(number: int, bssids: list[str]) -> None:
+    """Drop the cached results of bssids seen in new scans and send events.
+
+    Called by the change watcher from its thread.
+
+    Args:
+        number (int): Number of the latest data frame
+        bssids (list[str]): BSSIDs seen in the new data frames
+    """
+
+    # Render the dropped heatmaps again with the new scans
+    dropped = api.on_bssids_scanned(number, bssids)
+    if prewarm_executor is not None:
+        prewarm_executor.submit(prewarm_heatmaps, dropped)
+
+def prewarm_heatmaps(keys: list[tuple]) -> None:
+    """Render heatmaps again for the latest data version of their bssid.
+
+    Args:
+        keys (list[tuple]): Cache keys of the outdated heatmaps
+    """
+
+    # Get shared db client
+    client = da.client(db_username, db_password, db_host)
+
+    for key in keys:
+        bssid = key[1]
+        version = api.bssid_version(client, bssid)
+        key = api.prewarm_key(key, version)
+        if key is None:
+            continue
+
+        # Leave the render workers to the requests when they are busy
+        _, _, locator, area, _, image_format = key
+        try:
+            api.png_cache.put(key, render_heatmap_image(
+                client, bssid, locator, area, version, image_format
+            ))
+        except RenderPoolFull:
+            return
+        except ValueError:
+            continue
+
+def update_stats() -> None:
+    """Fold new scans into the bssid statistics, run by the stats updater."""
+
+    da.update_bssid_stats(da.client(db_username, db_password, db_host))
+
+def update_geo() -> None:
+    """Store the location of new scans as GeoJSON, run by the geo updater."""
+
+    da.update_geo_locations(da.client(db_username, db_password, db_host))
+
+# The bssid statistics and the GeoJSON locations for the area queries are
+# updated in the background when the watcher sees new scans and at the stats
+# interval, so the requests only read them
+stats_updater = BackgroundUpdater(update_stats, args.stats_interval, "bssid-stats")
+geo_updater = BackgroundUpdater(update_geo, args.stats_interval, "geo-locations")
+
+# The updaters are started by the first request, so they run under any WSGI
+# server but not in the render workers, which import this module again
+updaters_started = False
+updaters_lock = threading.Lock()
+
+def start_updaters() -> None:
+    """Start the stats and geo updaters if they aren't started yet."""
+
+    global updaters_started
+
+    with updaters_lock:
+        if updaters_started:
+            return
+        for updater in (stats_updater, geo_updater):
+            updater.start()
+            atexit.register(updater.stop)
+        updaters_started = True
+
+def start_watcher() -> ChangeWatcher:
+    """Start the change watcher, and the pre-warm thread if requested.
+
+    Returns:
+        ChangeWatcher: The running change watcher
+    """
+
+    global prewarm_executor
+
+    # The pre-warm renders run one at a time so they don't fill the pool
+    if args.prewarm:
+        prewarm_executor = ThreadPoolExecutor(1, thread_name_prefix="prewarm")
+        atexit.register(prewarm_executor.shutdown, cancel_futures=True)
+
+    watcher = ChangeWatcher(
+        da.client(db_username, db_password, db_host), args.poll_interval
+    )
+    watcher.subscribe(on_bssids_scanned)
+    watcher.subscribe(stats_updater.trigger)
+    watcher.subscribe(geo_updater.trigger)
+    api.watcher = watcher
+    watcher.start()
+    atexit.register(watcher.stop)
+    return watcher
+
+def get_render_pool() -> RenderPool:
+    """Get the render pool, starting it on first use.
+
+    Returns:
+        RenderPool: The render pool
+    """
+
+    global render_pool
+
+    with render_pool_lock:
+        if render_pool is None:
+            render_pool = RenderPool(
+                args.render_workers,
+                args.max_queue,
+                incremental_heatmaps=args.incremental_heatmaps
+            )
+            atexit.register(render_pool.shutdown)
+    return render_pool
+
+def render_heatmap_image(
+    client,
+    bssid: str,
+    locator: str,
+    area: tuple[str, tuple] | None,
+    version: int,
+    image_format: str
+) -> bytes:
+    """Render the heatmap of a bssid in a render worker.
+
+    Args:
+        client: Shared db client
+        bssid (str): BSSID to generate the heatmap for
+        locator (str): Name of the locator in da.locators
+        area (tuple[str, tuple] | None): Area from area_params
+        version (int): Data version of the bssid
+        image_format (str): Name of the format in ie.image_formats
+
+    Raises:
+        RenderPoolFull: If all workers are busy and the queue is full
+
+    Returns:
+        bytes: The encoded image
+    """
+
+    # Get the datapoints, only the ones in the area if an area is given
+    datapoints = api.heatmap_datapoints(client, bssid, area, version)
+
+    # Estimate the access point location and render the heatmap in a render
+    # worker, which only draws the new scans if it rendered it before
+    return get_render_pool().submit(
+        render_heatmap, datapoints, locator, 2000, 20, image_format,
+        (bssid, area)
+    )
+
+def cached_image(key: tuple, render) -> Response:
+    """Respond with a cached image, rendering it on a cache miss.
+
+    The key should contain the data version so new scans make a new image.
+    The format is picked from the Accept header and added to the key. The
+    response carries an ETag, and requests with a matching If-None-Match
+    header get an empty 304 response.
+
+    Args:
+        key (tuple): Cache key of the image
+        render: Function taking the name of the image format that returns
+            the encoded image
+
+    Returns:
+        Response: The image response, or 503 if the render pool is full
+    """
+
+    # Pick the image format the client prefers
+    key, image_format, etag = api.image_key(key, request.accept_mimetypes)
+
+    # Let the browser reuse its copy if it already has this version
+    if etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.vary.add("Accept")
+        return response
+
+    # Get the image from the cache or render and cache it
+    data = api.png_cache.get(key)
+    if data is None:
+        try:
+            data = render(image_format)
+        except RenderPoolFull as e:
+            response = jsonify({"error": str(e)})
+            response.status_code = 503
+            response.headers["Retry-After"] = "1"
+            return response
+        api.png_cache.put(key, data)
+
+    # Return the image, caches must keep a copy per format
+    response = Response(data, mimetype=ie.image_formats[image_format])
+    response.set_etag(etag)
+    response.vary.add("Accept")
+    return response
+
 @app.get("/api/ssidoverview/<int:filtertype>/<string:filterstr>")
 def ssidoverview(filtertype: int, filterstr: str):
     """Endpoint for list of ssid and bssid relationships with filter.
 
+    With ?format=ndjson or ?format=array the ssids are streamed as
+    {"ssid": name, "bssids": [[bssid, scans], ...]} rows, and can be paged
+    with the limit and after query parameters.
+
     Args:
         filtertype (int): Type of filter, 0 = ssid, 1 = bssid, 2 = no filter
         filterstr (str): String to filter by
     """
 
-    # Make db client
+    # Get shared db client
     client = da.client(db_username, db_password, db_host)
+
+    # Get the output format and pagination
+    try:
+        output_format, limit, after = au.stream_params(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if filtertype not in da.ssid_filter_types:
+        return jsonify({"error": f"Unknown filter type {filtertype}"}), 400
     
+    # Stream the overview one ssid at a time if requested
+    if output_format != "json":
+        return stream_rows(
+            (
+                (ssid_id, {"ssid": name, "bssids": bssids})
+                for ssid_id, name, bssids in da.iter_ssid_overview(
+                    client, filterstr, filtertype, limit, after
+                )
+            ),
+            output_format,
+            limit
+        )
+
     # Get the overview from the data analysis function
     overview = da.generate_ssid_overview(client, filterstr, filtertype)
     
@@ -52,94 +380,438 @@ def ssidoverview(filtertype: int, filterstr: str):
 @app.get("/api/apscans.png")
 def applot():
     """Endpoint to get a plot of bssids seen over time.
+
+    The plot can be limited to a time window with the optional from and to
+    query parameters in ISO 8601 format.
     """
 
-    # Make db client
+    # Get shared db client
     client = da.client(db_username, db_password, db_host)
+
+    # Get the time window to plot
+    try:
+        start, end = au.time_window(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
-    # Generate the plot
-    fig = da.generate_graph_of_aps(client)
-    
-    # Create file buffer in memory
-    output = BytesIO()
-    
-    # Save the plot in the buffer as an png image
-    FigureCanvas(fig).print_figure(output)
+    def render(image_format: str) -> bytes:
+        # Get the time buckets to plot
+        buckets = da.get_aps_graph_buckets(client, start, end)
+
+        # Render the plot in a render worker
+        return get_render_pool().submit(
+            render_graph, buckets, "aps", image_format
+        )
     
-    # Return the png image
-    return Response(output.getvalue(), mimetype='image/png')
+    # Return the image, cached until new data frames arrive
+    return cached_image(
+        ("apscans", start, end, da.get_data_version(client)),
+        render
+    )
 
 @app.get("/api/bssidplot/<string:bssid>.png")
 def bssidplot(bssid: str):
     """Endpoint to get a plot of rssi over time for bssid.
 
+    The plot can be limited to a time window with the optional from and to
+    query parameters in ISO 8601 format.
+
     Args:
         bssid (str): BSSID to plot the rssi of
     """
 
-    # Make db client
+    # Get shared db client
     client = da.client(db_username, db_password, db_host)
+
+    # Get the time window to plot
+    try:
+        start, end = au.time_window(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
-    # Generate the plot
-    fig = da.generate_bssid_graph(client, bssid)
-    
-    # Create file buffer in memory
-    output = BytesIO()
+    def render(image_format: str) -> bytes:
+        # Get the time buckets to plot
+        buckets = da.get_bssid_graph_buckets(client, bssid, start, end)
 
-    # Save the plot in the buffer as an png image
-    FigureCanvas(fig).print_png(output)
+        # Render the plot in a render worker
+        return get_render_pool().submit(
+            render_graph, buckets, "bssid", image_format
+        )
 
-    # Return the png image
-    return Response(output.getvalue(), mimetype='image/png')
+    # Return the image, cached until the bssid is seen in new scans
+    return cached_image(
+        ("bssidplot", bssid, start, end, api.bssid_version(client, bssid)),
+        render
+    )
 
 @app.get("/api/bssiddatapoints/<string:bssid>")
 def bssiddatapoints(bssid: str):
     """Endpoint to get the datapoints collected about bssid.
 
+    With ?format=ndjson or ?format=array the datapoints are streamed, and
+    can be paged with the limit and after query parameters. The datapoints
+    can be limited to an area with ?bbox=south,west,north,east or
+    ?near=latitude,longitude&radius=meters.
+
     Args:
         bssid (str): BSSID to get datapoints for
     """
 
-    # Make db client
+    # Get shared db client
     client = da.client(db_username, db_password, db_host)
-    
+
+    # Get the output format, pagination and area
+    try:
+        output_format, limit, after = au.stream_params(request.args)
+        area = au.area_params(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Only get the datapoints in the area if one is given
+    if area is not None:
+        kind, area_args = area
+        area = da.area_filters[kind](*area_args)
+
+    # Stream the datapoints one at a time if requested
+    if output_format != "json":
+        return stream_rows(
+            da.iter_datapoint_overview(client, bssid, limit, after, area),
+            output_format,
+            limit
+        )
+
     # Generate the datapoints
-    overview = da.generate_datapoint_overview(client, bssid)
+    if area is None:
+        overview = da.generate_datapoint_overview(client, bssid)
+    else:
+        overview = [
+            datapoint for _, datapoint in da.iter_datapoint_overview(
+                client, bssid, area=area
+            )
+        ]
     
     # Return the datapoints in json format
     return jsonify(overview)
 
+@app.get("/api/bssidstats/<string:bssid>")
+def bssidstats(bssid: str):
+    """Endpoint to get the summary statistics and estimated location of bssid.
+
+    Args:
+        bssid (str): BSSID to get statistics for
+    """
+
+    # Get shared db client
+    client = da.client(db_username, db_password, db_host)
+
+    # Get the statistics of the bssid
+    stats = da.get_bssid_stats(client, bssid)
+    if stats is None:
+        return jsonify({"error": f"No scans of {bssid}"}), 404
+
+    # Return the statistics in json format
+    return jsonify(stats)
+
 @app.get("/api/heatmap/<string:bssid>.png")
 def heatmap(bssid: str):
     """Endpoint to generate a heatmap for bssid.
 
+    The access point locator can be chosen with the locator query parameter,
+    e.g. ?locator=pathloss, the default is the weighted centroid. The
+    heatmap can be limited to the scans in an area with
+    ?bbox=south,west,north,east or ?near=latitude,longitude&radius=meters.
+
     Args:
         bssid (str): BSSID to generate heatmap for
     """
 
-    # Make db client
+    # Get shared db client
     client = da.client(db_username, db_password, db_host)
     
-    # Get the datapoints
-    datapoints = da.get_rssi_location_datapoints(client, bssid)
-    
-    # Estimate the access point location
-    ap_location = da.estimate_accesspoint_location(
-        datapoints["rssi"], datapoints["location"]
+    # Get the locator to estimate the access point location with
+    locator = request.args.get("locator", "centroid")
+    if locator not in da.locators:
+        return jsonify({"error": f"Unknown locator {locator}"}), 400
+
+    # Get the area to limit the heatmap to
+    try:
+        area = au.area_params(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Get the data version from the number of scans of the bssid
+    version = api.bssid_version(client, bssid)
+
+    def render(image_format: str) -> bytes:
+        return render_heatmap_image(
+            client, bssid, locator, area, version, image_format
+        )
+
+    # Return the image, cached until the bssid is seen in new scans, and
+    # 404 if no scan has the weight to locate the access point
+    try:
+        return cached_image(("heatmap", bssid, locator, area, version), render)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+
+@app.get("/api/heatmap/<string:bssid>/<int:z>/<int:x>/<int:y>.png")
+def heatmaptile(bssid: str, z: int, x: int, y: int):
+    """Endpoint to get a 256 pixel tile of the heatmap for bssid.
+
+    At zoom z the heatmap is 256 * 2^z pixels wide and split into 2^z by
+    2^z tiles, x and y count from the top left. The access point locator can
+    be chosen with the locator query parameter like for the heatmap.
+
+    Args:
+        bssid (str): BSSID to generate the heatmap tile for
+        z (int): Zoom level
+        x (int): Column of the tile
+        y (int): Row of the tile
+    """
+
+    # Get shared db client
+    client = da.client(db_username, db_password, db_host)
+
+    # Get the locator to estimate the access point location with
+    locator = request.args.get("locator", "centroid")
+    if locator not in da.locators:
+        return jsonify({"error": f"Unknown locator {locator}"}), 400
+
+    # Check that the tile exists
+    if z > max_zoom or x >= 2**z or y >= 2**z:
+        return jsonify({"error": f"No tile {z}/{x}/{y}"}), 404
+
+    # Get the data version from the number of scans of the bssid
+    version = api.bssid_version(client, bssid)
+
+    def render(image_format: str) -> bytes:
+        # Get the tile renderer of this data version, or make it from the
+        # datapoints and estimated access point location
+        tiles = api.tile_renderer(client, bssid, locator, version)
+
+        # Render and encode the tile, it is small enough to render in the
+        # request
+        return ie.encode_image(
+            tiles.render_tile(z, x, y), image_format, palette=True
+        )
+
+    # Return the image, each tile cached until the bssid is seen in new
+    # scans, and 404 if there aren't enough scans for a heatmap
+    try:
+        return cached_image(
+            ("heatmaptile", bssid, locator, z, x, y, version), render
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+
+@app.get("/api/coverage/<string:ssid>.png")
+def coverage(ssid: str):
+    """Endpoint to generate a combined heatmap of all access points of ssid.
+
+    With ?mode=max each pixel shows the strongest signal of any access point,
+    with ?mode=server it shows which access point has the strongest signal.
+    The access point locator can be chosen with the locator query parameter
+    like for the heatmap.
+
+    Args:
+        ssid (str): SSID to generate the coverage heatmap for
+    """
+
+    # Get shared db client
+    client = da.client(db_username, db_password, db_host)
+
+    # Get the locator and the way to combine the access points
+    locator = request.args.get("locator", "centroid")
+    if locator not in da.locators:
+        return jsonify({"error": f"Unknown locator {locator}"}), 400
+    mode = request.args.get("mode", "max")
+    if mode not in da.coverage_modes:
+        return jsonify({"error": f"Unknown coverage mode {mode}"}), 400
+
+    def render(image_format: str) -> bytes:
+        # Get the datapoints of every access point of the ssid in one query
+        names, groups, datapoints = da.get_ssid_datapoints(client, ssid)
+
+        # Estimate the access point locations and render the heatmap in a
+        # render worker
+        return get_render_pool().submit(
+            render_coverage, names, groups, datapoints, locator, mode, 2000,
+            20, image_format
+        )
+
+    # Return the image, cached until new data frames arrive
+    return cached_image(
+        ("coverage", ssid, mode, locator, da.get_data_version(client)),
+        render
     )
-    
-    # Generate heatmap
-    im = da.generate_heatmap(ap_location, datapoints, 2000, 20)
-    
-    # Make file buffer in memory
-    output = BytesIO()
 
-    # Save heatmap in the buffer as a png image
-    im.save(output, format='png')
+@app.get("/api/scans")
+def scans():
+    """Endpoint to get the data frames scanned inside an area.
+
+    The area is given with ?bbox=south,west,north,east or
+    ?near=latitude,longitude&radius=meters. With ?format=ndjson or
+    ?format=array the data frames are streamed, and can be paged with the
+    limit and after query parameters.
+    """
+
+    # Get shared db client
+    client = da.client(db_username, db_password, db_host)
+
+    # Get the area, output format and pagination
+    try:
+        area = au.area_params(request.args)
+        output_format, limit, after = au.stream_params(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if area is None:
+        return jsonify({"error": "An area is needed, use bbox or near"}), 400
+
+    # Find the data frames in the area by their GeoJSON location
+    kind, area_args = area
+    rows = da.iter_scans_in_area(
+        client, da.area_filters[kind](*area_args), limit, after
+    )
+
+    # Stream the data frames one at a time if requested
+    if output_format != "json":
+        return stream_rows(rows, output_format, limit)
+
+    # Return the data frames in json format
+    return jsonify([data_frame for _, data_frame in rows])
+
+@app.get("/api/nearby")
+def nearby():
+    """Endpoint to get the bssids seen near a location.
+
+    The location is given with ?near=latitude,longitude&radius=meters, and
+    the number of bssids can be limited with ?limit=n, at most and by
+    default max_limit.
+    """
+
+    # Get shared db client
+    client = da.client(db_username, db_password, db_host)
+
+    # Get the location and limit
+    try:
+        area = au.area_params(request.args)
+        limit = au.limit_param(request.args, au.max_limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if area is None or area[0] != "radius":
+        return jsonify({"error": "A location is needed, use near"}), 400
 
-    # Return the png image
-    return Response(output.getvalue(), mimetype='image/png')
+    # Return the bssids closest first in json format
+    return jsonify(da.get_nearby_bssids(client, *area[1], limit))
+
+@app.get("/api/events")
+def bssid_events():
+    """Endpoint to follow the bssids seen in new scans as server-sent events.
+
+    Every bssid seen in new scans gives a bssid event with
+    {"bssid": bssid, "number": latest data frame number}, the bssids can be
+    limited with ?bssid=a,b. Needs the server to run with --watch.
+    """
+
+    if api.watcher is None:
+        return jsonify({"error": "The server doesn't watch for new scans"}), 503
+
+    # Get the bssids to follow, all if none are given
+    followed = set(filter(None, request.args.get("bssid", "").split(",")))
+    events = api.events
+    subscription = events.subscribe()
+
+    def generate() -> Iterator[bytes]:
+        try:
+            # Send a comment right away so the headers go out
+            yield keepalive
+
+            while True:
+                # Send a comment when idle so the connection stays open
+                try:
+                    event = subscription.get(timeout=15)
+                except queue.Empty:
+                    yield keepalive
+                    continue
+
+                if not followed or event["bssid"] in followed:
+                    yield format_event(event)
+        finally:
+            events.unsubscribe(subscription)
+
+    return Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/health")
+def health():
+    """Endpoint to check the connection to the database.
+    """
+
+    # Get shared db client
+    client = da.client(db_username, db_password, db_host)
+
+    # Ping the database
+    status = da.check_health(client)
+
+    # Return the status, with 503 if the database can't be reached
+    return jsonify(status), 200 if status["ok"] else 503
+
+@app.get("/api/poolmetrics")
+def poolmetrics():
+    """Endpoint to get the database connection pool metrics.
+    """
+
+    # Return the pool metrics in json format
+    return jsonify(da.get_pool_metrics())
+
+@app.get("/api/cachemetrics")
+def cachemetrics():
+    """Endpoint to get the rendered image cache metrics.
+    """
+
+    # Return the cache metrics in json format
+    return jsonify(api.png_cache.metrics())
+
+@app.get("/api/rendermetrics")
+def rendermetrics():
+    """Endpoint to get the render pool metrics.
+    """
+
+    # Return the render pool metrics in json format
+    return jsonify(get_render_pool().metrics())
+
+@app.get("/api/watchmetrics")
+def watchmetrics():
+    """Endpoint to get the change watcher and event metrics.
+    """
+
+    # Return the watcher metrics in json format
+    return jsonify({
+        **api.watch_metrics(),
+        "stats": stats_updater.metrics(),
+        "geo": geo_updater.metrics()
+    })
 
 if __name__ == "__main__":
+    # Make sure the queries are indexed before serving if requested
+    if args.ensure_indexes:
+        client = da.client(db_username, db_password, db_host)
+        da.ensure_indexes(client)
+        da.verify_query_plans(client)
+
+    # Start the render workers before the first request
+    get_render_pool()
+
+    # Keep the bssid statistics and GeoJSON locations up to date outside the
+    # requests
+    start_updaters()
+
+    # Follow new scans if requested
+    if args.watch:
+        start_watcher()
+
     # Start the flask server when this file is run
     app.run("0.0.0.0", 8090)
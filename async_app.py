@@ -0,0 +1,1089 @@
+"""Async application to serve the data analysis API in production
+
+This script serves the same API endpoints as app.py from an asyncio event
+loop with Hypercorn, sharing its helpers and caches through api_utils.
+The queries go through the async pymongo client and are streamed from its
+cursors, the background updates, the in process time series and the tile
+rendering run in a thread pool the size of the connection pool, and the CPU
+heavy plot and heatmap rendering runs in a bounded process pool, so one slow
+request doesn't block the others. When the render pool and its queue are
+full, image requests get a 503 with Retry-After. With --watch a change
+watcher thread follows new scans, drops the cached results of the bssids
+that were scanned and sends events to the clients following them.
+"""
+
+# Import Modules
+from quart import Quart, request, Response, jsonify
+from pymongo import AsyncMongoClient, ASCENDING, DESCENDING
+from bson import ObjectId
+from hypercorn.asyncio import serve
+from hypercorn.config import Config
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import AsyncIterator
+import argparse
+import asyncio
+import time
+
+# Import data analysis module, api helpers, image encoding, render pool,
+# change watcher, the datapoint container and the tile renderer
+import data_analysis as da
+import api_utils as au
+import image_encoding as ie
+from change_watcher import ChangeWatcher, BackgroundUpdater, format_event, keepalive
+from datapoints import Datapoints
+from heatmap_tiles import HeatmapTiles, max_zoom
+from render_pool import (
+    RenderPool, RenderPoolFull, render_graph, render_heatmap, render_coverage
+)
+
+# Set the credentials for the mongo database
+db_username = "root"
+db_password = "password"
+db_host = "localhost"
+
+# Settings, changed by the command line arguments when this file is run
+settings = {
+    "pool_size": 50,
+    "pool_timeout": 5000,
+    "ensure_indexes": False,
+    "render_workers": 4,
+    "max_queue": 16,
+    "incremental_heatmaps": 4,
+    "cache_size": 64,
+    "cache_dir": None,
+    "watch": False,
+    "poll_interval": 2.0,
+    "prewarm": False,
+    "stats_interval": 10.0
+}
+
+# Define the application, the database clients, render pool and caches are
+# made when it starts serving
+app = Quart(__name__)
+state = {}
+
+@app.before_serving
+async def startup():
+    """Make the database clients, render pool and caches."""
+
+    # Both clients use the same pool settings and count their pool events
+    # in the same metrics
+    da.configure_pool(
+        maxPoolSize=settings["pool_size"],
+        waitQueueTimeoutMS=settings["pool_timeout"],
+        connectTimeoutMS=settings["pool_timeout"],
+        serverSelectionTimeoutMS=settings["pool_timeout"]
+    )
+    uri = f"mongodb://{db_username}:{db_password}@{db_host}:27017/"
+    state["client"] = AsyncMongoClient(
+        uri,
+        event_listeners=[da.pool_metrics],
+        **da.pool_settings
+    )
+    state["db"] = state["client"]["scandata"]
+    state["sync_client"] = da.client(db_username, db_password, db_host)
+
+    # The blocking work left in threads gets one thread per connection of the
+    # pool, asyncio.to_thread uses it as well
+    state["executor"] = ThreadPoolExecutor(
+        settings["pool_size"], thread_name_prefix="async-app"
+    )
+    asyncio.get_running_loop().set_default_executor(state["executor"])
+
+    # Make sure the queries are indexed before serving if requested
+    if settings["ensure_indexes"]:
+        await asyncio.to_thread(da.ensure_indexes, state["sync_client"])
+        await asyncio.to_thread(da.verify_query_plans, state["sync_client"])
+
+    # The bssid statistics and the GeoJSON locations for the area queries
+    # are maintained with the synchronous client in threads, when the watcher
+    # sees new scans and at the stats interval, so the requests only read them
+    state["stats_updater"] = BackgroundUpdater(
+        lambda: da.update_bssid_stats(state["sync_client"]),
+        settings["stats_interval"],
+        "bssid-stats"
+    )
+    state["geo_updater"] = BackgroundUpdater(
+        lambda: da.update_geo_locations(state["sync_client"]),
+        settings["stats_interval"],
+        "geo-locations"
+    )
+    state["stats_updater"].start()
+    state["geo_updater"].start()
+
+    state["render_pool"] = RenderPool(
+        settings["render_workers"],
+        settings["max_queue"],
+        incremental_heatmaps=settings["incremental_heatmaps"]
+    )
+    state["api"] = au.ApiState(settings["cache_size"], settings["cache_dir"])
+
+    # Follow new scans if requested, while the watcher runs the data version
+    # of each bssid is cached until the bssid is seen in new scans
+    state["loop"] = asyncio.get_running_loop()
+    if settings["watch"]:
+        watcher = ChangeWatcher(state["sync_client"], settings["poll_interval"])
+        watcher.subscribe(on_bssids_scanned)
+        watcher.subscribe(state["stats_updater"].trigger)
+        watcher.subscribe(state["geo_updater"].trigger)
+        state["api"].watcher = watcher
+        await asyncio.to_thread(watcher.start)
+
+@app.after_serving
+async def shutdown():
+    """Close the database clients and stop the render pool."""
+
+    if state["api"].watcher is not None:
+        await asyncio.to_thread(state["api"].watcher.stop)
+    await asyncio.to_thread(state["stats_updater"].stop)
+    await asyncio.to_thread(state["geo_updater"].stop)
+    await state["client"].close()
+    da.close_clients()
+    state["render_pool"].shutdown()
+
+async def bssid_id(bssid: str):
+    """Get the DB id of a mac address.
+
+    Args:
+        bssid (str): Mac Address to get the id of
+
+    Returns:
+        ObjectId | None: The id or None if the mac address doesn't exist
+    """
+
+    document = await state["db"]["bssid_pool"].find_one(
+        {"name": bssid}, da.projections["bssid_id"]
+    )
+    return document and document["_id"]
+
+async def bssid_version(bssid: str) -> int:
+    """Get the data version of a bssid, cached while the change watcher runs.
+
+    Args:
+        bssid (str): BSSID to get the version of
+
+    Returns:
+        int: Data version of the bssid
+    """
+
+    api = state["api"]
+    version = api.cached_version(bssid)
+    if version is None:
+        mark = api.watch_mark()
+        version = await state["db"]["ap_data_frames"].count_documents(
+            {"bssid": await bssid_id(bssid)}
+        )
+        api.store_version(bssid, version, mark)
+    return version
+
+async def data_version() -> int:
+    """Get the data version from the latest data frame.
+
+    Returns:
+        int: Number of the latest data frame, 0 if there are none
+    """
+
+    latest = await state["db"]["data_frames"].find_one(
+        {}, da.projections["data_frame_number"], sort=[("number", -1)]
+    )
+    return latest["number"] if latest else 0
+
+async def check_health() -> dict:
+    """Check that the database can be reached through the async client.
+
+    Returns:
+        dict: Health status and ping time in milliseconds, like
+            da.check_health
+    """
+
+    start = time.perf_counter()
+
+    try:
+        # Ping the server, this goes through the connection pool
+        await state["client"].admin.command("ping")
+    except Exception as e:
+        return {"ok": False, "error": str(e)}
+
+    return {
+        "ok": True,
+        "ping_ms": round((time.perf_counter() - start) * 1000, 3)
+    }
+
+def on_bssids_scanned(number: int, bssids: list[str]) -> None:
+    """Drop the cached results of bssids seen in new scans and send events.
+
+    Called by the change watcher from its thread.
+
+    Args:
+        number (int): Number of the latest data frame
+        bssids (list[str]): BSSIDs seen in the new data frames
+    """
+
+    # Render the dropped heatmaps again with the new scans on the event loop
+    dropped = state["api"].on_bssids_scanned(number, bssids)
+    if settings["prewarm"]:
+        asyncio.run_coroutine_threadsafe(prewarm_heatmaps(dropped), state["loop"])
+
+async def prewarm_heatmaps(keys: list[tuple]) -> None:
+    """Render heatmaps again for the latest data version of their bssid.
+
+    The heatmaps are rendered one at a time so they don't fill the pool.
+
+    Args:
+        keys (list[tuple]): Cache keys of the outdated heatmaps
+    """
+
+    api = state["api"]
+    for key in keys:
+        bssid = key[1]
+        version = await bssid_version(bssid)
+        key = api.prewarm_key(key, version)
+        if key is None:
+            continue
+
+        # Leave the render workers to the requests when they are busy
+        _, _, locator, area, _, image_format = key
+        try:
+            api.png_cache.put(key, await render_heatmap_image(
+                bssid, locator, area, version, image_format
+            ))
+        except RenderPoolFull:
+            return
+        except ValueError:
+            continue
+
+async def aggregate(collection: str, pipeline: list[dict]) -> list[dict]:
+    """Run an aggregation pipeline and get all results.
+
+    Args:
+        collection (str): Name of the collection
+        pipeline (list[dict]): Aggregation pipeline
+
+    Returns:
+        list[dict]: The results
+    """
+
+    cursor = await state["db"][collection].aggregate(pipeline)
+    return await cursor.to_list(None)
+
+def stream_rows(
+    rows: AsyncIterator[tuple],
+    output_format: str,
+    limit: int | None
+) -> Response:
+    """Stream rows as chunked NDJSON or as a streamed JSON array.
+
+    Args:
+        rows (AsyncIterator[tuple[ObjectId, object]]): Resume token and row
+            pairs
+        output_format (str): ndjson for one row per line or array
+        limit (int | None): Page size the rows were limited to
+
+    Returns:
+        Response: The streamed response
+    """
+
+    response = Response(
+        au.stream_chunks_async(rows, output_format, limit),
+        mimetype=au.stream_mimetype(output_format)
+    )
+    response.timeout = None
+    return response
+
+async def iter_ssid_overview(
+    filterstr: str,
+    filtertype: int,
+    limit: int | None = None,
+    after: ObjectId | None = None
+) -> AsyncIterator[tuple]:
+    """Stream the ssid overview one ssid at a time, like da.iter_ssid_overview.
+
+    Args:
+        filterstr (str): String to filter by
+        filtertype (int): Type of filter, 0 = ssid, 1 = bssid, 2 = no filter
+        limit (int | None): Maximum number of ssids, None for all
+        after (ObjectId | None): Only ssids with an id after this one
+
+    Returns:
+        AsyncIterator[tuple[ObjectId, str, list[tuple[str, int]]]]: Id and
+            name of each ssid with its mac addresses and number of scans
+    """
+
+    cursor = await state["db"]["ssid_pool"].aggregate(
+        da.ssid_overview_pipeline(filterstr, filtertype, limit, after)
+    )
+    async with cursor:
+        async for ssid in cursor:
+            yield da.ssid_overview_row(ssid)
+
+async def iter_datapoint_overview(
+    bssid: str,
+    limit: int | None = None,
+    after: ObjectId | None = None,
+    area: dict | None = None
+) -> AsyncIterator[tuple]:
+    """Stream the datapoints of a bssid, like da.iter_datapoint_overview.
+
+    Args:
+        bssid (str): The BSSID to get datapoints for
+        limit (int | None): Maximum number of datapoints, None for all
+        after (ObjectId | None): Only datapoints with an id after this one
+        area (dict | None): Filter from da.bbox_filter or da.radius_filter
+
+    Returns:
+        AsyncIterator[tuple[ObjectId, dict]]: Ap_data_frame id and location,
+            rssi and time of each datapoint
+    """
+
+    # Continue after the last datapoint of the previous page
+    match = {"bssid": await bssid_id(bssid)}
+    if after is not None:
+        match["_id"] = {"$gt": after}
+
+    cursor = await state["db"]["ap_data_frames"].aggregate(
+        da.datapoints_pipeline(match, area, limit=limit, keep_id=True)
+    )
+    async with cursor:
+        async for datapoint in cursor:
+            yield datapoint["_id"], da.datapoint_row(datapoint)
+
+async def iter_scans_in_area(
+    area: dict,
+    limit: int | None = None,
+    after: ObjectId | None = None
+) -> AsyncIterator[tuple]:
+    """Stream the data frames scanned inside an area, like da.iter_scans_in_area.
+
+    Args:
+        area (dict): Filter from da.bbox_filter or da.radius_filter
+        limit (int | None): Maximum number of data frames, None for all
+        after (ObjectId | None): Only data frames with an id after this one
+
+    Returns:
+        AsyncIterator[tuple[ObjectId, dict]]: Id and location, number and
+            time of each data frame
+    """
+
+    # Continue after the last data frame of the previous page
+    match = dict(area)
+    if after is not None:
+        match["_id"] = {"$gt": after}
+
+    cursor = state["db"]["data_frames"].find(
+        match, da.projections["data_frame_area"]
+    )
+    if limit:
+        cursor = cursor.sort("_id", ASCENDING).limit(limit)
+    async with cursor:
+        async for data_frame in cursor:
+            yield data_frame["_id"], da.area_row(data_frame)
+
+async def get_bssid_stats(bssid: str) -> dict | None:
+    """Get the summary statistics of a bssid, like da.get_bssid_stats.
+
+    Args:
+        bssid (str): BSSID to get statistics for
+
+    Returns:
+        dict | None: The summary, None if the bssid hasn't been seen
+    """
+
+    id_ = await bssid_id(bssid)
+    if id_ is None:
+        return None
+    stats = await state["db"]["bssid_stats"].find_one(
+        {"_id": id_}, da.projections["bssid_stats"]
+    )
+    return stats and da.bssid_stats_summary(stats)
+
+async def bssid_scan_time(id_: ObjectId | None, direction: int) -> datetime | None:
+    """Get the time of the first or last scan of a bssid.
+
+    Args:
+        id_ (ObjectId | None): DB id of the bssid
+        direction (int): ASCENDING for the first scan, DESCENDING for the
+            last one
+
+    Returns:
+        datetime | None: Time of the scan, None if there are no scans
+    """
+
+    db = state["db"]
+    ap_data_frame = await db["ap_data_frames"].find_one(
+        {"bssid": id_}, da.projections["ap_data_frame_id"], sort=[("_id", direction)]
+    )
+    if ap_data_frame is None:
+        return None
+    data_frame = await db["data_frames"].find_one(
+        {"ap_data_frames": ap_data_frame["_id"]}, da.projections["data_frame_time"]
+    )
+    return data_frame and data_frame["time"]
+
+async def get_bssid_graph_buckets(
+    bssid: str,
+    start: datetime | None,
+    end: datetime | None
+) -> list[dict]:
+    """Get the rssi of a bssid in time buckets, like da.get_bssid_graph_buckets.
+
+    Args:
+        bssid (str): BSSID to graph
+        start (datetime | None): Only plot scans from this time
+        end (datetime | None): Only plot scans until this time
+
+    Returns:
+        list[dict]: Buckets with _id as time and min, mean and max rssi
+    """
+
+    # Fill in the bound of the time range that isn't given
+    id_ = await bssid_id(bssid)
+    if start is None:
+        start = await bssid_scan_time(id_, ASCENDING)
+    if end is None:
+        end = await bssid_scan_time(id_, DESCENDING)
+    if start is None or end is None:
+        return []
+
+    return await aggregate(
+        "ap_data_frames", da.bssid_graph_pipeline(id_, start, end, da.plot_width())
+    )
+
+async def get_ssid_datapoints(ssid: str) -> tuple:
+    """Get the datapoints of every bssid of an ssid, like da.get_ssid_datapoints.
+
+    Args:
+        ssid (str): Name of the network
+
+    Returns:
+        tuple[list[str], np.ndarray, Datapoints]: BSSIDs, the index in the
+            bssids of each datapoint and the datapoints of all bssids
+    """
+
+    db = state["db"]
+    ssid_document = await db["ssid_pool"].find_one(
+        {"name": ssid}, da.projections["ssid_id"]
+    )
+    bssids = await db["bssid_pool"].find(
+        {"ssid": ssid_document and ssid_document["_id"]},
+        da.projections["bssid_id_name"]
+    ).to_list(None)
+    documents = await aggregate(
+        "ap_data_frames", da.ssid_datapoints_pipeline(bssids)
+    )
+    return da.group_ssid_datapoints(bssids, documents)
+
+async def load_datapoints(bssid: str, version: int) -> Datapoints:
+    """Get the datapoints of a bssid, cached until the bssid is seen in new scans.
+
+    Args:
+        bssid (str): BSSID to get datapoints for
+        version (int): Data version of the bssid
+
+    Returns:
+        Datapoints: The datapoints
+    """
+
+    datapoints_cache = state["api"].datapoints_cache
+    key = (bssid, version)
+    datapoints = datapoints_cache.get(key)
+    if datapoints is None:
+        datapoints = Datapoints.from_cursor(await aggregate(
+            "ap_data_frames", da.datapoints_pipeline({"bssid": await bssid_id(bssid)})
+        ))
+        datapoints_cache.put(key, datapoints)
+    return datapoints
+
+async def tile_renderer(bssid: str, locator: str, version: int) -> HeatmapTiles:
+    """Get the heatmap tile renderer of a bssid, cached like the datapoints.
+
+    Args:
+        bssid (str): BSSID of the heatmap
+        locator (str): Name of the locator in da.locators
+        version (int): Data version of the bssid
+
+    Raises:
+        ValueError: If no scan has the weight to locate the access point
+
+    Returns:
+        HeatmapTiles: The tile renderer
+    """
+
+    # Make it from the datapoints and estimated access point location in a
+    # thread
+    heatmap_tiles = state["api"].heatmap_tiles
+    key = (bssid, locator, version)
+    tiles = heatmap_tiles.get(key)
+    if tiles is None:
+        datapoints = await load_datapoints(bssid, version)
+        tiles = await asyncio.to_thread(
+            lambda: HeatmapTiles(da.locate_accesspoint(datapoints, locator), datapoints)
+        )
+        heatmap_tiles.put(key, tiles)
+    return tiles
+
+async def render_heatmap_image(
+    bssid: str,
+    locator: str,
+    area: tuple[str, tuple] | None,
+    version: int,
+    image_format: str
+) -> bytes:
+    """Render the heatmap of a bssid in a worker process.
+
+    Args:
+        bssid (str): BSSID to generate the heatmap for
+        locator (str): Name of the locator in da.locators
+        area (tuple[str, tuple] | None): Area from area_params
+        version (int): Data version of the bssid
+        image_format (str): Name of the format in ie.image_formats
+
+    Raises:
+        RenderPoolFull: If all workers are busy and the queue is full
+
+    Returns:
+        bytes: The encoded image
+    """
+
+    # Get the datapoints, only the ones in the area if an area is given
+    datapoints = au.datapoints_in_area(await load_datapoints(bssid, version), area)
+
+    # Render the heatmap in a worker process, which only draws the new scans
+    # if it rendered it before
+    return await state["render_pool"].render(
+        render_heatmap, datapoints, locator, 2000, 20, image_format,
+        (bssid, area)
+    )
+
+async def cached_image(key: tuple, render) -> Response:
+    """Respond with a cached image, rendering it on a cache miss.
+
+    The format is picked from the Accept header and added to the key.
+
+    Args:
+        key (tuple): Cache key of the image including the data version
+        render: Coroutine function taking the name of the image format that
+            returns the encoded image
+
+    Returns:
+        Response: The image response, 304 if the browser has it or 503 if
+            the render pool is full
+    """
+
+    # Pick the image format the client prefers
+    png_cache = state["api"].png_cache
+    key, image_format, etag = state["api"].image_key(key, request.accept_mimetypes)
+
+    # Let the browser reuse its copy if it already has this version
+    if etag in request.if_none_match:
+        response = Response("", status=304)
+        response.set_etag(etag)
+        response.vary.add("Accept")
+        return response
+
+    # Get the image from the cache or render and cache it
+    data = png_cache.get(key)
+    if data is None:
+        try:
+            data = await render(image_format)
+        except RenderPoolFull as e:
+            response = jsonify({"error": str(e)})
+            response.status_code = 503
+            response.headers["Retry-After"] = "1"
+            return response
+        png_cache.put(key, data)
+
+    # Return the image, caches must keep a copy per format
+    response = Response(data, mimetype=ie.image_formats[image_format])
+    response.set_etag(etag)
+    response.vary.add("Accept")
+    return response
+
+@app.get("/api/ssidoverview/<int:filtertype>/<string:filterstr>")
+async def ssidoverview(filtertype: int, filterstr: str):
+    """Endpoint for list of ssid and bssid relationships with filter.
+
+    With ?format=ndjson or ?format=array the ssids are streamed as
+    {"ssid": name, "bssids": [[bssid, scans], ...]} rows, and can be paged
+    with the limit and after query parameters.
+
+    Args:
+        filtertype (int): Type of filter, 0 = ssid, 1 = bssid, 2 = no filter
+        filterstr (str): String to filter by
+    """
+
+    # Get the output format and pagination
+    try:
+        output_format, limit, after = au.stream_params(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if filtertype not in da.ssid_filter_types:
+        return jsonify({"error": f"Unknown filter type {filtertype}"}), 400
+
+    # Stream the overview one ssid at a time if requested
+    if output_format != "json":
+        return stream_rows(
+            (
+                (ssid_id, {"ssid": name, "bssids": bssids})
+                async for ssid_id, name, bssids in iter_ssid_overview(
+                    filterstr, filtertype, limit, after
+                )
+            ),
+            output_format,
+            limit
+        )
+
+    # Get the overview and return it in json format
+    return jsonify({
+        name: bssids
+        async for _, name, bssids in iter_ssid_overview(filterstr, filtertype)
+    })
+
+@app.get("/api/bssiddatapoints/<string:bssid>")
+async def bssiddatapoints(bssid: str):
+    """Endpoint to get the datapoints collected about bssid.
+
+    With ?format=ndjson or ?format=array the datapoints are streamed, and
+    can be paged with the limit and after query parameters. The datapoints
+    can be limited to an area with ?bbox=south,west,north,east or
+    ?near=latitude,longitude&radius=meters.
+
+    Args:
+        bssid (str): BSSID to get datapoints for
+    """
+
+    # Get the output format, pagination and area
+    try:
+        output_format, limit, after = au.stream_params(request.args)
+        area = au.area_params(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Only get the datapoints in the area if one is given
+    if area is not None:
+        kind, area_args = area
+        area = da.area_filters[kind](*area_args)
+
+    # Stream the datapoints one at a time if requested
+    rows = iter_datapoint_overview(bssid, limit, after, area)
+    if output_format != "json":
+        return stream_rows(rows, output_format, limit)
+
+    # Get the datapoints and return them in json format
+    return jsonify([datapoint async for _, datapoint in rows])
+
+@app.get("/api/bssidstats/<string:bssid>")
+async def bssidstats(bssid: str):
+    """Endpoint to get the summary statistics and estimated location of bssid.
+
+    Args:
+        bssid (str): BSSID to get statistics for
+    """
+
+    # Get the statistics of the bssid
+    stats = await get_bssid_stats(bssid)
+    if stats is None:
+        return jsonify({"error": f"No scans of {bssid}"}), 404
+
+    # Return the statistics in json format
+    return jsonify(stats)
+
+@app.get("/api/apscans.png")
+async def applot():
+    """Endpoint to get a plot of bssids seen over time.
+
+    The plot can be limited to a time window with the optional from and to
+    query parameters in ISO 8601 format.
+    """
+
+    # Get the time window to plot
+    try:
+        start, end = au.time_window(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    async def render(image_format: str) -> bytes:
+        # Get the number of access points in time buckets from the
+        # incremental time series, which is kept in this process with the
+        # synchronous client in a thread
+        buckets = await asyncio.to_thread(
+            da.get_aps_graph_buckets, state["sync_client"], start, end
+        )
+        return await state["render_pool"].render(
+            render_graph, buckets, "aps", image_format
+        )
+
+    # Return the image, cached until new data frames arrive
+    return await cached_image(("apscans", start, end, await data_version()), render)
+
+@app.get("/api/bssidplot/<string:bssid>.png")
+async def bssidplot(bssid: str):
+    """Endpoint to get a plot of rssi over time for bssid.
+
+    The plot can be limited to a time window with the optional from and to
+    query parameters in ISO 8601 format.
+
+    Args:
+        bssid (str): BSSID to plot the rssi of
+    """
+
+    # Get the time window to plot
+    try:
+        start, end = au.time_window(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Get the data version from the number of scans of the bssid
+    version = await bssid_version(bssid)
+
+    async def render(image_format: str) -> bytes:
+        # Get the time buckets to plot
+        buckets = await get_bssid_graph_buckets(bssid, start, end)
+        return await state["render_pool"].render(
+            render_graph, buckets, "bssid", image_format
+        )
+
+    # Return the image, cached until the bssid is seen in new scans
+    return await cached_image(("bssidplot", bssid, start, end, version), render)
+
+@app.get("/api/heatmap/<string:bssid>.png")
+async def heatmap(bssid: str):
+    """Endpoint to generate a heatmap for bssid.
+
+    The access point locator can be chosen with the locator query parameter,
+    e.g. ?locator=pathloss, the default is the weighted centroid. The
+    heatmap can be limited to the scans in an area with
+    ?bbox=south,west,north,east or ?near=latitude,longitude&radius=meters.
+
+    Args:
+        bssid (str): BSSID to generate heatmap for
+    """
+
+    # Get the locator to estimate the access point location with
+    locator = request.args.get("locator", "centroid")
+    if locator not in da.locators:
+        return jsonify({"error": f"Unknown locator {locator}"}), 400
+
+    # Get the area to limit the heatmap to
+    try:
+        area = au.area_params(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Get the data version from the number of scans of the bssid
+    version = await bssid_version(bssid)
+
+    async def render(image_format: str) -> bytes:
+        return await render_heatmap_image(
+            bssid, locator, area, version, image_format
+        )
+
+    # Return the image, cached until the bssid is seen in new scans, and
+    # 404 if no scan has the weight to locate the access point
+    try:
+        return await cached_image(("heatmap", bssid, locator, area, version), render)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+
+@app.get("/api/heatmap/<string:bssid>/<int:z>/<int:x>/<int:y>.png")
+async def heatmaptile(bssid: str, z: int, x: int, y: int):
+    """Endpoint to get a 256 pixel tile of the heatmap for bssid.
+
+    At zoom z the heatmap is 256 * 2^z pixels wide and split into 2^z by
+    2^z tiles, x and y count from the top left. The access point locator can
+    be chosen with the locator query parameter like for the heatmap.
+
+    Args:
+        bssid (str): BSSID to generate the heatmap tile for
+        z (int): Zoom level
+        x (int): Column of the tile
+        y (int): Row of the tile
+    """
+
+    # Get the locator to estimate the access point location with
+    locator = request.args.get("locator", "centroid")
+    if locator not in da.locators:
+        return jsonify({"error": f"Unknown locator {locator}"}), 400
+
+    # Check that the tile exists
+    if z > max_zoom or x >= 2**z or y >= 2**z:
+        return jsonify({"error": f"No tile {z}/{x}/{y}"}), 404
+
+    # Get the data version from the number of scans of the bssid
+    version = await bssid_version(bssid)
+
+    async def render(image_format: str) -> bytes:
+        # Get the tile renderer of this data version, then render and encode
+        # the tile in a thread, it is small enough to not need a render
+        # worker
+        tiles = await tile_renderer(bssid, locator, version)
+        return await asyncio.to_thread(
+            lambda: ie.encode_image(
+                tiles.render_tile(z, x, y), image_format, palette=True
+            )
+        )
+
+    # Return the image, each tile cached until the bssid is seen in new
+    # scans, and 404 if there aren't enough scans for a heatmap
+    try:
+        return await cached_image(
+            ("heatmaptile", bssid, locator, z, x, y, version), render
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+
+@app.get("/api/coverage/<string:ssid>.png")
+async def coverage(ssid: str):
+    """Endpoint to generate a combined heatmap of all access points of ssid.
+
+    With ?mode=max each pixel shows the strongest signal of any access point,
+    with ?mode=server it shows which access point has the strongest signal.
+    The access point locator can be chosen with the locator query parameter
+    like for the heatmap.
+
+    Args:
+        ssid (str): SSID to generate the coverage heatmap for
+    """
+
+    # Get the locator and the way to combine the access points
+    locator = request.args.get("locator", "centroid")
+    if locator not in da.locators:
+        return jsonify({"error": f"Unknown locator {locator}"}), 400
+    mode = request.args.get("mode", "max")
+    if mode not in da.coverage_modes:
+        return jsonify({"error": f"Unknown coverage mode {mode}"}), 400
+
+    async def render(image_format: str) -> bytes:
+        # Get the datapoints of every access point of the ssid in one query
+        names, groups, datapoints = await get_ssid_datapoints(ssid)
+
+        # Render the heatmap in a worker process
+        return await state["render_pool"].render(
+            render_coverage, names, groups, datapoints, locator, mode, 2000,
+            20, image_format
+        )
+
+    # Return the image, cached until new data frames arrive
+    return await cached_image(
+        ("coverage", ssid, mode, locator, await data_version()), render
+    )
+
+@app.get("/api/scans")
+async def scans():
+    """Endpoint to get the data frames scanned inside an area.
+
+    The area is given with ?bbox=south,west,north,east or
+    ?near=latitude,longitude&radius=meters. With ?format=ndjson or
+    ?format=array the data frames are streamed, and can be paged with the
+    limit and after query parameters.
+    """
+
+    # Get the area, output format and pagination
+    try:
+        area = au.area_params(request.args)
+        output_format, limit, after = au.stream_params(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if area is None:
+        return jsonify({"error": "An area is needed, use bbox or near"}), 400
+
+    # Find the data frames in the area by their GeoJSON location
+    kind, area_args = area
+    rows = iter_scans_in_area(da.area_filters[kind](*area_args), limit, after)
+
+    # Stream the data frames one at a time if requested
+    if output_format != "json":
+        return stream_rows(rows, output_format, limit)
+
+    # Return the data frames in json format
+    return jsonify([data_frame async for _, data_frame in rows])
+
+@app.get("/api/nearby")
+async def nearby():
+    """Endpoint to get the bssids seen near a location.
+
+    The location is given with ?near=latitude,longitude&radius=meters, and
+    the number of bssids can be limited with ?limit=n, at most and by
+    default max_limit.
+    """
+
+    # Get the location and limit
+    try:
+        area = au.area_params(request.args)
+        limit = au.limit_param(request.args, au.max_limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if area is None or area[0] != "radius":
+        return jsonify({"error": "A location is needed, use near"}), 400
+
+    # Return the bssids closest first in json format
+    return jsonify(await aggregate(
+        "data_frames", da.nearby_bssids_pipeline(*area[1], limit)
+    ))
+
+@app.get("/api/events")
+async def bssid_events():
+    """Endpoint to follow the bssids seen in new scans as server-sent events.
+
+    Every bssid seen in new scans gives a bssid event with
+    {"bssid": bssid, "number": latest data frame number}, the bssids can be
+    limited with ?bssid=a,b. Needs the server to run with --watch.
+    """
+
+    if state["api"].watcher is None:
+        return jsonify({"error": "The server doesn't watch for new scans"}), 503
+
+    # Get the bssids to follow, all if none are given
+    followed = set(filter(None, request.args.get("bssid", "").split(",")))
+    events = state["api"].events
+    subscription = events.subscribe(asyncio.get_running_loop())
+
+    async def generate():
+        try:
+            # Send a comment right away so the headers go out
+            yield keepalive
+
+            while True:
+                # Send a comment when idle so the connection stays open
+                try:
+                    event = await asyncio.wait_for(subscription.get(), 15)
+                except asyncio.TimeoutError:
+                    yield keepalive
+                    continue
+
+                if not followed or event["bssid"] in followed:
+                    yield format_event(event)
+        finally:
+            events.unsubscribe(subscription)
+
+    response = Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    response.timeout = None
+    return response
+
+@app.get("/api/health")
+async def health():
+    """Endpoint to check the connection to the database.
+    """
+
+    # Ping the database
+    status = await check_health()
+
+    # Return the status, with 503 if the database can't be reached
+    return jsonify(status), 200 if status["ok"] else 503
+
+@app.get("/api/poolmetrics")
+async def poolmetrics():
+    """Endpoint to get the database connection pool metrics.
+    """
+
+    # Return the pool metrics of both clients in json format
+    return jsonify(da.get_pool_metrics())
+
+@app.get("/api/cachemetrics")
+async def cachemetrics():
+    """Endpoint to get the rendered image cache metrics.
+    """
+
+    # Return the cache metrics in json format
+    return jsonify(state["api"].png_cache.metrics())
+
+@app.get("/api/rendermetrics")
+async def rendermetrics():
+    """Endpoint to get the render pool metrics.
+    """
+
+    # Return the render pool metrics in json format
+    return jsonify(state["render_pool"].metrics())
+
+@app.get("/api/watchmetrics")
+async def watchmetrics():
+    """Endpoint to get the change watcher and event metrics.
+    """
+
+    # Return the watcher metrics in json format
+    return jsonify({
+        **state["api"].watch_metrics(),
+        "stats": state["stats_updater"].metrics(),
+        "geo": state["geo_updater"].metrics()
+    })
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--docker', action="store_true", default=False, dest="docker")
+    parser.add_argument('--bind', default="0.0.0.0:8090")
+    parser.add_argument('--pool-size', type=int, default=50, dest="pool_size")
+    parser.add_argument('--pool-timeout', type=int, default=5000, dest="pool_timeout",
+                        help="Timeout in milliseconds for connecting and waiting on the pool")
+    parser.add_argument('--ensure-indexes', action="store_true", default=False,
+                        dest="ensure_indexes",
+                        help="Create the database indexes and verify the query plans on startup")
+    parser.add_argument('--render-workers', type=int, default=4, dest="render_workers",
+                        help="Number of render worker processes")
+    parser.add_argument('--max-queue', type=int, default=16, dest="max_queue",
+                        help="Render jobs that may wait before requests get 503")
+    parser.add_argument('--incremental-heatmaps', type=int, default=4,
+                        dest="incremental_heatmaps",
+                        help="Heatmaps each render worker keeps to only draw new scans, 0 to disable")
+    parser.add_argument('--backlog', type=int, default=1000,
+                        help="Connections the listening socket queues before they are accepted")
+    parser.add_argument('--cache-size', type=int, default=64, dest="cache_size",
+                        help="Size of the in memory image cache in MB")
+    parser.add_argument('--cache-dir', default=None, dest="cache_dir",
+                        help="Directory for the on disk image cache tier")
+    parser.add_argument('--png-level', type=int, default=ie.settings["png_compress_level"],
+                        dest="png_level", help="PNG compression level from 0 to 9")
+    parser.add_argument('--no-png-palette', action="store_false", default=True,
+                        dest="png_palette", help="Write heatmaps as RGB instead of palette PNGs")
+    parser.add_argument('--webp-quality', type=int, default=ie.settings["webp_quality"],
+                        dest="webp_quality", help="WebP quality from 0 to 100")
+    parser.add_argument('--webp-lossless', action="store_true", default=False,
+                        dest="webp_lossless", help="Write lossless WebP images")
+    parser.add_argument('--jpeg-quality', type=int, default=ie.settings["jpeg_quality"],
+                        dest="jpeg_quality", help="JPEG quality from 0 to 100")
+    parser.add_argument('--watch', action="store_true", default=False,
+                        help="Follow new scans to drop outdated cache entries and send events")
+    parser.add_argument('--poll-interval', type=float, default=2.0, dest="poll_interval",
+                        help="Seconds between polls for new scans without a replica set")
+    parser.add_argument('--prewarm', action="store_true", default=False,
+                        help="Render the dropped heatmaps again when their bssid is scanned")
+    parser.add_argument('--stats-interval', type=float, default=10.0, dest="stats_interval",
+                        help="Longest time in seconds between updates of the bssid statistics and GeoJSON locations")
+    args = parser.parse_args()
+
+    # If in a docker network change the database to mongo for
+    # docker dns resolution over the provided network
+    if args.docker: db_host = "mongo"
+
+    settings.update(
+        pool_size=args.pool_size,
+        pool_timeout=args.pool_timeout,
+        ensure_indexes=args.ensure_indexes,
+        render_workers=args.render_workers,
+        max_queue=args.max_queue,
+        incremental_heatmaps=args.incremental_heatmaps,
+        cache_size=args.cache_size,
+        cache_dir=args.cache_dir,
+        watch=args.watch,
+        poll_interval=args.poll_interval,
+        prewarm=args.prewarm,
+        stats_interval=args.stats_interval
+    )
+
+    # Set the encoder settings, the render workers get a copy when they start
+    ie.configure(
+        png_compress_level=args.png_level,
+        png_palette=args.png_palette,
+        webp_quality=args.webp_quality,
+        webp_lossless=args.webp_lossless,
+        jpeg_quality=args.jpeg_quality
+    )
+
+    # Serve the application with hypercorn
+    config = Config()
+    config.bind = [args.bind]
+    config.backlog = args.backlog
+    asyncio.run(serve(app, config))
@@ -0,0 +1,197 @@
+"""Batch job estimating the location of every access point
+
+Instead of one heatmap request per mac address, this job streams all
+ap_data_frames joined with their data frames in one aggregation sorted by
+mac address. The mac addresses are located in batches by a pool of worker
+processes, and the estimates are bulk written to the ap_locations
+collection as
+
+    {_id: bssid id, location: [latitude, longitude], locator, count,
+     last_number, updated}
+
+Usage:
+    python batch_locate.py --locator pathloss --workers 8
+"""
+
+# Import Modules
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from pymongo import UpdateOne
+from datetime import datetime, timezone
+from typing import Iterator
+import argparse
+import multiprocessing
+import os
+import time
+
+# Import data analysis module and the datapoint container
+import data_analysis as da
+from datapoints import Datapoints
+
+def locate_batch(
+    batch: list[tuple[object, Datapoints]],
+    locator: str
+) -> list[tuple]:
+    """Estimate the location of a batch of mac addresses.
+
+    Args:
+        batch (list[tuple]): Id and Datapoints of each mac address
+        locator (str): Name of the locator in da.locators
+
+    Returns:
+        list[tuple]: Id, estimated latitude and longitude or None, number of
+            datapoints and latest data frame number of each mac address
+    """
+
+    results = []
+    for bssid_id, datapoints in batch:
+        # Scans at -100 dBm carry no weight, so there may be no estimate
+        try:
+            location = da.locate_accesspoint(datapoints, locator)
+        except ValueError:
+            location = None
+
+        results.append((
+            bssid_id,
+            location,
+            len(datapoints),
+            int(datapoints.number.max())
+        ))
+
+    return results
+
+def write_locations(client, results: list[tuple], locator: str) -> None:
+    """Bulk write the estimated locations of a batch.
+
+    Args:
+        client: DB Client
+        results (list[tuple]): Results from locate_batch
+        locator (str): Name of the locator the locations come from
+    """
+
+    updated = datetime.now(timezone.utc)
+    client["scandata"]["ap_locations"].bulk_write([
+        UpdateOne(
+            {"_id": bssid_id},
+            {"$set": {
+                "location": location and list(location),
+                "locator": locator,
+                "count": count,
+                "last_number": last_number,
+                "updated": updated
+            }},
+            upsert=True
+        )
+        for bssid_id, location, count, last_number in results
+    ], ordered=False)
+
+def batches(
+    stream: Iterator[tuple],
+    batch_size: int
+) -> Iterator[list[tuple]]:
+    """Group the streamed mac addresses into batches.
+
+    Args:
+        stream (Iterator[tuple]): Id and Datapoints of each mac address
+        batch_size (int): Number of mac addresses per batch
+
+    Returns:
+        Iterator[list[tuple]]: The batches
+    """
+
+    batch = []
+    for item in stream:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def run(
+    client,
+    locator: str,
+    workers: int,
+    batch_size: int,
+    progress_interval: float
+) -> int:
+    """Locate every mac address and store the estimates.
+
+    At most two batches per worker are in flight, so reading from the
+    database waits for the workers instead of buffering every datapoint.
+
+    Args:
+        client: DB Client
+        locator (str): Name of the locator in da.locators
+        workers (int): Number of worker processes
+        batch_size (int): Number of mac addresses per batch
+        progress_interval (float): Seconds between progress reports
+
+    Returns:
+        int: Number of mac addresses located
+    """
+
+    total = client["scandata"]["bssid_pool"].estimated_document_count()
+    located, datapoints_read = 0, 0
+    start = last_report = time.perf_counter()
+
+    def report(final: bool = False) -> None:
+        # Print the progress and the throughput so far
+        elapsed = time.perf_counter() - start
+        print(
+            f"{'Done' if final else 'Progress'}: {located}/{total} bssids, "
+            f"{datapoints_read} datapoints in {elapsed:.1f} s, "
+            f"{located / max(elapsed, 1e-9):.1f} bssids/s, "
+            f"{datapoints_read / max(elapsed, 1e-9):.0f} datapoints/s",
+            flush=True
+        )
+
+    # Start the workers from a clean server process instead of forking this
+    # process with its database threads
+    with ProcessPoolExecutor(
+        workers, mp_context=multiprocessing.get_context("forkserver")
+    ) as executor:
+        pending = set()
+        for batch in batches(da.iter_bssid_datapoints(client), batch_size):
+            datapoints_read += sum(len(datapoints) for _, datapoints in batch)
+            pending.add(executor.submit(locate_batch, batch, locator))
+
+            # Wait for a batch to finish when enough are in flight, and
+            # write the finished batches back
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results = future.result()
+                    write_locations(client, results, locator)
+                    located += len(results)
+
+            # Report the progress every progress_interval seconds
+            if time.perf_counter() - last_report >= progress_interval:
+                report()
+                last_report = time.perf_counter()
+
+        # Write the batches that are still running when the stream ends
+        for future in pending:
+            results = future.result()
+            write_locations(client, results, locator)
+            located += len(results)
+
+    report(final=True)
+    return located
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default="localhost")
+    parser.add_argument('--username', default="root")
+    parser.add_argument('--password', default="password")
+    parser.add_argument('--locator', default="centroid", choices=da.locators.keys())
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help="Number of worker processes")
+    parser.add_argument('--batch-size', type=int, default=256, dest="batch_size",
+                        help="Mac addresses per job sent to a worker")
+    parser.add_argument('--progress', type=float, default=5.0,
+                        help="Seconds between progress reports")
+    args = parser.parse_args()
+
+    db_client = da.client(args.username, args.password, args.host)
+    run(db_client, args.locator, args.workers, args.batch_size, args.progress)
+    da.close_clients()
@@ -0,0 +1,1076 @@
+"""Benchmarks for the data analysis functions
+
+The database benchmarks wipe and seed the scandata database with synthetic
+scans, so they must only be run against a local throwaway mongod, e.g.
+
+    docker run --rm -p 27017:27017 -e MONGO_INITDB_ROOT_USERNAME=root \
+        -e MONGO_INITDB_ROOT_PASSWORD=password mongo
+
+Usage:
+    python benchmark.py datapoints --sizes 10 100 1000
+    python benchmark.py estimate
+    python benchmark.py locators
+    python benchmark.py heatmap
+    python benchmark.py incremental --sizes 100 1000
+    python benchmark.py grid --sizes 1000 100000
+    python benchmark.py projection
+    python benchmark.py tiles --sizes 100 1000
+    python benchmark.py area --sizes 10000 1000000
+    python benchmark.py coverage
+    python benchmark.py encode
+    python benchmark.py apscans --sizes 100000
+    python benchmark.py load --url http://localhost:8090 --paths /api/health
+"""
+
+# Import Modules
+from pymongo import MongoClient, monitoring
+import bson
+from datetime import datetime, timedelta
+from PIL import Image, ImageDraw
+import matplotlib.pyplot as plt
+from math import sqrt
+from io import BytesIO
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import http.client
+import argparse
+import random
+import time
+
+# Import data analysis module and heatmap utilities
+import data_analysis as da
+import heatmap_utils as hu
+from datapoints import Datapoints
+from heatmap_tiles import HeatmapTiles
+from incremental_heatmap import IncrementalHeatmap
+from grid_projection import GridProjection
+import image_encoding as ie
+import render_pool as rp
+from spatial_index import haversine
+
+class RoundTripCounter(monitoring.CommandListener):
+    """Command listener that counts the commands sent to the server.
+
+    If replies is set to a list, the BSON of every reply is added to it.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.replies = None
+
+    def started(self, event):
+        self.count += 1
+
+    def succeeded(self, event):
+        if self.replies is not None:
+            self.replies.append(bson.encode(event.reply))
+
+    def failed(self, event):
+        pass
+
+def bench_client(args: argparse.Namespace) -> tuple[MongoClient, RoundTripCounter]:
+    """Make a client with a round trip counter for the benchmark database.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments
+
+    Returns:
+        tuple[MongoClient, RoundTripCounter]: DB Client and its counter
+    """
+
+    counter = RoundTripCounter()
+    return MongoClient(
+        f"mongodb://{args.username}:{args.password}@{args.host}:27017/",
+        event_listeners=[counter]
+    ), counter
+
+def bssid_name(n: int) -> str:
+    """Get the name of the seeded bssid with n observations.
+
+    Args:
+        n (int): Number of observations
+
+    Returns:
+        str: Mac address
+    """
+
+    return ":".join(f"{b:02x}" for b in n.to_bytes(6, "big"))
+
+def seed(client: MongoClient, sizes: list[int], noise: int = 20) -> None:
+    """Wipe the scandata database and seed it with synthetic scans.
+
+    Every size in sizes gets its own bssid which is seen in that many
+    data frames, each data frame also sees a number of noise access points.
+
+    Args:
+        client (MongoClient): DB Client
+        sizes (list[int]): Number of observations for each seeded bssid
+        noise (int): Number of other access points in each data frame
+    """
+
+    client.drop_database("scandata")
+    db = client["scandata"]
+
+    rng = random.Random(1)
+    ssid_id = db["ssid_pool"].insert_one({"name": "bench"}).inserted_id
+    noise_ids = db["bssid_pool"].insert_many(
+        [{"name": f"noise-{i}", "ssid": ssid_id} for i in range(noise)]
+    ).inserted_ids
+
+    number = 0
+    start = datetime(2023, 1, 1)
+    for size in sizes:
+        bssid_id = db["bssid_pool"].insert_one(
+            {"name": bssid_name(size), "ssid": ssid_id}
+        ).inserted_id
+
+        data_frames = []
+        for _ in range(size):
+            ap_frames = [{"bssid": bssid_id, "rssi": rng.randint(-95, -30)}]
+            ap_frames += [
+                {"bssid": noise_id, "rssi": rng.randint(-95, -30)}
+                for noise_id in noise_ids
+            ]
+            ap_ids = db["ap_data_frames"].insert_many(ap_frames).inserted_ids
+            number += 1
+            data_frames.append({
+                "number": number,
+                "time": start + timedelta(seconds=number),
+                "location": [
+                    57.0 + rng.random() / 100, 9.9 + rng.random() / 100
+                ],
+                "ap_data_frames": ap_ids
+            })
+
+            if len(data_frames) == 1000:
+                db["data_frames"].insert_many(data_frames)
+                data_frames = []
+
+        if data_frames:
+            db["data_frames"].insert_many(data_frames)
+
+    # Index the lookup fields so the old implementation isn't dominated by
+    # collection scans
+    da.ensure_indexes(client)
+
+def measure(counter: RoundTripCounter, func, *args, repeat: int = 3) -> tuple[int, float]:
+    """Measure the round trips and best latency of a function call.
+
+    Args:
+        counter (RoundTripCounter): Counter of the client used by func
+        func: Function to call
+        *args: Arguments for func
+        repeat (int): Number of times to run func
+
+    Returns:
+        tuple[int, float]: Round trips per call and best latency in ms
+    """
+
+    best = float("inf")
+    for _ in range(repeat):
+        counter.count = 0
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+
+    return counter.count, best * 1000
+
+def legacy_get_rssi_location_datapoints(client: MongoClient, bssid: str) -> dict:
+    """The find_one per observation version of get_rssi_location_datapoints.
+
+    Args:
+        client (MongoClient): DB Client
+        bssid (str): Mac Address to get datapoints for
+
+    Returns:
+        dict: RSSI and Location datapoints
+    """
+
+    db = client["scandata"]
+    data_frames, ap_data_frames, bssid_pool = (db["data_frames"],
+                                               db["ap_data_frames"],
+                                               db["bssid_pool"])
+    bssid_id = bssid_pool.find_one({"name": bssid})["_id"]
+    ids = [doc["_id"] for doc in ap_data_frames.find({"bssid": bssid_id})]
+
+    datapoints = {"rssi": [], "location": [], "number": [], "time": []}
+    for ap_data_frames_id in ids:
+        datapoints["rssi"].append(
+            ap_data_frames.find_one({"_id": ap_data_frames_id})["rssi"]
+        )
+        for key in ("location", "number", "time"):
+            datapoints[key].append(
+                data_frames.find_one({"ap_data_frames": ap_data_frames_id})[key]
+            )
+
+    return datapoints
+
+def bench_datapoints(args: argparse.Namespace) -> None:
+    """Compare round trips and latency of get_rssi_location_datapoints.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments
+    """
+
+    client, counter = bench_client(args)
+    if args.seed:
+        seed(client, args.sizes)
+
+    print(f"{'n':>8} {'old trips':>10} {'old ms':>10} {'new trips':>10} {'new ms':>10}")
+    for size in args.sizes:
+        bssid = bssid_name(size)
+        old_trips, old_ms = measure(
+            counter, legacy_get_rssi_location_datapoints, client, bssid
+        )
+        new_trips, new_ms = measure(
+            counter, da.get_rssi_location_datapoints, client, bssid
+        )
+        print(f"{size:>8} {old_trips:>10} {old_ms:>10.1f} {new_trips:>10} {new_ms:>10.1f}")
+
+def legacy_estimate_accesspoint_location(rssi_list: list[int], locations_list: list) -> tuple[float, float]:
+    """The pure Python version of estimate_accesspoint_location.
+
+    Args:
+        rssi_list (list[int]): List of rssi measurements
+        locations_list (list): List of locations
+
+    Returns:
+        tuple[float, float]: Estimated latitude and longitude
+    """
+
+    signal_strengths = [100+rssi for rssi in rssi_list]
+    signal_ratios = [
+        signal_strength/sum(signal_strengths)
+        for signal_strength in signal_strengths
+    ]
+
+    longitude = 0
+    latitude = 0
+    for location, signal_ratio in zip(locations_list, signal_ratios):
+        longitude += location[1] * signal_ratio
+        latitude += location[0] * signal_ratio
+
+    return (round(latitude,6), round(longitude, 6))
+
+def synthetic_datapoints(n: int, seed: int = 1) -> Datapoints:
+    """Make random datapoints around a point without a database.
+
+    Args:
+        n (int): Number of datapoints
+        seed (int): Random seed
+
+    Returns:
+        Datapoints: The datapoints
+    """
+
+    rng = np.random.default_rng(seed)
+    return Datapoints(
+        57.0 + rng.random(n) / 100,
+        9.9 + rng.random(n) / 100,
+        rng.integers(-95, -30, n),
+        np.arange(n),
+        np.datetime64("2023-01-01") + np.arange(n).astype("timedelta64[s]")
+    )
+
+def bench_estimate(args: argparse.Namespace) -> None:
+    """Compare estimate_accesspoint_location for n from 10 to 10^6.
+
+    The quadratic pure Python version is only run up to 10^4 points.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments
+    """
+
+    print(f"{'n':>8} {'old ms':>10} {'new ms':>10} {'same':>6}")
+    for n in (10, 100, 1000, 10**4, 10**5, 10**6):
+        datapoints = synthetic_datapoints(n)
+        start = time.perf_counter()
+        new = da.estimate_accesspoint_location(
+            datapoints.rssi, datapoints.location
+        )
+        new_ms = (time.perf_counter() - start) * 1000
+
+        if n > 10**4:
+            print(f"{n:>8} {'-':>10} {new_ms:>10.3f} {'-':>6}")
+            continue
+
+        rssi, locations = datapoints.rssi.tolist(), datapoints.location.tolist()
+        start = time.perf_counter()
+        old = legacy_estimate_accesspoint_location(rssi, locations)
+        old_ms = (time.perf_counter() - start) * 1000
+        print(f"{n:>8} {old_ms:>10.3f} {new_ms:>10.3f} {str(old == new):>6}")
+
+def synthetic_pathloss_datapoints(n: int, seed: int = 1) -> tuple[tuple[float, float], Datapoints]:
+    """Make datapoints following a path-loss model around a known access point.
+
+    The scans are taken on one side of the access point, like when walking
+    along a building, with 3 dB noise and 5% outliers.
+
+    Args:
+        n (int): Number of datapoints
+        seed (int): Random seed
+
+    Returns:
+        tuple[tuple[float, float], Datapoints]: True location and datapoints
+    """
+
+    rng = np.random.default_rng(seed)
+    ap = (57.0, 9.9)
+
+    # Scan positions in meters, mostly east of the access point
+    x = rng.uniform(-20, 120, n)
+    y = rng.uniform(-60, 60, n)
+    d = np.maximum(np.hypot(x, y), 1.0)
+    rssi = -40 - 10 * 2.7 * np.log10(d) + rng.normal(0, 3, n)
+    outliers = rng.random(n) < 0.05
+    rssi[outliers] += rng.uniform(-25, 25, outliers.sum())
+
+    return ap, Datapoints(
+        ap[0] + y / 110540.0,
+        ap[1] + x / (111320.0 * np.cos(np.radians(ap[0]))),
+        np.clip(np.round(rssi), -99, -1),
+        np.arange(n),
+        np.datetime64("2023-01-01") + np.arange(n).astype("timedelta64[s]")
+    )
+
+def bench_locators(args: argparse.Namespace) -> None:
+    """Compare accuracy and runtime of the access point locators.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments
+    """
+
+    print(f"{'n':>8} {'locator':>10} {'error m':>10} {'ms':>10}")
+    for n in (100, 1000, 10**4, 10**5):
+        ap, datapoints = synthetic_pathloss_datapoints(n)
+        for locator in da.locators:
+            start = time.perf_counter()
+            location = da.locate_accesspoint(datapoints, locator)
+            elapsed = (time.perf_counter() - start) * 1000
+            error = np.hypot(
+                (location[0] - ap[0]) * 110540.0,
+                (location[1] - ap[1]) * 111320.0 * np.cos(np.radians(ap[0]))
+            )
+            print(f"{n:>8} {locator:>10} {error:>10.1f} {elapsed:>10.1f}")
+
+def legacy_draw_heat_circles(im: Image.Image, ap: dict, scans: list[dict]) -> None:
+    """The one ellipse per scan version of hu.draw_heat_circles.
+
+    Args:
+        im (Image.Image): Image to draw on
+        ap (dict): Access Point data
+        scans (list[dict]): List of scan data
+    """
+
+    scan_dists = []
+    for scan in scans:
+        dist = int(
+            sqrt(
+                (ap["coords"][0] - scan["coords"][0])**2 +
+                (ap["coords"][1] - scan["coords"][1])**2
+            )
+        )
+        scan_dists.append((dist, -scan["rssi"]))
+
+    scan_dists.sort(key=lambda x: x[1], reverse=True)
+
+    draw = ImageDraw.Draw(im)
+    for dist in scan_dists:
+        draw.ellipse(
+            [
+                (ap["coords"][0] - dist[0], ap["coords"][1] - dist[0]),
+                (ap["coords"][0] + dist[0], ap["coords"][1] + dist[0])
+            ],
+            fill=hu.getcolor(hu.color_gradient, dist[1])
+        )
+
+def legacy_convert_locations_to_grid(
+    ap_location: tuple[float, float],
+    scan_locations: list[list[float]],
+    isize: int,
+    buffer: int
+) -> tuple[tuple[float, float], list[tuple[float, float]]]:
+    """The min/max with lambdas and per location loop version of da.convert_locations_to_grid.
+
+    Args:
+        ap_location (tuple[float, float]): Location of Access Point
+        scan_locations (list[list[float]]): Locations of scans
+        isize (int): Size of image in pixels
+        buffer (int): Size of outer buffer
+
+    Returns:
+        tuple: Grid coordinates of access point and scans
+    """
+
+    size = isize-buffer*2
+
+    min_longitude = min(min(scan_locations, key = lambda x: x[1])[1], ap_location[1])
+    max_longitude = max(max(scan_locations, key = lambda x: x[1])[1], ap_location[1])
+    min_latitude = max(max(scan_locations, key = lambda x: x[0])[0], ap_location[0])
+    max_latitude = min(min(scan_locations, key = lambda x: x[0])[0], ap_location[0])
+
+    aspect_ratio = abs((max_longitude-min_longitude)/(max_latitude-min_latitude))
+    if aspect_ratio > 1:
+        x_axis = size
+        y_axis = size * aspect_ratio**(-1)
+    else:
+        y_axis = size
+        x_axis = size * aspect_ratio
+
+    x_padding = (y_axis - x_axis) / 2
+    if x_padding < 0: x_padding = 0
+    y_padding = (x_axis - y_axis) / 2
+    if y_padding < 0: y_padding = 0
+
+    def project(location):
+        return (
+            int(abs((location[1] - min_longitude)/(max_longitude-min_longitude))*x_axis)
+            + buffer + x_padding,
+            int(abs((location[0] - min_latitude)/(max_latitude-min_latitude))*y_axis)
+            + buffer + y_padding
+        )
+
+    return project(ap_location), [project(location) for location in scan_locations]
+
+def bench_grid(args: argparse.Namespace) -> None:
+    """Compare the per location projection loop with the grid projection.
+
+    Reports the time of the loop, of building a projection and projecting
+    with it like da.convert_locations_to_grid, and of projecting again with
+    a projection that is reused.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments
+    """
+
+    print(f"{'n':>8} {'old ms':>10} {'new ms':>10} {'reuse ms':>10} {'same':>6}")
+    for n in args.sizes:
+        datapoints = synthetic_datapoints(n)
+        ap_location = da.locate_accesspoint(datapoints)
+        locations = datapoints.location.tolist()
+
+        start = time.perf_counter()
+        old_ap, old_scans = legacy_convert_locations_to_grid(
+            ap_location, locations, 2000, 20
+        )
+        old_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        new_ap, new_scans = da.convert_locations_to_grid(
+            ap_location, datapoints.location, 2000, 20
+        )
+        new_ms = (time.perf_counter() - start) * 1000
+
+        projection = GridProjection.from_locations(
+            datapoints.location, 2000, 20, ap_location
+        )
+        start = time.perf_counter()
+        projection.project(datapoints.location)
+        reuse_ms = (time.perf_counter() - start) * 1000
+
+        same = old_ap == new_ap and np.array_equal(np.array(old_scans), new_scans)
+        print(f"{n:>8} {old_ms:>10.2f} {new_ms:>10.2f} {reuse_ms:>10.2f} "
+              f"{str(same):>6}")
+
+def bench_heatmap(args: argparse.Namespace) -> None:
+    """Compare the raster heat field with drawing one ellipse per scan.
+
+    Renders on the 2000x2100 heatmap image and reports the share of pixels
+    that differ between the two renderers. The scans are spread over the
+    whole image or clustered within 200 pixels of the access point, and the
+    small sizes show the cost of the few scan heatmaps around
+    hu.ellipse_scans.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments
+    """
+
+    rng = np.random.default_rng(1)
+    ap = {"coords": (1000.0, 1000.0)}
+    spreads = {"spread": (20, 1980), "clustered": (800, 1200)}
+
+    print(f"{'scans':>10} {'n':>8} {'old ms':>10} {'new ms':>10} {'diff %':>8}")
+    for layout, n in [
+        (layout, n) for layout in spreads for n in (10, 50, 100, 1000, 10**4)
+    ]:
+        coords = np.trunc(rng.uniform(*spreads[layout], (n, 2)))
+        rssi = rng.integers(-95, -30, n)
+        scans = [
+            {"coords": tuple(c), "rssi": r}
+            for c, r in zip(coords.tolist(), rssi.tolist())
+        ]
+
+        old = hu.make_image(2000, 2000)
+        start = time.perf_counter()
+        legacy_draw_heat_circles(old, ap, scans)
+        old_ms = (time.perf_counter() - start) * 1000
+
+        new = hu.make_image(2000, 2000)
+        start = time.perf_counter()
+        hu.draw_heat_circles(new, ap, scans)
+        new_ms = (time.perf_counter() - start) * 1000
+
+        diff = (np.asarray(old) != np.asarray(new)).any(axis=2).mean() * 100
+        print(f"{layout:>10} {n:>8} {old_ms:>10.1f} {new_ms:>10.1f} {diff:>8.3f}")
+
+def bench_incremental(args: argparse.Namespace) -> None:
+    """Compare rendering a heatmap from scratch with rendering it incrementally.
+
+    Each size is rendered once, then 5 scans inside the bounds are added to
+    it. The incremental heatmap only draws the new scans if the estimated
+    access point stays on the same pixel, otherwise it also computes the
+    heat field again. Reports the largest change of a color channel against
+    the heatmap rendered from scratch.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments
+    """
+
+    print(f"{'n':>8} {'full ms':>10} {'inc ms':>10} {'field':>8} {'max diff':>8}")
+    for n in args.sizes:
+        datapoints = synthetic_datapoints(n + 5)
+        before = datapoints.take(np.arange(n))
+        heatmap = IncrementalHeatmap(2000, 20)
+        heatmap.render(da.locate_accesspoint(before), before)
+
+        # Render the datapoints with the new scans both ways
+        ap_location = da.locate_accesspoint(datapoints)
+        ap_coords = heatmap.ap_coords
+        start = time.perf_counter()
+        full = da.generate_heatmap(ap_location, datapoints, 2000, 20)
+        full_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        incremental = heatmap.render(ap_location, datapoints)
+        incremental_ms = (time.perf_counter() - start) * 1000
+
+        # Report whether the heat field was merged or computed again
+        field = "merged" if heatmap.ap_coords == ap_coords else "new"
+        diff = np.abs(
+            np.asarray(full, dtype=np.int16) - np.asarray(incremental, dtype=np.int16)
+        ).max()
+        print(f"{n:>8} {full_ms:>10.1f} {incremental_ms:>10.1f} {field:>8} "
+              f"{diff:>8}")
+
+def bench_tiles(args: argparse.Namespace) -> None:
+    """Compare rendering the single image heatmap with rendering tiles.
+
+    The tiles of zoom 3 cover the same 2048 pixel heatmap, so all of them
+    stitched together are checked to be the same as the single image. With
+    up to hu.ellipse_scans scans the single image draws its circles as
+    ellipses, whose edges differ from the rasterised tiles by a pixel.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments
+    """
+
+    print(f"{'n':>8} {'image ms':>10} {'layer ms':>10} {'tile z0 ms':>10} "
+          f"{'tile z3 ms':>10} {'tile z8 ms':>10} {'diff px':>8}")
+    for n in args.sizes:
+        datapoints = synthetic_datapoints(n)
+        ap_location = da.estimate_accesspoint_location(
+            datapoints.rssi, datapoints.location
+        )
+
+        # Render the single image at the size of zoom 3
+        start = time.perf_counter()
+        image = da.generate_heatmap(ap_location, datapoints, 2048, 20)
+        image_ms = (time.perf_counter() - start) * 1000
+
+        # Build the zoom 3 layer, then render and stitch all of its tiles
+        tiles = HeatmapTiles(ap_location, datapoints)
+        start = time.perf_counter()
+        tiles.layer(3)
+        layer_ms = (time.perf_counter() - start) * 1000
+
+        stitched = Image.new("RGB", (2048, 2048))
+        start = time.perf_counter()
+        for x in range(8):
+            for y in range(8):
+                stitched.paste(tiles.render_tile(3, x, y), (x * 256, y * 256))
+        z3_ms = (time.perf_counter() - start) * 1000 / 64
+
+        # Time a tile zoomed all the way out and one zoomed all the way in
+        # next to the access point
+        start = time.perf_counter()
+        tiles.render_tile(0, 0, 0)
+        z0_ms = (time.perf_counter() - start) * 1000
+
+        ap_x, ap_y = tiles.layer(8).ap_coords
+        start = time.perf_counter()
+        tiles.render_tile(8, int(ap_x // 256), int(ap_y // 256))
+        z8_ms = (time.perf_counter() - start) * 1000
+
+        diff = (
+            np.asarray(image.crop((0, 0, 2048, 2048))) != np.asarray(stitched)
+        ).any(axis=2).sum()
+        print(f"{n:>8} {image_ms:>10.1f} {layer_ms:>10.1f} {z0_ms:>10.1f} "
+              f"{z3_ms:>10.1f} {z8_ms:>10.1f} {diff:>8}")
+
+def bench_area(args: argparse.Namespace) -> None:
+    """Compare area queries on the spatial index with masking every point.
+
+    Queries 100 random 200 m bounding boxes and radii over datapoints spread
+    over about 1 km and checks that both give the same points.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments
+    """
+
+    rng = np.random.default_rng(1)
+
+    print(f"{'n':>8} {'index ms':>10} {'bbox old us':>12} {'bbox new us':>12} "
+          f"{'radius old us':>14} {'radius new us':>14}")
+    for n in args.sizes:
+        datapoints = synthetic_datapoints(n)
+        latitudes, longitudes = datapoints.latitude, datapoints.longitude
+
+        # Build the spatial index
+        start = time.perf_counter()
+        index = datapoints.geo_index
+        index_ms = (time.perf_counter() - start) * 1000
+
+        centers = np.column_stack((
+            rng.uniform(latitudes.min(), latitudes.max(), 100),
+            rng.uniform(longitudes.min(), longitudes.max(), 100)
+        )).tolist()
+        span = 0.0009
+
+        times = {"bbox old": 0, "bbox new": 0, "radius old": 0, "radius new": 0}
+        for latitude, longitude in centers:
+            box = (latitude - span, longitude - span, latitude + span, longitude + span)
+
+            start = time.perf_counter()
+            old = np.nonzero(
+                (latitudes >= box[0]) & (latitudes <= box[2])
+                & (longitudes >= box[1]) & (longitudes <= box[3])
+            )[0]
+            times["bbox old"] += time.perf_counter() - start
+            start = time.perf_counter()
+            new = index.bbox(*box)
+            times["bbox new"] += time.perf_counter() - start
+            assert np.array_equal(old, new)
+
+            start = time.perf_counter()
+            old = np.nonzero(
+                haversine(latitude, longitude, latitudes, longitudes) <= 100
+            )[0]
+            times["radius old"] += time.perf_counter() - start
+            start = time.perf_counter()
+            new = index.radius(latitude, longitude, 100)
+            times["radius new"] += time.perf_counter() - start
+            assert np.array_equal(old, new)
+
+        us = {name: value / len(centers) * 10**6 for name, value in times.items()}
+        print(f"{n:>8} {index_ms:>10.1f} {us['bbox old']:>12.1f} "
+              f"{us['bbox new']:>12.1f} {us['radius old']:>14.1f} "
+              f"{us['radius new']:>14.1f}")
+
+def bench_coverage(args: argparse.Namespace) -> None:
+    """Compare one heatmap per access point with the combined coverage heatmap.
+
+    Each access point of the network gets 500 synthetic datapoints. The old
+    way estimates and renders every access point on its own, the new way
+    estimates all of them at once and renders one combined image.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments
+    """
+
+    print(f"{'aps':>8} {'old est ms':>10} {'new est ms':>10} {'same':>6} "
+          f"{'old img ms':>10} {'new img ms':>10}")
+    for count in (2, 8, 32):
+        # Give each access point its own random scans, shifted east so the
+        # access points are spread out
+        parts = []
+        for i in range(count):
+            part = synthetic_datapoints(500, i)
+            parts.append(Datapoints(
+                part.latitude, part.longitude + i * 0.005, part.rssi,
+                part.number, part.time
+            ))
+        datapoints = Datapoints(*(
+            np.concatenate([getattr(part, column) for part in parts])
+            for column in ("latitude", "longitude", "rssi", "number", "time")
+        ))
+        groups = np.repeat(np.arange(count), 500)
+        names = [f"00:00:00:00:00:{i:02x}" for i in range(count)]
+
+        # Estimate the access point locations one at a time and all at once
+        start = time.perf_counter()
+        old = [da.locate_accesspoint(part) for part in parts]
+        old_estimate_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        new = da.locate_accesspoints(datapoints, groups, count)
+        new_estimate_ms = (time.perf_counter() - start) * 1000
+        same = np.allclose(np.array(old), new)
+
+        # Render a heatmap per access point and one combined heatmap
+        start = time.perf_counter()
+        for location, part in zip(old, parts):
+            da.generate_heatmap(location, part, 2000, 20)
+        old_image_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        da.generate_coverage_heatmap(names, new, datapoints, groups, 2000, 20)
+        new_image_ms = (time.perf_counter() - start) * 1000
+
+        print(f"{count:>8} {old_estimate_ms:>10.1f} {new_estimate_ms:>10.1f} "
+              f"{str(same):>6} {old_image_ms:>10.1f} {new_image_ms:>10.1f}")
+
+def bench_encode(args: argparse.Namespace) -> None:
+    """Compare encode time and size of the image formats and settings.
+
+    Encodes a heatmap with 1000 labelled scans, a server mode coverage
+    heatmap and an rssi graph, and reports the largest change of a color
+    channel after decoding.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments
+    """
+
+    # Render the images to encode
+    datapoints = synthetic_datapoints(1000)
+    heatmap = da.generate_heatmap(
+        da.locate_accesspoint(datapoints), datapoints, 2000, 20
+    )
+    groups = np.arange(len(datapoints)) % 4
+    coverage = da.generate_coverage_heatmap(
+        list("abcd"),
+        da.locate_accesspoints(datapoints, groups, 4),
+        datapoints, groups, 2000, 20, "server"
+    )
+    rp.render_graph([
+        {
+            "_id": datetime(2023, 1, 1) + timedelta(hours=i),
+            "min": -80 + i % 7, "mean": -70 + i % 5, "max": -60 + i % 3
+        }
+        for i in range(200)
+    ], "bssid")
+    canvas = rp.worker_state["graphs"]["bssid"]["canvas"]
+    graph = Image.frombuffer(
+        "RGBA", canvas.get_width_height(), canvas.buffer_rgba(),
+        "raw", "RGBA", 0, 1
+    ).copy()
+
+    # Formats and settings to compare, the first is how images were
+    # encoded before
+    options = [
+        ("png 6 rgb", "png", {"png_compress_level": 6, "png_palette": False}),
+        ("png 1 rgb", "png", {"png_compress_level": 1, "png_palette": False}),
+        ("png 3 rgb", "png", {"png_compress_level": 3, "png_palette": False}),
+        ("png 9 rgb", "png", {"png_compress_level": 9, "png_palette": False}),
+        ("png 1 palette", "png", {"png_compress_level": 1}),
+        ("png 3 palette", "png", {"png_compress_level": 3}),
+        ("png 6 palette", "png", {"png_compress_level": 6}),
+        ("webp lossy m0", "webp", {"webp_method": 0}),
+        ("webp lossy m4", "webp", {"webp_method": 4}),
+        ("webp lossless m0", "webp", {"webp_lossless": True, "webp_method": 0}),
+        ("jpeg 90", "jpeg", {})
+    ]
+    defaults = dict(ie.settings)
+
+    print(f"{'image':>8} {'option':>18} {'ms':>8} {'KiB':>8} {'max diff':>8}")
+    for name, im in (("heatmap", heatmap), ("coverage", coverage), ("graph", graph)):
+        for option, image_format, changes in options:
+            ie.configure(**{**defaults, **changes})
+            start = time.perf_counter()
+            data = ie.encode_image(im, image_format, palette=name != "graph")
+            elapsed = (time.perf_counter() - start) * 1000
+
+            decoded = Image.open(BytesIO(data)).convert(im.mode)
+            diff = np.abs(
+                np.asarray(decoded, dtype=np.int16) - np.asarray(im, dtype=np.int16)
+            ).max()
+            print(f"{name:>8} {option:>18} {elapsed:>8.1f} "
+                  f"{len(data) / 1024:>8.1f} {diff:>8}")
+
+    ie.configure(**defaults)
+
+def legacy_generate_ssid_overview(client: MongoClient, filterstr: str, filtertype: int) -> dict:
+    """The query per ssid and bssid version of generate_ssid_overview.
+
+    Args:
+        client (MongoClient): DB Client
+        filterstr (str): String to filter by
+        filtertype (int): Type of filter, 0 = ssid, 1 = bssid, 2 = no filter
+
+    Returns:
+        dict: Overview of ssid-bssid connections
+    """
+
+    db = client["scandata"]
+    ssid_bssid = {}
+    for ssid in db["ssid_pool"].find():
+        if filtertype == 2 or (filterstr in ssid["name"] and filtertype == 0) or filtertype == 1:
+            ssid_bssid[ssid["name"]] = [
+                (bssid["name"], len(list(db["ap_data_frames"].find({"bssid": bssid["_id"]}))))
+                for bssid in db["bssid_pool"].find({"ssid": ssid["_id"]})
+                if filtertype == 2 or (filterstr in bssid["name"] and filtertype == 1) or filtertype == 0
+            ]
+
+    return {k: v for k, v in ssid_bssid.items() if v}
+
+def legacy_generate_datapoint_overview(client: MongoClient, bssid: str) -> list[dict]:
+    """The whole document version of generate_datapoint_overview.
+
+    Args:
+        client (MongoClient): DB Client
+        bssid (str): The BSSID to generate datapoints for
+
+    Returns:
+        list[dict]: List of dictionarys containing location, rssi and time
+    """
+
+    db = client["scandata"]
+    bssid_id = db["bssid_pool"].find_one({"name": bssid})["_id"]
+    datapoints = []
+    for ap_data_frame in db["ap_data_frames"].find({"bssid": bssid_id}):
+        data_frame = db["data_frames"].find_one({"ap_data_frames": ap_data_frame["_id"]})
+        datapoints.append({
+            "location": tuple(data_frame["location"]),
+            "rssi": ap_data_frame["rssi"],
+            "time": data_frame["time"]
+        })
+
+    return datapoints
+
+def legacy_generate_graph_of_aps(client: MongoClient) -> list[tuple]:
+    """The whole document queries of generate_graph_of_aps without the plot.
+
+    Args:
+        client (MongoClient): DB Client
+
+    Returns:
+        list[tuple]: Times and number of access points
+    """
+
+    return [
+        (data_frame["time"], len(data_frame["ap_data_frames"]))
+        for data_frame in client["scandata"]["data_frames"].find({})
+    ]
+
+def legacy_get_aps_graph_buckets(client: MongoClient) -> list[dict]:
+    """The aggregation over every data frame version of get_aps_graph_buckets.
+
+    Args:
+        client (MongoClient): DB Client
+
+    Returns:
+        list[dict]: Buckets with _id as time and min, mean and max number
+            of access points
+    """
+
+    data_frames = client["scandata"]["data_frames"]
+    first = data_frames.find_one({}, sort=[("time", 1)])["time"]
+    last = data_frames.find_one({}, sort=[("time", -1)])["time"]
+    unit, bin_size = da.choose_bucket_size(first, last, da.plot_width())
+    return list(data_frames.aggregate([
+        da._bucket_group(unit, bin_size, {"$size": "$ap_data_frames"}),
+        {"$sort": {"_id": 1}}
+    ]))
+
+def bench_apscans(args: argparse.Namespace) -> None:
+    """Compare the aps graph buckets from the database with the time series.
+
+    The time series is timed on its first call, on a call without new data
+    frames and on a call after 100 data frames are added.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments
+    """
+
+    client, counter = bench_client(args)
+    if args.seed:
+        seed(client, args.sizes)
+    data_frames = client["scandata"]["data_frames"]
+
+    def add_data_frames() -> None:
+        # Add data frames after the last one like new scans
+        last = data_frames.find_one({}, sort=[("number", -1)])
+        data_frames.insert_many([
+            {
+                "number": last["number"] + i,
+                "time": last["time"] + timedelta(seconds=i),
+                "location": last["location"],
+                "ap_data_frames": last["ap_data_frames"]
+            }
+            for i in range(1, 101)
+        ])
+
+    print(f"{'call':>12} {'round trips':>12} {'ms':>10}")
+    old_trips, old_ms = measure(counter, legacy_get_aps_graph_buckets, client)
+    print(f"{'database':>12} {old_trips:>12} {old_ms:>10.1f}")
+    for name, prepare in (
+        ("first", lambda: da._aps_series.update(
+            number=0, records=np.empty(0, dtype=da.aps_series_dtype)
+        )),
+        ("unchanged", lambda: None),
+        ("100 new", add_data_frames)
+    ):
+        prepare()
+        counter.count = 0
+        start = time.perf_counter()
+        da.get_aps_graph_buckets(client)
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"{name:>12} {counter.count:>12} {elapsed:>10.1f}")
+
+    same = da.get_aps_graph_buckets(client) == legacy_get_aps_graph_buckets(client)
+    print(f"Same buckets: {same}")
+
+def transfer(counter: RoundTripCounter, func, *args) -> tuple[int, float]:
+    """Measure the reply bytes and BSON decode time of a function call.
+
+    Args:
+        counter (RoundTripCounter): Counter of the client used by func
+        func: Function to call
+        *args: Arguments for func
+
+    Returns:
+        tuple[int, float]: Bytes received and time to decode them in ms
+    """
+
+    counter.replies = []
+    result = func(*args)
+    replies, counter.replies = counter.replies, None
+
+    # Close figures so they don't pile up between the runs
+    if isinstance(result, plt.Figure):
+        plt.close(result)
+
+    start = time.perf_counter()
+    for reply in replies:
+        bson.decode(reply)
+    decode_ms = (time.perf_counter() - start) * 1000
+
+    return sum(len(reply) for reply in replies), decode_ms
+
+def bench_projection(args: argparse.Namespace) -> None:
+    """Compare bytes transferred and decode time per endpoint before and after.
+
+    The before queries fetch whole documents like the original functions,
+    the after queries are the current projected ones.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments
+    """
+
+    client, counter = bench_client(args)
+    if args.seed:
+        seed(client, args.sizes)
+    da.update_bssid_stats(client)
+
+    bssid = bssid_name(max(args.sizes))
+    endpoints = [
+        ("ssidoverview", legacy_generate_ssid_overview,
+         da.generate_ssid_overview, ("", 2)),
+        ("bssiddatapoints", legacy_generate_datapoint_overview,
+         da.generate_datapoint_overview, (bssid,)),
+        ("heatmap", legacy_get_rssi_location_datapoints,
+         da.get_rssi_location_datapoints, (bssid,)),
+        ("apscans", legacy_generate_graph_of_aps,
+         da.generate_graph_of_aps, ())
+    ]
+
+    print(f"{'endpoint':>16} {'old KiB':>10} {'old ms':>8} {'new KiB':>10} {'new ms':>8}")
+    for name, legacy, current, endpoint_args in endpoints:
+        old_bytes, old_ms = transfer(counter, legacy, client, *endpoint_args)
+        new_bytes, new_ms = transfer(counter, current, client, *endpoint_args)
+        print(f"{name:>16} {old_bytes / 1024:>10.1f} {old_ms:>8.1f} "
+              f"{new_bytes / 1024:>10.1f} {new_ms:>8.1f}")
+
+def load_worker(url: str, paths: list[str], requests: int) -> tuple[list[float], dict]:
+    """Send requests to the server over one keep-alive connection.
+
+    Args:
+        url (str): Base url of the server
+        paths (list[str]): Paths to request in turn
+        requests (int): Number of requests to send
+
+    Returns:
+        tuple[list[float], dict]: Latency of every request in milliseconds
+            and the number of responses per status code
+    """
+
+    location = urlsplit(url)
+    connection = http.client.HTTPConnection(location.hostname, location.port)
+    latencies, statuses = [], {}
+
+    for i in range(requests):
+        start = time.perf_counter()
+        connection.request("GET", paths[i % len(paths)])
+        response = connection.getresponse()
+        response.read()
+        latencies.append((time.perf_counter() - start) * 1000)
+        statuses[response.status] = statuses.get(response.status, 0) + 1
+
+    connection.close()
+    return latencies, statuses
+
+def bench_load(args: argparse.Namespace) -> None:
+    """Measure throughput and tail latency of a running API server.
+
+    Run it once against app.py and once against async_app.py with the same
+    paths to compare the two servers under concurrent load.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments
+    """
+
+    print(f"{'clients':>8} {'rps':>10} {'p50 ms':>10} {'p99 ms':>10} statuses")
+    for clients in args.sizes:
+        # Spread the requests over the clients
+        per_client = max(1, args.requests // clients)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(clients) as executor:
+            results = list(executor.map(
+                lambda _: load_worker(args.url, args.paths, per_client),
+                range(clients)
+            ))
+        elapsed = time.perf_counter() - start
+
+        # Combine the latencies and status codes of all clients
+        latencies = np.array([l for result, _ in results for l in result])
+        statuses = {}
+        for _, result in results:
+            for status, count in result.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+        print(f"{clients:>8} {len(latencies) / elapsed:>10.1f} "
+              f"{np.percentile(latencies, 50):>10.1f} "
+              f"{np.percentile(latencies, 99):>10.1f} {statuses}")
+
+# Benchmarks that can be selected on the command line
+benchmarks = {
+    "datapoints": bench_datapoints,
+    "estimate": bench_estimate,
+    "locators": bench_locators,
+    "heatmap": bench_heatmap,
+    "incremental": bench_incremental,
+    "grid": bench_grid,
+    "projection": bench_projection,
+    "tiles": bench_tiles,
+    "area": bench_area,
+    "coverage": bench_coverage,
+    "encode": bench_encode,
+    "apscans": bench_apscans,
+    "load": bench_load
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("benchmark", choices=benchmarks.keys())
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--username", default="root")
+    parser.add_argument("--password", default="password")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--no-seed", action="store_false", dest="seed",
+                        help="Reuse the already seeded database")
+    parser.add_argument("--url", default="http://localhost:8090",
+                        help="Base url of the server for the load benchmark")
+    parser.add_argument("--paths", nargs="+", default=["/api/health"],
+                        help="Paths requested by the load benchmark")
+    parser.add_argument("--requests", type=int, default=1000,
+                        help="Total number of requests per load level")
+    args = parser.parse_args()
+
+    benchmarks[args.benchmark](args)
@@ -0,0 +1,339 @@
+"""Utility classes for caching rendered images and loaded data
+
+The render cache keeps rendered images in memory with an optional tier on
+disk, and the object cache keeps data such as datapoints and tile renderers
+in memory. Entries are keyed by a tuple such as (endpoint, bssid,
+parameters, data version), so a new data version makes a new entry and old
+ones age out. When it is known which entries are outdated, e.g. from the
+change watcher, they can be dropped right away with discard.
+"""
+
+# Import Modules
+from collections import OrderedDict
+import hashlib
+import os
+import threading
+
+class RenderCache:
+    """Size bounded LRU cache of rendered images with an optional disk tier."""
+
+    def __init__(
+        self,
+        max_bytes: int = 64 * 1024 * 1024,
+        disk_dir: str | None = None,
+        max_disk_bytes: int = 1024 * 1024 * 1024
+    ):
+        """Make a render cache.
+
+        Args:
+            max_bytes (int): Maximum size of the images kept in memory
+            disk_dir (str | None): Directory for the disk tier, None to
+                only cache in memory. It is scanned once here and then only
+                changed by this cache
+            max_disk_bytes (int): Maximum size of the images kept on disk
+        """
+
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+
+        self._entries = OrderedDict()
+        self._keys = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        # Size of each file in the disk tier in least recently used order,
+        # so puts don't have to scan the directory
+        self._disk_entries = OrderedDict()
+        self._disk_bytes = 0
+        self.counters = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "disk_evictions": 0
+        }
+
+        if disk_dir is not None:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._scan_disk()
+
+    @staticmethod
+    def etag(key: tuple) -> str:
+        """Get the ETag of a cache key.
+
+        The key contains the data version, so the ETag changes whenever the
+        rendered image would.
+
+        Args:
+            key (tuple): Cache key
+
+        Returns:
+            str: Hex digest of the key
+        """
+
+        return hashlib.sha1(repr(key).encode()).hexdigest()
+
+    def get(self, key: tuple) -> bytes | None:
+        """Get a cached image.
+
+        Args:
+            key (tuple): Cache key
+
+        Returns:
+            bytes | None: The image or None if it isn't cached
+        """
+
+        digest = self.etag(key)
+
+        with self._lock:
+            # Look in memory first and mark the entry as recently used
+            if digest in self._entries:
+                self._entries.move_to_end(digest)
+                self.counters["hits"] += 1
+                return self._entries[digest]
+
+        # Look on disk and move the entry into memory if it's there
+        data = self._read_disk(digest)
+        with self._lock:
+            if data is None:
+                self.counters["misses"] += 1
+                return None
+            self.counters["disk_hits"] += 1
+        self._put_memory(digest, key, data)
+        return data
+
+    def put(self, key: tuple, data: bytes) -> None:
+        """Cache an image.
+
+        Args:
+            key (tuple): Cache key
+            data (bytes): The image
+        """
+
+        digest = self.etag(key)
+        self._put_memory(digest, key, data)
+        self._write_disk(digest, data)
+
+    def discard(self, predicate) -> list[tuple]:
+        """Remove the images in memory whose key matches a predicate.
+
+        Images on disk are left to age out, their keys aren't stored.
+
+        Args:
+            predicate: Function taking a cache key, True to remove the image
+
+        Returns:
+            list[tuple]: Keys of the removed images
+        """
+
+        with self._lock:
+            removed = [
+                (digest, key) for digest, key in self._keys.items()
+                if predicate(key)
+            ]
+            for digest, _ in removed:
+                self._bytes -= len(self._entries.pop(digest))
+                del self._keys[digest]
+            return [key for _, key in removed]
+
+    def clear(self) -> None:
+        """Remove all images from memory."""
+
+        with self._lock:
+            self._entries.clear()
+            self._keys.clear()
+            self._bytes = 0
+
+    def metrics(self) -> dict:
+        """Get the cache metrics.
+
+        Returns:
+            dict: Hit/miss counters, number of entries and bytes in memory
+                and on disk
+        """
+
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "disk": self.disk_dir is not None,
+                "disk_entries": len(self._disk_entries),
+                "disk_bytes": self._disk_bytes,
+                **self.counters
+            }
+
+    def _put_memory(self, digest: str, key: tuple, data: bytes) -> None:
+        # Images larger than the whole cache are not kept in memory
+        if len(data) > self.max_bytes:
+            return
+
+        with self._lock:
+            if digest in self._entries:
+                self._bytes -= len(self._entries.pop(digest))
+            self._entries[digest] = data
+            self._keys[digest] = key
+            self._bytes += len(data)
+
+            # Evict the least recently used images until it fits
+            while self._bytes > self.max_bytes:
+                evicted_digest, evicted = self._entries.popitem(last=False)
+                del self._keys[evicted_digest]
+                self._bytes -= len(evicted)
+                self.counters["evictions"] += 1
+
+    def _scan_disk(self) -> None:
+        # Index the files left by an earlier run, oldest first, and remove
+        # the temporary files of writes that didn't finish
+        files = []
+        for entry in os.scandir(self.disk_dir):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith(".tmp"):
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+                continue
+            stat = entry.stat()
+            files.append((stat.st_mtime, entry.name, stat.st_size))
+
+        for _, digest, size in sorted(files):
+            self._disk_entries[digest] = size
+            self._disk_bytes += size
+
+        # Apply the size limit, it may be lower than in the earlier run
+        self._remove_files(self._evict_disk())
+
+    def _read_disk(self, digest: str) -> bytes | None:
+        if self.disk_dir is None:
+            return None
+
+        # Only files in the index are on disk
+        with self._lock:
+            if digest not in self._disk_entries:
+                return None
+
+        path = os.path.join(self.disk_dir, digest)
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+        except OSError:
+            # The file is gone, forget it
+            with self._lock:
+                size = self._disk_entries.pop(digest, None)
+                if size is not None:
+                    self._disk_bytes -= size
+            return None
+
+        # Mark the file as recently used, and touch it so the order survives
+        # a restart
+        with self._lock:
+            if digest in self._disk_entries:
+                self._disk_entries.move_to_end(digest)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def _write_disk(self, digest: str, data: bytes) -> None:
+        if self.disk_dir is None:
+            return
+
+        # Write to a temporary file first so readers never see half an image
+        path = os.path.join(self.disk_dir, digest)
+        temporary = f"{path}.{threading.get_ident()}.tmp"
+        with open(temporary, "wb") as file:
+            file.write(data)
+        os.replace(temporary, path)
+
+        # Add the file to the index as the most recently used
+        with self._lock:
+            self._disk_bytes -= self._disk_entries.pop(digest, 0)
+            self._disk_entries[digest] = len(data)
+            self._disk_bytes += len(data)
+            evicted = self._evict_disk()
+
+        self._remove_files(evicted)
+
+    def _evict_disk(self) -> list[str]:
+        # Take the least recently used files out of the index until the disk
+        # tier fits, the caller removes them outside the lock
+        evicted = []
+        while self._disk_bytes > self.max_disk_bytes:
+            digest, size = self._disk_entries.popitem(last=False)
+            self._disk_bytes -= size
+            self.counters["disk_evictions"] += 1
+            evicted.append(digest)
+        return evicted
+
+    def _remove_files(self, digests: list[str]) -> None:
+        for digest in digests:
+            try:
+                os.remove(os.path.join(self.disk_dir, digest))
+            except OSError:
+                continue
+
+class ObjectCache:
+    """LRU cache of Python objects with a maximum number of entries."""
+
+    def __init__(self, max_entries: int = 16):
+        """Make an object cache.
+
+        Args:
+            max_entries (int): Number of objects to keep
+        """
+
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple):
+        """Get a cached object.
+
+        Args:
+            key (tuple): Cache key including the data version
+
+        Returns:
+            The object or None if it isn't cached
+        """
+
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: tuple, value) -> None:
+        """Cache an object.
+
+        Args:
+            key (tuple): Cache key including the data version
+            value: The object
+        """
+
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+
+            # Evict the least recently used objects until it fits
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, predicate) -> list[tuple]:
+        """Remove the objects whose key matches a predicate.
+
+        Args:
+            predicate: Function taking a cache key, True to remove the object
+
+        Returns:
+            list[tuple]: Keys of the removed objects
+        """
+
+        with self._lock:
+            removed = [key for key in self._entries if predicate(key)]
+            for key in removed:
+                del self._entries[key]
+            return removed
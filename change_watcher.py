@@ -0,0 +1,394 @@
+"""Background watcher for new scans
+
+The scanner only ever inserts data frames, each with the ids of its
+ap_data_frames. The watcher follows these inserts with a MongoDB change
+stream on data_frames, which needs a replica set (a single node replica set
+is enough). On a standalone server it falls back to polling for data frames
+with a number above the last one seen. For every batch of new data frames
+it finds the mac addresses that were scanned and calls its listeners, which
+drop or refresh the cached results of only those mac addresses.
+
+The background updater runs slower updates such as the bssid statistics and
+the GeoJSON locations outside the requests, when the watcher reports new
+scans or at an interval. The event broadcaster passes the updates on to the
+clients following them, e.g. over server-sent events.
+"""
+
+# Import Modules
+from pymongo.errors import OperationFailure, PyMongoError
+import asyncio
+import json
+import logging
+import queue
+import threading
+
+# Import data analysis module
+import data_analysis as da
+
+# Error code of a change stream on a server that isn't a replica set
+not_replica_set = 40573
+
+logger = logging.getLogger(__name__)
+
+class ChangeWatcher:
+    """Thread following new data frames and reporting the scanned mac addresses."""
+
+    def __init__(
+        self,
+        client,
+        poll_interval: float = 2.0,
+        batch_size: int = 1000,
+        change_stream: bool = True
+    ):
+        """Make a change watcher.
+
+        Args:
+            client: DB Client, used from the watcher thread
+            poll_interval (float): Seconds between polls, and the longest a
+                change stream waits before handing over a batch
+            batch_size (int): Maximum number of data frames per batch
+            change_stream (bool): Whether to try a change stream before
+                falling back to polling
+        """
+
+        self.client = client
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.mode = "change_stream" if change_stream else "polling"
+
+        # Number of the latest data frame reported to the listeners
+        self.last_number = 0
+
+        self._listeners = []
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.counters = {"batches": 0, "data_frames": 0, "bssids": 0, "errors": 0}
+
+    def subscribe(self, listener) -> None:
+        """Add a listener for scanned mac addresses.
+
+        Args:
+            listener: Function taking the number of the latest data frame and
+                the list of mac addresses seen since the previous call, it
+                runs in the watcher thread
+        """
+
+        self._listeners.append(listener)
+
+    @property
+    def running(self) -> bool:
+        """Whether the watcher thread is running."""
+
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """Start following new data frames from the latest one."""
+
+        if self.running:
+            return
+
+        # Only data frames added from now on are reported
+        self.last_number = da.get_data_version(self.client)
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="change-watcher", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the watcher thread and wait for it."""
+
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def metrics(self) -> dict:
+        """Get the watcher metrics.
+
+        Returns:
+            dict: Mode, latest data frame number and counters
+        """
+
+        with self._lock:
+            return {
+                "running": self.running,
+                "mode": self.mode,
+                "last_number": self.last_number,
+                **self.counters
+            }
+
+    def _count(self, counter: str, amount: int = 1) -> None:
+        with self._lock:
+            self.counters[counter] += amount
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                if self.mode == "change_stream":
+                    self._watch()
+                else:
+                    self._poll()
+            except OperationFailure as e:
+                # Poll from now on if the server can't open change streams
+                if e.code == not_replica_set:
+                    logger.info("No replica set, polling for new data frames")
+                    self.mode = "polling"
+                    continue
+                self._count("errors")
+                logger.warning("Watching data frames failed: %s", e)
+                self._stop.wait(self.poll_interval)
+            except PyMongoError as e:
+                # Retry after the poll interval, the stream is opened again
+                # and catches up on what it missed
+                self._count("errors")
+                logger.warning("Watching data frames failed: %s", e)
+                self._stop.wait(self.poll_interval)
+
+    def _catch_up(self) -> int:
+        # Report the data frames after the last one seen in batches
+        frames = da.get_new_data_frames(
+            self.client, self.last_number, self.batch_size
+        )
+        if frames:
+            self._notify(frames)
+        return len(frames)
+
+    def _poll(self) -> None:
+        # Wait for the next poll unless there may be more new data frames
+        if self._catch_up() < self.batch_size:
+            self._stop.wait(self.poll_interval)
+
+    def _watch(self) -> None:
+        # Open the stream before catching up so no insert falls in between,
+        # the data frames seen twice are skipped by their number
+        with self.client["scandata"]["data_frames"].watch(
+            [{"$match": {"operationType": "insert"}}],
+            max_await_time_ms=int(self.poll_interval * 1000)
+        ) as stream:
+            while self._catch_up() == self.batch_size:
+                pass
+
+            while stream.alive and not self._stop.is_set():
+                # Collect the inserts until the stream has to wait for more
+                frames = []
+                while len(frames) < self.batch_size:
+                    change = stream.try_next()
+                    if change is None:
+                        break
+                    frame = change["fullDocument"]
+                    if frame["number"] > self.last_number:
+                        frames.append(frame)
+
+                if frames:
+                    self._notify(frames)
+
+    def _notify(self, frames: list[dict]) -> None:
+        # Find the mac addresses scanned in the new data frames
+        bssids = da.get_scanned_bssids(self.client, [
+            ap_data_frame
+            for frame in frames
+            for ap_data_frame in frame["ap_data_frames"]
+        ])
+        number = max(frame["number"] for frame in frames)
+
+        with self._lock:
+            self.last_number = max(self.last_number, number)
+            self.counters["batches"] += 1
+            self.counters["data_frames"] += len(frames)
+            self.counters["bssids"] += len(bssids)
+
+        # A failing listener must not stop the watcher
+        for listener in self._listeners:
+            try:
+                listener(number, bssids)
+            except Exception:
+                self._count("errors")
+                logger.exception("Change listener failed")
+
+class BackgroundUpdater:
+    """Thread running an update whenever it is triggered or an interval passed."""
+
+    def __init__(self, update, interval: float = 10.0, name: str = "updater"):
+        """Make a background updater.
+
+        Args:
+            update: Function without arguments doing the update, it runs in
+                the updater thread
+            interval (float): Longest time in seconds between updates when
+                nothing triggers one
+            name (str): Name of the thread
+        """
+
+        self.update = update
+        self.interval = interval
+        self.name = name
+
+        self._thread = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self.counters = {"runs": 0, "errors": 0}
+
+    @property
+    def running(self) -> bool:
+        """Whether the updater thread is running."""
+
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """Start the updater thread, it updates right away."""
+
+        if self.running:
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name=self.name, daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the updater thread and wait for it."""
+
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def trigger(self, *_) -> None:
+        """Ask for an update, e.g. as a change watcher listener.
+
+        Triggers while an update runs lead to one more update after it.
+        """
+
+        self._wake.set()
+
+    def metrics(self) -> dict:
+        """Get the updater metrics.
+
+        Returns:
+            dict: Whether it is running and the counters
+        """
+
+        with self._lock:
+            return {"running": self.running, **self.counters}
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.clear()
+
+            # A failing update must not stop the updater
+            try:
+                self.update()
+            except Exception:
+                with self._lock:
+                    self.counters["errors"] += 1
+                logger.exception("Background update %s failed", self.name)
+            with self._lock:
+                self.counters["runs"] += 1
+
+            self._wake.wait(self.interval)
+
+class EventBroadcaster:
+    """Thread safe fan out of events to queues of subscribers."""
+
+    def __init__(self, max_events: int = 256):
+        """Make an event broadcaster.
+
+        Args:
+            max_events (int): Events kept for a subscriber that doesn't read
+                them, newer events are dropped for that subscriber
+        """
+
+        self.max_events = max_events
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self.counters = {"published": 0, "dropped": 0}
+
+    def subscribe(self, loop: asyncio.AbstractEventLoop | None = None):
+        """Add a subscriber.
+
+        Args:
+            loop (asyncio.AbstractEventLoop | None): Event loop of an async
+                subscriber, None for a thread
+
+        Returns:
+            queue.Queue | asyncio.Queue: Queue receiving the events, an
+                asyncio.Queue for an async subscriber
+        """
+
+        events = (
+            asyncio.Queue(self.max_events) if loop is not None
+            else queue.Queue(self.max_events)
+        )
+        with self._lock:
+            self._subscribers[events] = loop
+        return events
+
+    def unsubscribe(self, events) -> None:
+        """Remove a subscriber.
+
+        Args:
+            events (queue.Queue | asyncio.Queue): Queue from subscribe
+        """
+
+        with self._lock:
+            self._subscribers.pop(events, None)
+
+    def publish(self, event: dict) -> None:
+        """Send an event to every subscriber, from any thread.
+
+        Args:
+            event (dict): The event
+        """
+
+        with self._lock:
+            subscribers = list(self._subscribers.items())
+            self.counters["published"] += 1
+
+        for events, loop in subscribers:
+            if loop is None:
+                self._offer(events, event)
+            else:
+                # asyncio queues must be used from their event loop
+                try:
+                    loop.call_soon_threadsafe(self._offer, events, event)
+                except RuntimeError:
+                    self.unsubscribe(events)
+
+    def metrics(self) -> dict:
+        """Get the broadcaster metrics.
+
+        Returns:
+            dict: Number of subscribers and event counters
+        """
+
+        with self._lock:
+            return {"subscribers": len(self._subscribers), **self.counters}
+
+    def _offer(self, events, event: dict) -> None:
+        # Drop the event for a subscriber that fell behind
+        try:
+            events.put_nowait(event)
+        except (queue.Full, asyncio.QueueFull):
+            with self._lock:
+                self.counters["dropped"] += 1
+
+def format_event(event: dict, name: str = "bssid") -> bytes:
+    """Format an event as a server-sent event.
+
+    Args:
+        event (dict): The event, sent as json
+        name (str): Name of the event type
+
+    Returns:
+        bytes: The event in the text/event-stream format
+    """
+
+    return f"event: {name}\ndata: {json.dumps(event)}\n\n".encode()
+
+# Comment line sent to keep idle event streams open through proxies
+keepalive = b": keepalive\n\n"
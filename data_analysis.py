@@ -5,449 +5,2330 @@ This module is primarily used by the flask api application
 """
 
 #Import modules
-from pymongo import MongoClient
+from pymongo import MongoClient, ASCENDING, DESCENDING, GEOSPHERE, UpdateOne
+from pymongo import monitoring
+from bson import ObjectId
+from datetime import datetime, timedelta, timezone
+from typing import Iterator
+from itertools import groupby
+from operator import itemgetter
 import matplotlib
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 from PIL import Image, ImageDraw
 from io import BytesIO
+import numpy as np
+import re
+import threading
+import time
 
-# Import heatmap utilities
+# Import heatmap utilities, the datapoint container and grid projection
 import heatmap_utils as hu
+from datapoints import Datapoints
+from grid_projection import GridProjection
+from spatial_index import earth_radius
 
 # Set the matplotlib to agg to avoid errors when generating images
 # as an headless server
 matplotlib.use("agg")
 
+# Default settings for the shared connection pool, these are passed directly
+# to the MongoClient and can be changed with configure_pool
+pool_settings = {
+    "maxPoolSize": 50,
+    "minPoolSize": 0,
+    "maxIdleTimeMS": 60000,
+    "waitQueueTimeoutMS": 5000,
+    "connectTimeoutMS": 5000,
+    "serverSelectionTimeoutMS": 5000,
+    "socketTimeoutMS": 30000
+}
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Connection pool listener that counts pool events for all clients."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {
+            "pools": 0,
+            "connections_created": 0,
+            "connections_closed": 0,
+            "connections_open": 0,
+            "connections_in_use": 0,
+            "checkouts": 0,
+            "checkout_failures": 0,
+            "pool_clears": 0
+        }
+
+    def _add(self, **changes: int) -> None:
+        # Update the counters under the lock since the events are published
+        # from the request threads and the pymongo monitor threads
+        with self._lock:
+            for key, value in changes.items():
+                self.counters[key] += value
+
+    def snapshot(self) -> dict:
+        """Get a copy of the current counters.
+
+        Returns:
+            dict: Pool counters
+        """
+        with self._lock:
+            return dict(self.counters)
+
+    def pool_created(self, event):
+        self._add(pools=1)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._add(pool_clears=1)
+
+    def pool_closed(self, event):
+        self._add(pools=-1)
+
+    def connection_created(self, event):
+        self._add(connections_created=1, connections_open=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._add(connections_closed=1, connections_open=-1)
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._add(checkout_failures=1)
+
+    def connection_checked_out(self, event):
+        self._add(checkouts=1, connections_in_use=1)
+
+    def connection_checked_in(self, event):
+        self._add(connections_in_use=-1)
+
+# Pool metrics shared by every client made by this module
+pool_metrics = PoolMetrics()
+
+# Shared clients keyed by connection uri, so every caller reuses the same
+# connection pool instead of making a new one per request
+_clients = {}
+_clients_lock = threading.Lock()
+
+def configure_pool(**settings) -> None:
+    """Change the settings used for new shared clients.
+
+    Clients that are already made keep their settings, so this should be
+    called before the first call to client.
+
+    Args:
+        **settings: MongoClient pool and timeout options, e.g. maxPoolSize
+    """
+
+    pool_settings.update(settings)
+
 def client(
     username: str,
     password: str,
     host: str
 ) -> MongoClient:
-    """Make a client to communicate with the database.
+    """Get the shared client to communicate with the database.
+
+    The first call for a set of credentials makes the client, later calls
+    return the same client so the connection pool is reused.
+
+    Args:
+        username (str): DB Username
+        password (str): DB Password
+        host (str): Hostname where the DB is located
+
+    Returns:
+        MongoClient: DB Client
+    """
+
+    uri = f"mongodb://{username}:{password}@{host}:27017/"
+
+    with _clients_lock:
+        # Make the client connection to the database if it doesn't exist yet
+        if uri not in _clients:
+            _clients[uri] = MongoClient(
+                uri,
+                event_listeners=[pool_metrics],
+                **pool_settings
+            )
+
+        # Return the shared client
+        return _clients[uri]
+
+def check_health(client: MongoClient) -> dict:
+    """Check that the database can be reached through the client.
+
+    Args:
+        client (MongoClient): DB Client
+
+    Returns:
+        dict: Health status and ping time in milliseconds
+    """
+
+    start = time.perf_counter()
+
+    try:
+        # Ping the server, this goes through the connection pool
+        client.admin.command("ping")
+    except Exception as e:
+        return {"ok": False, "error": str(e)}
+
+    return {
+        "ok": True,
+        "ping_ms": round((time.perf_counter() - start) * 1000, 3)
+    }
+
+def get_pool_metrics() -> dict:
+    """Get the connection pool metrics and settings.
+
+    Returns:
+        dict: Pool counters, number of shared clients and pool settings
+    """
+
+    return {
+        "clients": len(_clients),
+        "settings": dict(pool_settings),
+        **pool_metrics.snapshot()
+    }
+
+def close_clients() -> None:
+    """Close all shared clients and their connection pools."""
+
+    with _clients_lock:
+        for shared_client in _clients.values():
+            shared_client.close()
+        _clients.clear()
+
+# Indexes needed by the queries in this module as (collection, keys) pairs
+indexes = [
+    # Network lookup by name for the coverage heatmap
+    ("ssid_pool", [("name", ASCENDING)]),
+    # Mac address lookup by name, and the ssid overview join by ssid
+    ("bssid_pool", [("name", ASCENDING)]),
+    ("bssid_pool", [("ssid", ASCENDING), ("name", ASCENDING)]),
+    # Scans of a mac address, rssi is included so the index covers the
+    # rssi projections and counting
+    ("ap_data_frames", [("bssid", ASCENDING), ("rssi", ASCENDING)]),
+    # Pages of the datapoint stream of a mac address in ap_data_frame id
+    # order, so the range and the sort are read from the index
+    ("ap_data_frames", [("bssid", ASCENDING), ("_id", ASCENDING)]),
+    # Multikey index to find the data frame of an ap_data_frame
+    ("data_frames", [("ap_data_frames", ASCENDING)]),
+    # Latest data frame number for the data version
+    ("data_frames", [("number", ASCENDING)]),
+    # Time windows and ranges of the time series graphs
+    ("data_frames", [("time", ASCENDING)]),
+    # Area and nearby queries on the GeoJSON point of the location
+    ("data_frames", [("geo", GEOSPHERE)])
+]
+
+# Query patterns used by this module as (collection, filter, sort) triples,
+# these are explained by verify_query_plans to make sure they use an index
+# and, when sorted, read the order from it
+query_patterns = [
+    ("ssid_pool", {"name": ""}, None),
+    ("bssid_pool", {"name": ""}, None),
+    ("bssid_pool", {"ssid": ObjectId()}, None),
+    ("ap_data_frames", {"bssid": ObjectId()}, None),
+    ("ap_data_frames", {"bssid": ObjectId(), "_id": {"$gt": ObjectId()}},
+     [("_id", ASCENDING)]),
+    ("data_frames", {"ap_data_frames": ObjectId()}, None),
+    ("data_frames", {"number": {"$gt": 0}}, None),
+    ("data_frames", {"time": {"$gte": datetime(1970, 1, 1)}}, None),
+    ("data_frames",
+     {"geo": {"$geoWithin": {"$centerSphere": [[0, 0], 0.0001]}}}, None)
+]
+
+# Fields read by each access path, every query passes its projection so only
+# the needed fields leave MongoDB. Data frames carry the full array of
+# ap_data_frame ids, so they should never be fetched whole.
+projections = {
+    # ssid_pool documents when only the id of a network is needed
+    "ssid_id": {"_id": 1},
+    # bssid_pool documents when only the id of a mac address is needed
+    "bssid_id": {"_id": 1},
+    # ap_data_frames when only the id is needed
+    "ap_data_frame_id": {"_id": 1},
+    # ap_data_frames joined with their data frame
+    "ap_data_frame_scan": {"_id": 0, "bssid": 1, "rssi": 1},
+    # data_frames joined to an ap_data_frame as a datapoint
+    "data_frame_datapoint": {"_id": 0, "location": 1, "number": 1, "time": 1},
+    # data_frames when only the time or number is needed
+    "data_frame_time": {"_id": 0, "time": 1},
+    "data_frame_number": {"_id": 0, "number": 1},
+    # data_frames followed for new scans
+    "data_frame_scans": {"_id": 0, "number": 1, "ap_data_frames": 1},
+    # data_frames found by an area query
+    "data_frame_area": {"_id": 1, "location": 1, "number": 1, "time": 1},
+    # bssid_pool documents when only the mac address is needed
+    "bssid_name": {"_id": 0, "name": 1},
+    # bssid_pool documents when the id and mac address are needed
+    "bssid_id_name": {"_id": 1, "name": 1},
+    # Watermark of the bssid statistics and the claim on it
+    "stats_watermark": {"_id": 0, "number": 1, "claimed": 1,
+                        "claimed_until": 1},
+    # Summary statistics of a mac address
+    "bssid_stats": {"_id": 0, "sum_weight_latitude": 1,
+                    "sum_weight_longitude": 1, "sum_weight": 1, "count": 1,
+                    "sum_rssi": 1, "min_rssi": 1, "max_rssi": 1,
+                    "min_latitude": 1, "max_latitude": 1, "min_longitude": 1,
+                    "max_longitude": 1, "last_seen": 1, "last_number": 1}
+}
+
+def _bssid_id(db, bssid: str) -> ObjectId | None:
+    """Get the DB id of a mac address.
+
+    Args:
+        db: The scandata database
+        bssid (str): Mac Address to get the id of
+
+    Returns:
+        ObjectId | None: The id or None if the mac address doesn't exist
+    """
+
+    bssid_document = db["bssid_pool"].find_one(
+        {"name": bssid}, projections["bssid_id"]
+    )
+    return bssid_document and bssid_document["_id"]
+
+def ensure_indexes(client: MongoClient) -> list[str]:
+    """Create the indexes needed by the queries in this module.
+
+    Creating an index that already exists does nothing, so this is safe to
+    call on every startup.
+
+    Args:
+        client (MongoClient): DB Client
+
+    Returns:
+        list[str]: Names of the indexes
+    """
+
+    # Get database
+    db = client["scandata"]
+
+    # Create all indexes and return their names
+    return [
+        f"{collection}.{db[collection].create_index(keys)}"
+        for collection, keys in indexes
+    ]
+
+def _plan_stages(plan) -> list[str]:
+    """Get all stage names in an explained query plan.
+
+    Args:
+        plan: Query plan or part of one
+
+    Returns:
+        list[str]: Names of the stages
+    """
+
+    stages = []
+
+    # Walk all nested dictionaries and lists of the plan and collect the
+    # stage names
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages += _plan_stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            stages += _plan_stages(value)
+
+    return stages
+
+def verify_query_plans(client: MongoClient) -> dict:
+    """Explain every query pattern and fail if any of them is a COLLSCAN.
+
+    Sorted query patterns also fail if they sort in memory instead of
+    reading the order from the index.
+
+    Args:
+        client (MongoClient): DB Client
+
+    Raises:
+        RuntimeError: If a query pattern does a collection scan or a
+            blocking sort
+
+    Returns:
+        dict: Stages of the winning plan for each query pattern
+    """
+
+    # Get database
+    db = client["scandata"]
+
+    # Explain all query patterns and get the stages of the winning plan
+    plans = {}
+    for collection, query, sort in query_patterns:
+        explanation = db[collection].find(query, sort=sort).explain()
+        name = f"{collection} {list(query)}"
+        if sort:
+            name += f" sort {[key for key, _ in sort]}"
+        plans[name] = _plan_stages(explanation["queryPlanner"]["winningPlan"])
+
+    # Fail if any of the query patterns scan the whole collection
+    collscans = [name for name, stages in plans.items() if "COLLSCAN" in stages]
+    if collscans:
+        raise RuntimeError(
+            f"Query patterns without an index: {', '.join(collscans)}"
+        )
+
+    # Fail if any of the sorted query patterns sort in memory
+    sorts = [name for name, stages in plans.items() if "SORT" in stages]
+    if sorts:
+        raise RuntimeError(
+            f"Query patterns sorted in memory: {', '.join(sorts)}"
+        )
+
+    return plans
+
+def get_data_version(client: MongoClient) -> int:
+    """Get the version of the scan data, the number of the latest data frame.
+
+    Data frames are only ever added, so the version changes whenever new
+    scans arrive.
+
+    Args:
+        client (MongoClient): DB Client
+
+    Returns:
+        int: Number of the latest data frame, 0 if there are none
+    """
+
+    # Get the latest data frame by number using the index
+    latest = client["scandata"]["data_frames"].find_one(
+        {}, projections["data_frame_number"], sort=[("number", -1)]
+    )
+
+    return latest["number"] if latest else 0
+
+def get_bssid_data_version(client: MongoClient, bssid: str) -> int:
+    """Get the version of the scan data of a mac address.
+
+    This is the number of ap_data_frames of the mac address, which only
+    grows when it is seen in new scans.
+
+    Args:
+        client (MongoClient): DB Client
+        bssid (str): Mac Address to get the version for
+
+    Returns:
+        int: Number of scans of the mac address, 0 if it doesn't exist
+    """
+
+    # Get database
+    db = client["scandata"]
+
+    # Grab id of the requested bssid
+    bssid_id = _bssid_id(db, bssid)
+    if bssid_id is None:
+        return 0
+
+    # Count the scans of the bssid using the index
+    return db["ap_data_frames"].count_documents({"bssid": bssid_id})
+
+def get_new_data_frames(
+    client: MongoClient,
+    after: int,
+    limit: int = 1000
+) -> list[dict]:
+    """Get the number and ap_data_frame ids of data frames after a number.
+
+    Args:
+        client (MongoClient): DB Client
+        after (int): Number of the last data frame already seen
+        limit (int): Maximum number of data frames
+
+    Returns:
+        list[dict]: Data frames with number and ap_data_frames in number
+            order
+    """
+
+    return list(
+        client["scandata"]["data_frames"]
+        .find({"number": {"$gt": after}}, projections["data_frame_scans"])
+        .sort("number", ASCENDING)
+        .limit(limit)
+    )
+
+def get_scanned_bssids(client: MongoClient, ap_data_frame_ids: list) -> list[str]:
+    """Get the mac addresses seen in a set of ap_data_frames.
+
+    Args:
+        client (MongoClient): DB Client
+        ap_data_frame_ids (list): Ids of the ap_data_frames
+
+    Returns:
+        list[str]: Mac addresses
+    """
+
+    # Get database
+    db = client["scandata"]
+
+    # Find the ids of the mac addresses of the ap_data_frames and their names
+    bssid_ids = db["ap_data_frames"].distinct(
+        "bssid", {"_id": {"$in": ap_data_frame_ids}}
+    )
+    return [
+        bssid["name"] for bssid in db["bssid_pool"].find(
+            {"_id": {"$in": bssid_ids}}, projections["bssid_name"]
+        )
+    ]
+
+# Lock so only one thread of this process updates the bssid statistics
+_stats_lock = threading.Lock()
+
+# Seconds an updater may hold a claim on data frames before another updater
+# may take them over, e.g. after the first one crashed
+claim_timeout = 600
+
+def _claim_data_frames(client: MongoClient, name: str) -> tuple[int, int] | None:
+    """Claim the data frames added since a watermark in stats_meta.
+
+    The range from the watermark to the latest data frame is claimed with a
+    compare and set on the watermark document, so concurrent updaters never
+    process the same data frames at once. The watermark itself only moves
+    when the updater releases the claim with _release_data_frames after its
+    write succeeded. A claim that isn't released within claim_timeout is
+    taken over with the same range, so the update must be safe to apply
+    twice.
+
+    Args:
+        client (MongoClient): DB Client
+        name (str): Id of the watermark document
+
+    Returns:
+        tuple[int, int] | None: The watermark and the last data frame number
+            of the claimed range, None if there are no new data frames or
+            another updater holds them
+    """
+
+    # Get Collection from database
+    stats_meta = client["scandata"]["stats_meta"]
+
+    # Get the watermark and the claim on it
+    stats_meta.update_one(
+        {"_id": name},
+        {"$setOnInsert": {"number": 0}},
+        upsert=True
+    )
+    meta = stats_meta.find_one({"_id": name}, projections["stats_watermark"])
+    watermark = meta["number"]
+    claimed_until = meta.get("claimed_until")
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+
+    if claimed_until is not None:
+        # Another updater is still working on its range
+        if claimed_until > now:
+            return None
+
+        # Take over the range of an updater that didn't finish, it may have
+        # written part of it
+        latest = meta["claimed"]
+    else:
+        latest = get_data_version(client)
+        if latest <= watermark:
+            return None
+
+    # Claim the range, if another updater claimed it or moved the watermark
+    # first it handles the data frames
+    claimed = stats_meta.update_one(
+        {"_id": name, "number": watermark, "claimed_until": claimed_until},
+        {"$set": {
+            "claimed": latest,
+            "claimed_until": now + timedelta(seconds=claim_timeout)
+        }}
+    ).modified_count
+    if not claimed:
+        return None
+
+    return watermark, latest
+
+def _release_data_frames(
+    client: MongoClient,
+    name: str,
+    watermark: int,
+    latest: int
+) -> None:
+    """Move the watermark past a claimed range once it has been processed.
+
+    Args:
+        client (MongoClient): DB Client
+        name (str): Id of the watermark document
+        watermark (int): Watermark from _claim_data_frames
+        latest (int): Last data frame number of the claimed range
+    """
+
+    # Compare and set, a rebuild may have removed the watermark meanwhile
+    client["scandata"]["stats_meta"].update_one(
+        {"_id": name, "number": watermark, "claimed": latest},
+        {
+            "$set": {"number": latest},
+            "$unset": {"claimed": "", "claimed_until": ""}
+        }
+    )
+
+def update_bssid_stats(client: MongoClient) -> int:
+    """Fold new data frames into the bssid_stats summary collection.
+
+    Only data frames with a number above the watermark stored in the
+    stats_meta collection are aggregated. The range up to the latest data
+    frame is claimed with _claim_data_frames, and the watermark only moves
+    past it once the statistics are written. Every bssid stores the end of
+    the last range folded into it, so a range written partly by a failed
+    update is not counted twice when it is taken over.
+
+    Args:
+        client (MongoClient): DB Client
+
+    Returns:
+        int: Number of bssids whose statistics were updated
+    """
+
+    # Get Collections from database
+    db = client["scandata"]
+    data_frames, bssid_stats = db["data_frames"], db["bssid_stats"]
+
+    with _stats_lock:
+        # Claim the data frames added since the last update
+        claimed = _claim_data_frames(client, "bssid_stats")
+        if claimed is None:
+            return 0
+        watermark, latest = claimed
+
+        # Signal strength used as the weight, like the weighted centroid
+        weight = {"$add": [100, "$ap.rssi"]}
+
+        # Aggregate the new scans of every bssid in the claimed data frames
+        pipeline = [
+            {"$match": {"number": {"$gt": watermark, "$lte": latest}}},
+            {"$project": {
+                "_id": 0,
+                "number": 1,
+                "time": 1,
+                "latitude": {"$arrayElemAt": ["$location", 0]},
+                "longitude": {"$arrayElemAt": ["$location", 1]},
+                "ap_data_frames": 1
+            }},
+            {"$unwind": "$ap_data_frames"},
+            {"$lookup": {
+                "from": "ap_data_frames",
+                "localField": "ap_data_frames",
+                "foreignField": "_id",
+                "pipeline": [{"$project": projections["ap_data_frame_scan"]}],
+                "as": "ap"
+            }},
+            {"$unwind": "$ap"},
+            {"$group": {
+                "_id": "$ap.bssid",
+                "count": {"$sum": 1},
+                "sum_rssi": {"$sum": "$ap.rssi"},
+                "sum_weight": {"$sum": weight},
+                "sum_weight_latitude": {
+                    "$sum": {"$multiply": [weight, "$latitude"]}
+                },
+                "sum_weight_longitude": {
+                    "$sum": {"$multiply": [weight, "$longitude"]}
+                },
+                "min_rssi": {"$min": "$ap.rssi"},
+                "max_rssi": {"$max": "$ap.rssi"},
+                "min_latitude": {"$min": "$latitude"},
+                "max_latitude": {"$max": "$latitude"},
+                "min_longitude": {"$min": "$longitude"},
+                "max_longitude": {"$max": "$longitude"},
+                "last_seen": {"$max": "$time"},
+                "last_number": {"$max": "$number"}
+            }}
+        ]
+
+        # Add the new scans to the statistics of each bssid, unless the
+        # range was already folded into it
+        updates = [
+            UpdateOne(
+                {"_id": group["_id"]},
+                [{"$set": _fold_bssid_stats(group, latest)}],
+                upsert=True
+            )
+            for group in data_frames.aggregate(pipeline, allowDiskUse=True)
+        ]
+        if updates:
+            bssid_stats.bulk_write(updates, ordered=False)
+
+        # Move the watermark past the range now that it is written
+        _release_data_frames(client, "bssid_stats", watermark, latest)
+
+        return len(updates)
+
+def _fold_bssid_stats(group: dict, latest: int) -> dict:
+    """Make the update of a bssid_stats document with the scans of a range.
+
+    Args:
+        group (dict): Statistics of the new scans of the bssid
+        latest (int): Last data frame number of the range
+
+    Returns:
+        dict: Fields of a $set stage, leaving the document unchanged if the
+            range was already folded into it
+    """
+
+    # Whether the statistics already include the range
+    folded = {"$gte": [{"$ifNull": ["$folded", 0]}, latest]}
+
+    def fold(operator: str, key: str) -> dict:
+        value = (
+            {"$add": [{"$ifNull": [f"${key}", 0]}, group[key]]}
+            if operator == "$add"
+            else {operator: [f"${key}", group[key]]}
+        )
+        return {"$cond": [folded, f"${key}", value]}
+
+    return {
+        **{
+            key: fold("$add", key) for key in (
+                "count", "sum_rssi", "sum_weight",
+                "sum_weight_latitude", "sum_weight_longitude"
+            )
+        },
+        **{
+            key: fold("$min", key) for key in (
+                "min_rssi", "min_latitude", "min_longitude"
+            )
+        },
+        **{
+            key: fold("$max", key) for key in (
+                "max_rssi", "max_latitude", "max_longitude",
+                "last_seen", "last_number"
+            )
+        },
+        "folded": {"$max": [{"$ifNull": ["$folded", 0]}, latest]}
+    }
+
+def rebuild_bssid_stats(client: MongoClient) -> int:
+    """Throw away the bssid statistics and aggregate them from scratch.
+
+    Args:
+        client (MongoClient): DB Client
+
+    Returns:
+        int: Number of bssids with statistics
+    """
+
+    # Get database
+    db = client["scandata"]
+
+    # Remove the statistics and the watermark and aggregate everything
+    with _stats_lock:
+        db["bssid_stats"].drop()
+        db["stats_meta"].delete_one({"_id": "bssid_stats"})
+
+    return update_bssid_stats(client)
+
+def get_bssid_stats(client: MongoClient, bssid: str) -> dict | None:
+    """Get the summary statistics of a mac address.
+
+    Args:
+        client (MongoClient): DB Client
+        bssid (str): Mac Address to get statistics for
+
+    Returns:
+        dict | None: Number of scans, rssi range and mean, bounding box,
+            last seen time and weighted centroid location, None if the
+            mac address hasn't been seen
+    """
+
+    # Get database
+    db = client["scandata"]
+
+    # Grab id of the requested bssid and its statistics
+    bssid_id = _bssid_id(db, bssid)
+    if bssid_id is None:
+        return None
+    stats = db["bssid_stats"].find_one(
+        {"_id": bssid_id}, projections["bssid_stats"]
+    )
+    if stats is None:
+        return None
+
+    return bssid_stats_summary(stats)
+
+def bssid_stats_summary(stats: dict) -> dict:
+    """Make the summary of a bssid_stats document.
+
+    Args:
+        stats (dict): bssid_stats document with the bssid_stats projection
+
+    Returns:
+        dict: Number of scans, rssi range and mean, bounding box, last seen
+            time and weighted centroid location
+    """
+
+    # The location is the same weighted centroid as
+    # estimate_accesspoint_location calculates
+    return {
+        "count": stats["count"],
+        "min_rssi": stats["min_rssi"],
+        "max_rssi": stats["max_rssi"],
+        "mean_rssi": round(stats["sum_rssi"] / stats["count"], 2),
+        "bounding_box": (
+            (stats["min_latitude"], stats["min_longitude"]),
+            (stats["max_latitude"], stats["max_longitude"])
+        ),
+        "last_seen": stats["last_seen"],
+        "last_number": stats["last_number"],
+        "location": (
+            round(stats["sum_weight_latitude"] / stats["sum_weight"], 6),
+            round(stats["sum_weight_longitude"] / stats["sum_weight"], 6)
+        ) if stats["sum_weight"] else None
+    }
+
+# Lock so only one thread of this process updates the GeoJSON locations
+_geo_lock = threading.Lock()
+
+def update_geo_locations(client: MongoClient) -> int:
+    """Store the location of new data frames as GeoJSON points.
+
+    Data frames keep their [latitude, longitude] location and get a geo
+    field with a GeoJSON point of [longitude, latitude] for the 2dsphere
+    index. Only the data frames added since the last update are converted,
+    claimed like in update_bssid_stats. Locations outside the valid range
+    can't be indexed and are left without a geo field.
+
+    Args:
+        client (MongoClient): DB Client
+
+    Returns:
+        int: Number of data frames that got a geo field
+    """
+
+    # Get Collection from database
+    data_frames = client["scandata"]["data_frames"]
+
+    with _geo_lock:
+        # Claim the data frames added since the last update
+        claimed = _claim_data_frames(client, "geo_locations")
+        if claimed is None:
+            return 0
+        watermark, latest = claimed
+
+        # Set the GeoJSON point of the claimed data frames in the database,
+        # setting it again is harmless
+        converted = data_frames.update_many(
+            {
+                "number": {"$gt": watermark, "$lte": latest},
+                "location.0": {"$gte": -90, "$lte": 90},
+                "location.1": {"$gte": -180, "$lte": 180}
+            },
+            [{"$set": {"geo": {
+                "type": "Point",
+                "coordinates": [
+                    {"$arrayElemAt": ["$location", 1]},
+                    {"$arrayElemAt": ["$location", 0]}
+                ]
+            }}}]
+        ).modified_count
+
+        # Move the watermark past the range now that it is written
+        _release_data_frames(client, "geo_locations", watermark, latest)
+
+        return converted
+
+def rebuild_geo_locations(client: MongoClient) -> int:
+    """Store the location of every data frame as a GeoJSON point again.
+
+    Args:
+        client (MongoClient): DB Client
+
+    Returns:
+        int: Number of data frames whose geo field changed
+    """
+
+    # Remove the watermark and convert everything
+    with _geo_lock:
+        client["scandata"]["stats_meta"].delete_one({"_id": "geo_locations"})
+
+    return update_geo_locations(client)
+
+def bbox_filter(south: float, west: float, north: float, east: float) -> dict:
+    """Make a filter for the data frames inside a bounding box.
+
+    The edges of the box are great circles on the 2dsphere index, which is
+    the same as lines of latitude and longitude for areas of a few km.
+
+    Args:
+        south (float): Southern latitude
+        west (float): Western longitude
+        north (float): Northern latitude
+        east (float): Eastern longitude
+
+    Returns:
+        dict: Filter for the data_frames collection
+    """
+
+    return {"geo": {"$geoWithin": {"$geometry": {
+        "type": "Polygon",
+        "coordinates": [[
+            [west, south], [east, south], [east, north], [west, north],
+            [west, south]
+        ]]
+    }}}}
+
+def radius_filter(latitude: float, longitude: float, radius: float) -> dict:
+    """Make a filter for the data frames within a distance of a location.
+
+    Args:
+        latitude (float): Latitude of the center
+        longitude (float): Longitude of the center
+        radius (float): Distance in meters
+
+    Returns:
+        dict: Filter for the data_frames collection
+    """
+
+    return {"geo": {"$geoWithin": {
+        "$centerSphere": [[longitude, latitude], radius / earth_radius]
+    }}}
+
+# Area filters by the name of the matching GeoIndex query
+area_filters = {
+    "bbox": bbox_filter,
+    "radius": radius_filter
+}
+
+def iter_scans_in_area(
+    client: MongoClient,
+    area: dict,
+    limit: int | None = None,
+    after: ObjectId | None = None
+) -> Iterator[tuple[ObjectId, dict]]:
+    """Stream the data frames scanned inside an area.
+
+    With a limit the data frames are ordered by id, and the id of the last
+    one can be passed as after to continue with the next page. Only data
+    frames with a geo field are found, so update_geo_locations should be
+    called first to include the latest scans.
+
+    Args:
+        client (MongoClient): DB Client
+        area (dict): Filter from bbox_filter or radius_filter
+        limit (int | None): Maximum number of data frames, None for all
+        after (ObjectId | None): Only data frames with an id after this one
+
+    Returns:
+        Iterator[tuple[ObjectId, dict]]: Id and dictionary with location,
+            number and time of each data frame
+    """
+
+    # Continue after the last data frame of the previous page
+    match = dict(area)
+    if after is not None:
+        match["_id"] = {"$gt": after}
+
+    # Find the data frames in the area using the 2dsphere index
+    cursor = client["scandata"]["data_frames"].find(
+        match, projections["data_frame_area"]
+    )
+    if limit:
+        cursor = cursor.sort("_id", ASCENDING).limit(limit)
+
+    # Yield the location, number and time of every data frame
+    for data_frame in cursor:
+        yield data_frame["_id"], area_row(data_frame)
+
+def area_row(data_frame: dict) -> dict:
+    """Make the row of a data frame found by an area query.
+
+    Args:
+        data_frame (dict): Data frame with the data_frame_area projection
+
+    Returns:
+        dict: Location, number and time of the data frame
+    """
+
+    return {
+        "location": (data_frame["location"][0], data_frame["location"][1]),
+        "number": data_frame["number"],
+        "time": data_frame["time"]
+    }
+
+def nearby_bssids_pipeline(
+    latitude: float,
+    longitude: float,
+    radius: float,
+    limit: int | None = None
+) -> list[dict]:
+    """Make the pipeline for the mac addresses seen near a location.
+
+    Args:
+        latitude (float): Latitude of the location
+        longitude (float): Longitude of the location
+        radius (float): Distance in meters
+        limit (int | None): Maximum number of mac addresses, None for all
+
+    Returns:
+        list[dict]: Aggregation pipeline for the data_frames collection
+    """
+
+    return [
+        # Find the data frames near the location with their distance using
+        # the 2dsphere index
+        {"$geoNear": {
+            "near": {"type": "Point", "coordinates": [longitude, latitude]},
+            "key": "geo",
+            "distanceField": "distance",
+            "maxDistance": radius,
+            "spherical": True
+        }},
+        {"$project": {"_id": 0, "distance": 1, "ap_data_frames": 1}},
+        # Join the scans of every data frame
+        {"$unwind": "$ap_data_frames"},
+        {"$lookup": {
+            "from": "ap_data_frames",
+            "localField": "ap_data_frames",
+            "foreignField": "_id",
+            "pipeline": [{"$project": projections["ap_data_frame_scan"]}],
+            "as": "ap"
+        }},
+        {"$unwind": "$ap"},
+        # Summarise the scans of every mac address, closest first
+        {"$group": {
+            "_id": "$ap.bssid",
+            "scans": {"$sum": 1},
+            "max_rssi": {"$max": "$ap.rssi"},
+            "distance": {"$min": "$distance"}
+        }},
+        {"$sort": {"distance": 1, "_id": 1}},
+        *([{"$limit": limit}] if limit else []),
+        # Join the names of the mac addresses
+        {"$lookup": {
+            "from": "bssid_pool",
+            "localField": "_id",
+            "foreignField": "_id",
+            "pipeline": [{"$project": projections["bssid_name"]}],
+            "as": "bssid"
+        }},
+        {"$unwind": "$bssid"},
+        {"$project": {
+            "_id": 0,
+            "bssid": "$bssid.name",
+            "scans": 1,
+            "max_rssi": 1,
+            "distance": {"$round": ["$distance", 1]}
+        }}
+    ]
+
+def get_nearby_bssids(
+    client: MongoClient,
+    latitude: float,
+    longitude: float,
+    radius: float,
+    limit: int | None = None
+) -> list[dict]:
+    """Get the mac addresses seen near a location.
+
+    Only data frames with a geo field are found, so update_geo_locations
+    should be called first to include the latest scans.
+
+    Args:
+        client (MongoClient): DB Client
+        latitude (float): Latitude of the location
+        longitude (float): Longitude of the location
+        radius (float): Distance in meters
+        limit (int | None): Maximum number of mac addresses, None for all
+
+    Returns:
+        list[dict]: Mac address, number of scans, best rssi and distance in
+            meters of the closest scan, closest first
+    """
+
+    return list(client["scandata"]["data_frames"].aggregate(
+        nearby_bssids_pipeline(latitude, longitude, radius, limit)
+    ))
+
+# Filter types of the ssid overview, 0 = ssid, 1 = bssid, 2 = no filter
+ssid_filter_types = (0, 1, 2)
+
+def ssid_overview_pipeline(
+    filterstr: str,
+    filtertype: int,
+    limit: int | None = None,
+    after: ObjectId | None = None
+) -> list[dict]:
+    """Make the pipeline for the overview of the ssid-bssid connections.
+
+    Args:
+        filterstr (str): String to filter by
+        filtertype (int): Type of filter, 0 = ssid, 1 = bssid, 2 = no filter
+        limit (int | None): Maximum number of ssids, None for all
+        after (ObjectId | None): Only ssids with an id after this one
+
+    Raises:
+        ValueError: If the filter type isn't in ssid_filter_types
+
+    Returns:
+        list[dict]: Aggregation pipeline for the ssid_pool collection
+    """
+
+    if filtertype not in ssid_filter_types:
+        raise ValueError(f"Unknown filter type {filtertype}")
+
+    # Make filters for the ssid and bssid names, these match if the filter
+    # string is contained in the name
+    name_filter = {"name": {"$regex": re.escape(filterstr)}}
+    ssid_filter = name_filter if filtertype == 0 else {}
+    bssid_filter = name_filter if filtertype == 1 else {}
+
+    # Continue after the last ssid of the previous page
+    if after is not None:
+        ssid_filter = {**ssid_filter, "_id": {"$gt": after}}
+
+    # Join every ssid with its filtered mac addresses and the number of
+    # scans from the statistics of each mac address
+    return [
+        {"$match": ssid_filter},
+        *([{"$sort": {"_id": 1}}] if limit or after is not None else []),
+        {"$lookup": {
+            "from": "bssid_pool",
+            "localField": "_id",
+            "foreignField": "ssid",
+            "pipeline": [
+                {"$match": bssid_filter},
+                {"$lookup": {
+                    "from": "bssid_stats",
+                    "localField": "_id",
+                    "foreignField": "_id",
+                    "pipeline": [{"$project": {"_id": 0, "n": "$count"}}],
+                    "as": "scans"
+                }},
+                {"$project": {
+                    "_id": 0,
+                    "name": 1,
+                    "scans": {
+                        "$ifNull": [{"$arrayElemAt": ["$scans.n", 0]}, 0]
+                    }
+                }}
+            ],
+            "as": "bssids"
+        }},
+        # Remove all ssids that doesn't have at least one mac address
+        {"$match": {"bssids": {"$ne": []}}},
+        *([{"$limit": limit}] if limit else []),
+        {"$project": {"_id": 1, "name": 1, "bssids": 1}}
+    ]
+
+def iter_ssid_overview(
+    client: MongoClient,
+    filterstr: str,
+    filtertype: int,
+    limit: int | None = None,
+    after: ObjectId | None = None
+) -> Iterator[tuple[ObjectId, str, list[tuple[str, int]]]]:
+    """Stream the overview of the ssid-bssid connections one ssid at a time.
+
+    The ssids are read from the database cursor as they are yielded. With a
+    limit the ssids are ordered by id, and the id of the last ssid can be
+    passed as after to continue with the next page.
+
+    Args:
+        client (MongoClient): DB Client
+        filterstr (str): String to filter by
+        filtertype (int): Type of filter, 0 = ssid, 1 = bssid, 2 = no filter
+        limit (int | None): Maximum number of ssids, None for all
+        after (ObjectId | None): Only ssids with an id after this one
+
+    Raises:
+        ValueError: If the filter type isn't in ssid_filter_types
+
+    Returns:
+        Iterator[tuple[ObjectId, str, list[tuple[str, int]]]]: Id and name
+            of each ssid with its mac addresses and number of scans
+    """
+
+    # Get Collections from database
+    db = client["scandata"]
+    ssid_pool = db["ssid_pool"]
+
+    # Yield every ssid with a list of mac addresses and number of scans
+    for ssid in ssid_pool.aggregate(
+        ssid_overview_pipeline(filterstr, filtertype, limit, after)
+    ):
+        yield ssid_overview_row(ssid)
+
+def ssid_overview_row(ssid: dict) -> tuple[ObjectId, str, list[tuple[str, int]]]:
+    """Make the row of an ssid from the ssid overview pipeline.
+
+    Args:
+        ssid (dict): Document from ssid_overview_pipeline
+
+    Returns:
+        tuple[ObjectId, str, list[tuple[str, int]]]: Id and name of the ssid
+            with its mac addresses and number of scans
+    """
+
+    return ssid["_id"], ssid["name"], [
+        (bssid["name"], bssid["scans"]) for bssid in ssid["bssids"]
+    ]
+
+def generate_ssid_overview(
+    client: MongoClient,
+    filterstr: str,
+    filtertype: int
+) -> dict:
+    """Get an overview of the ssid-bssid connections.
+
+    The number of scans is read from the bssid_stats collection, so
+    update_bssid_stats should be called first to include the latest scans.
+
+    Args:
+        client (MongoClient): DB Client
+        filterstr (str): String to filter by
+        filtertype (int): Type of filter, 0 = ssid, 1 = bssid, 2 = no filter
+
+    Raises:
+        ValueError: If the filter type isn't in ssid_filter_types
+
+    Returns:
+        dict: Overview of ssid-bssid connections
+    """
+
+    # Make dictionary of ssid names to lists of mac addresses and number of
+    # scans and return it
+    return {
+        name: bssids
+        for _, name, bssids in iter_ssid_overview(client, filterstr, filtertype)
+    }
+
+def iter_datapoint_overview(
+    client: MongoClient,
+    bssid: str,
+    limit: int | None = None,
+    after: ObjectId | None = None,
+    area: dict | None = None
+) -> Iterator[tuple[ObjectId, dict]]:
+    """Stream the datapoints of a mac address one at a time.
+
+    The datapoints are read from the database cursor as they are yielded.
+    With a limit the datapoints are ordered by ap_data_frame id, and the id
+    of the last datapoint can be passed as after to continue with the next
+    page.
+
+    Args:
+        client (MongoClient): Client to connect to the DB
+        bssid (str): The BSSID to generate datapoints for
+        limit (int | None): Maximum number of datapoints, None for all
+        after (ObjectId | None): Only datapoints with an id after this one
+        area (dict | None): Filter from bbox_filter or radius_filter to only
+            get the datapoints scanned inside an area
+
+    Returns:
+        Iterator[tuple[ObjectId, dict]]: Ap_data_frame id and dictionary
+            containing location, rssi and time of each datapoint
+    """
+
+    # Get database
+    db = client["scandata"]
+
+    # Get DB id of the bssid
+    bssid_id = _bssid_id(db, bssid)
+
+    # Continue after the last datapoint of the previous page
+    match = {"bssid": bssid_id}
+    if after is not None:
+        match["_id"] = {"$gt": after}
+
+    # Yield the location, rssi and time of the ap_data_frames of the bssid
+    # joined with their data frame
+    for datapoint in db["ap_data_frames"].aggregate(
+        datapoints_pipeline(match, area, limit=limit, keep_id=True)
+    ):
+        yield datapoint["_id"], datapoint_row(datapoint)
+
+def datapoint_row(datapoint: dict) -> dict:
+    """Make the row of a datapoint from datapoints_pipeline.
+
+    Args:
+        datapoint (dict): Document from datapoints_pipeline
+
+    Returns:
+        dict: Location, rssi and time of the datapoint
+    """
+
+    return {
+        "location": (datapoint["location"][0], datapoint["location"][1]),
+        "rssi": datapoint["rssi"],
+        "time": datapoint["time"]
+    }
+
+def generate_datapoint_overview(
+    client: MongoClient,
+    bssid: str
+) -> list[dict]:
+    """Generate a table of datapoints.
+
+    Args:
+        client (MongoClient): Client to connect to the DB
+        bssid (str): The BSSID to generate datapoints for
+
+    Returns:
+        list[dict]: List of dictionarys containing location, rssi and time
+    """
+
+    # Collect the streamed datapoints and return them
+    return [
+        datapoint for _, datapoint in iter_datapoint_overview(client, bssid)
+    ]
+
+# Bucket sizes for downsampled time series from small to large, as
+# ($dateTrunc unit, bin size, approximate length in seconds)
+bucket_sizes = [
+    ("second", 1, 1), ("second", 5, 5), ("second", 15, 15),
+    ("second", 30, 30), ("minute", 1, 60), ("minute", 5, 300),
+    ("minute", 15, 900), ("minute", 30, 1800), ("hour", 1, 3600),
+    ("hour", 3, 10800), ("hour", 6, 21600), ("hour", 12, 43200),
+    ("day", 1, 86400), ("week", 1, 604800), ("month", 1, 2629746),
+    ("year", 1, 31556952)
+]
+
+def choose_bucket_size(
+    start: datetime,
+    end: datetime,
+    width: int
+) -> tuple[str, int]:
+    """Choose the bucket size so a time range gets about one bucket per pixel.
+
+    Args:
+        start (datetime): Start of the time range
+        end (datetime): End of the time range
+        width (int): Width of the plot in pixels
+
+    Returns:
+        tuple[str, int]: $dateTrunc unit and bin size
+    """
+
+    # Find the smallest bucket size that is at least as long as a pixel
+    seconds_per_pixel = (end - start).total_seconds() / max(width, 1)
+    for unit, bin_size, length in bucket_sizes:
+        if length >= seconds_per_pixel:
+            return unit, bin_size
+
+    return bucket_sizes[-1][:2]
+
+def _time_filter(start: datetime | None, end: datetime | None) -> dict:
+    """Make a filter on the time field for a time window.
+
+    Args:
+        start (datetime | None): Start of the window, None for no start
+        end (datetime | None): End of the window, None for no end
+
+    Returns:
+        dict: Filter for the time field, empty if there is no window
+    """
+
+    window = {}
+    if start is not None:
+        window["$gte"] = start
+    if end is not None:
+        window["$lte"] = end
+
+    return {"time": window} if window else {}
+
+def _bucket_group(unit: str, bin_size: int, value) -> dict:
+    """Make a $group stage with the min, mean and max of value per bucket.
+
+    Args:
+        unit (str): $dateTrunc unit
+        bin_size (int): $dateTrunc bin size
+        value: Expression of the value to summarise
+
+    Returns:
+        dict: The $group stage
+    """
+
+    return {"$group": {
+        "_id": {"$dateTrunc": {
+            "date": "$time", "unit": unit, "binSize": bin_size
+        }},
+        "min": {"$min": value},
+        "mean": {"$avg": value},
+        "max": {"$max": value}
+    }}
+
+# Title, line label and y-axis label of the time series graphs
+graph_styles = {
+    "bssid": ("RSSI over Time", "Measured RSSI", "RSSI"),
+    "aps": (
+        "Access Point scans over Time",
+        "Number of Access Points",
+        "Access Point Scans"
+    )
+}
+
+def plot_width() -> int:
+    """Get the width in pixels of a new matplotlib figure.
+
+    Returns:
+        int: Width in pixels
+    """
+
+    return int(plt.rcParams["figure.figsize"][0] * plt.rcParams["figure.dpi"])
+
+def make_time_graph(buckets: list[dict], graph: str) -> plt.Figure:
+    """Plot the mean of time buckets as a line with a min/max band.
+
+    Args:
+        buckets (list[dict]): Buckets with _id as time and min, mean and max
+        graph (str): Name of the style in graph_styles
+
+    Returns:
+        plt.Figure: Graph
+    """
+
+    title, label, ylabel = graph_styles[graph]
+
+    # Make plot of the values, an empty time window gives an empty plot.
+    # The figure isn't registered with pyplot, so it is freed with its last
+    # reference instead of piling up in the global figure list
+    fig = Figure()
+    ax = fig.subplots()
+    if buckets:
+        # Split the buckets into lists of times and values
+        x = [bucket["_id"] for bucket in buckets]
+        ax.plot(x, [bucket["mean"] for bucket in buckets], label=label)
+        ax.fill_between(
+            x,
+            [bucket["min"] for bucket in buckets],
+            [bucket["max"] for bucket in buckets],
+            alpha=0.3,
+            label="Min/Max"
+        )
+
+    # Setup legends
+    ax.legend()
+    ax.set_title(title)
+    ax.set_xlabel("Time")
+    ax.set_ylabel(ylabel)
+
+    # Return Figure
+    return fig
+
+def bssid_graph_pipeline(
+    bssid_id: ObjectId,
+    start: datetime,
+    end: datetime,
+    width: int
+) -> list[dict]:
+    """Make the pipeline for the rssi of a mac address in time buckets.
+
+    Args:
+        bssid_id (ObjectId): DB id of the mac address
+        start (datetime): Start of the time range
+        end (datetime): End of the time range
+        width (int): Width of the plot in pixels
+
+    Returns:
+        list[dict]: Aggregation pipeline for the ap_data_frames collection
+    """
+
+    unit, bin_size = choose_bucket_size(start, end, width)
+    return datapoints_pipeline(
+        {"bssid": bssid_id}, _time_filter(start, end)
+    ) + [_bucket_group(unit, bin_size, "$rssi"), {"$sort": {"_id": 1}}]
+
+def aps_series_pipeline(after: int) -> list[dict]:
+    """Make the pipeline for the number of access points of new data frames.
+
+    Only the time and the size of the ap_data_frames array leave the
+    database, not the array itself.
+
+    Args:
+        after (int): Number of the last data frame already fetched
+
+    Returns:
+        list[dict]: Aggregation pipeline for the data_frames collection
+    """
+
+    return [
+        {"$match": {"number": {"$gt": after}}},
+        {"$sort": {"number": 1}},
+        {"$project": {
+            "_id": 0,
+            "number": 1,
+            "time": 1,
+            "count": {"$size": "$ap_data_frames"}
+        }}
+    ]
+
+# Record layout of the access point scan time series
+aps_series_dtype = np.dtype([
+    ("number", np.int64),
+    ("time", "datetime64[ms]"),
+    ("count", np.int32)
+])
+
+# Number of access points of every data frame fetched so far in number
+# order. Data frames are only ever added, so update_aps_series only fetches
+# the ones after the last number.
+_aps_series = {"number": 0, "records": np.empty(0, dtype=aps_series_dtype)}
+_aps_series_lock = threading.Lock()
+
+def update_aps_series(client: MongoClient) -> np.ndarray:
+    """Fetch the data frames added since the last update into the time series.
+
+    Args:
+        client (MongoClient): DB Client
+
+    Returns:
+        np.ndarray: The whole time series with the aps_series_dtype layout
+    """
+
+    with _aps_series_lock:
+        # Start over if the database has fewer data frames than already
+        # fetched, it has been replaced
+        latest = get_data_version(client)
+        if latest < _aps_series["number"]:
+            _aps_series["number"] = 0
+            _aps_series["records"] = np.empty(0, dtype=aps_series_dtype)
+
+        # Fetch the new data frames and append them
+        if latest > _aps_series["number"]:
+            new = np.fromiter(
+                (
+                    (document["number"], document["time"], document["count"])
+                    for document in client["scandata"]["data_frames"].aggregate(
+                        aps_series_pipeline(_aps_series["number"])
+                    )
+                ),
+                dtype=aps_series_dtype
+            )
+            if len(new):
+                _aps_series["records"] = np.concatenate(
+                    (_aps_series["records"], new)
+                )
+                _aps_series["number"] = int(new["number"][-1])
+
+        return _aps_series["records"]
+
+# Numpy datetime units of the $dateTrunc units
+_numpy_units = {
+    "second": "s", "minute": "m", "hour": "h", "day": "D", "month": "M",
+    "year": "Y"
+}
+
+def truncate_times(times: np.ndarray, unit: str, bin_size: int) -> np.ndarray:
+    """Truncate times to the start of their bucket like $dateTrunc.
+
+    Args:
+        times (np.ndarray): Times as datetime64
+        unit (str): $dateTrunc unit
+        bin_size (int): $dateTrunc bin size
+
+    Returns:
+        np.ndarray: Start of the bucket of each time as datetime64[ms]
+    """
+
+    # Weeks start on sunday like the $dateTrunc default, 1970-01-01 was a
+    # thursday
+    if unit == "week":
+        days = times.astype("datetime64[D]").astype(np.int64)
+        truncated = ((days + 4) // (7 * bin_size) * (7 * bin_size) - 4)
+        return truncated.astype("datetime64[D]").astype("datetime64[ms]")
+
+    # Count whole units since 1970 and round down to the bin size, the bins
+    # used line up with the 2000-01-01 reference of $dateTrunc
+    numpy_unit = _numpy_units[unit]
+    units = times.astype(f"datetime64[{numpy_unit}]").astype(np.int64)
+    return (
+        (units // bin_size * bin_size).astype(f"datetime64[{numpy_unit}]")
+        .astype("datetime64[ms]")
+    )
+
+def _utc_naive(time_: datetime | None) -> datetime | None:
+    # MongoDB returns naive UTC times, so aware times are converted to those
+    if time_ is not None and time_.tzinfo is not None:
+        return time_.astimezone(timezone.utc).replace(tzinfo=None)
+    return time_
+
+def get_bssid_graph_buckets(
+    client: MongoClient,
+    bssid: str,
+    start: datetime | None = None,
+    end: datetime | None = None
+) -> list[dict]:
+    """Get the rssi of a mac address in time buckets for a graph.
+
+    The scans are downsampled in the database into time buckets of about
+    one pixel of the plot each, with the min, mean and max rssi per bucket.
+
+    Args:
+        client (MongoClient): DB Client
+        bssid (str): Mac Address to graph
+        start (datetime | None): Only plot scans from this time
+        end (datetime | None): Only plot scans until this time
+
+    Returns:
+        list[dict]: Buckets with _id as time and min, mean and max rssi
+    """
+
+    # Get Collection from database
+    db = client["scandata"]
+
+    # Get DB id of the bssid
+    bssid_id = _bssid_id(db, bssid)
+
+    # Fill in the bound of the time range that isn't given with the time of
+    # the first or last scan of the bssid
+    start, end = _utc_naive(start), _utc_naive(end)
+    if start is None:
+        start = _bssid_scan_time(db, bssid_id, ASCENDING)
+    if end is None:
+        end = _bssid_scan_time(db, bssid_id, DESCENDING)
+
+    # Get the rssi of the bssid in time buckets about one pixel wide
+    buckets = []
+    if start is not None and end is not None:
+        buckets = list(db["ap_data_frames"].aggregate(
+            bssid_graph_pipeline(bssid_id, start, end, plot_width())
+        ))
+
+    return buckets
+
+def _bssid_scan_time(db, bssid_id: ObjectId | None, direction: int) -> datetime | None:
+    """Get the time of the first or last scan of a mac address.
+
+    Args:
+        db: scandata database
+        bssid_id (ObjectId | None): DB id of the mac address
+        direction (int): ASCENDING for the first scan, DESCENDING for the
+            last one
+
+    Returns:
+        datetime | None: Time of the scan, None if there are no scans
+    """
+
+    # ap_data_frames are inserted in scan order, so their ids are too
+    ap_data_frame = db["ap_data_frames"].find_one(
+        {"bssid": bssid_id},
+        projections["ap_data_frame_id"],
+        sort=[("_id", direction)]
+    )
+    if ap_data_frame is None:
+        return None
+
+    data_frame = db["data_frames"].find_one(
+        {"ap_data_frames": ap_data_frame["_id"]},
+        projections["data_frame_time"]
+    )
+    return data_frame["time"] if data_frame is not None else None
+
+def generate_bssid_graph(
+    client: MongoClient,
+    bssid: str,
+    start: datetime | None = None,
+    end: datetime | None = None
+) -> plt.Figure:
+    """Make a graph of bssid rssi and time.
+
+    Args:
+        client (MongoClient): DB Client
+        bssid (str): Mac Address to graph
+        start (datetime | None): Only plot scans from this time
+        end (datetime | None): Only plot scans until this time
+
+    Returns:
+        plt.Figure: Graph
+    """
+
+    # Make and return the plot of the time buckets
+    return make_time_graph(
+        get_bssid_graph_buckets(client, bssid, start, end), "bssid"
+    )
+
+def get_aps_graph_buckets(
+    client: MongoClient,
+    start: datetime | None = None,
+    end: datetime | None = None
+) -> list[dict]:
+    """Get the number of access points scanned in time buckets for a graph.
+
+    The number of access points of every data frame is kept in an in process
+    time series, which only fetches the data frames added since the last
+    call. It is downsampled into time buckets of about one pixel of the
+    plot each, with the min, mean and max number of access points per
+    bucket, the same buckets $dateTrunc would make.
+
+    Args:
+        client (MongoClient): Client to connect to DB
+        start (datetime | None): Only plot data frames from this time
+        end (datetime | None): Only plot data frames until this time
+
+    Returns:
+        list[dict]: Buckets with _id as time and min, mean and max number
+            of access points
+    """
+
+    # Get the time series and keep the data frames in the time window
+    series = update_aps_series(client)
+    start, end = _utc_naive(start), _utc_naive(end)
+    selected = np.ones(len(series), dtype=bool)
+    if start is not None:
+        selected &= series["time"] >= np.datetime64(start, "ms")
+    if end is not None:
+        selected &= series["time"] <= np.datetime64(end, "ms")
+    series = series[selected]
+    if not len(series):
+        return []
+
+    # Find the time range of the data frames that isn't given
+    times = series["time"]
+    start = start if start is not None else times.min().item()
+    end = end if end is not None else times.max().item()
+
+    # Group the data frames by bucket about one pixel wide, in time order
+    unit, bin_size = choose_bucket_size(start, end, plot_width())
+    keys = truncate_times(times, unit, bin_size)
+    order = np.argsort(keys, kind="stable")
+    keys, counts = keys[order], series["count"][order].astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    sizes = np.diff(np.r_[starts, len(keys)])
+
+    # Get the min, mean and max number of access points per bucket
+    return [
+        {"_id": bucket, "min": low, "mean": mean, "max": high}
+        for bucket, low, mean, high in zip(
+            keys[starts].tolist(),
+            np.minimum.reduceat(counts, starts).tolist(),
+            (np.add.reduceat(counts, starts) / sizes).tolist(),
+            np.maximum.reduceat(counts, starts).tolist()
+        )
+    ]
+
+def generate_graph_of_aps(
+    client: MongoClient,
+    start: datetime | None = None,
+    end: datetime | None = None
+):
+    """Generate a graph of the number of access points scanned over time.
+
+    Args:
+        client (MongoClient): Client to connect to DB
+        start (datetime | None): Only plot data frames from this time
+        end (datetime | None): Only plot data frames until this time
+    """
+
+    # Make and return the plot of the time buckets
+    return make_time_graph(get_aps_graph_buckets(client, start, end), "aps")
+
+def datapoints_pipeline(
+    match: dict,
+    frame_match: dict | None = None,
+    limit: int | None = None,
+    keep_id: bool = False,
+    keep_bssid: bool = False
+) -> list[dict]:
+    """Make an aggregation pipeline joining ap_data_frames with data_frames.
+
+    The pipeline runs on the ap_data_frames collection and outputs one
+    document with rssi, location, number and time for each ap_data_frame that
+    matches. The lookup uses the localField/foreignField form with a
+    sub-pipeline (MongoDB 5.0+) so the multikey index on
+    data_frames.ap_data_frames is used and only the needed fields are joined.
+
+    With a limit and no frame_match the limit comes right after the sort, so
+    the sort and limit are read from the bssid/_id index and only the page
+    is joined. With a frame_match the limit has to follow the join, because
+    the data frames that don't match drop ap_data_frames from the page.
 
     Args:
-        username (str): DB Username
-        password (str): DB Password
-        host (str): Hostname where the DB is located
+        match (dict): Filter for the ap_data_frames
+        frame_match (dict | None): Filter for the joined data_frames, the
+            ap_data_frames whose data frame doesn't match are left out
+        limit (int | None): Maximum number of documents in ap_data_frame id
+            order, None for all in natural order
+        keep_id (bool): Keep the ap_data_frame id in the output
+        keep_bssid (bool): Keep the mac address id in the output, for
+            pipelines matching several mac addresses
 
     Returns:
-        MongoClient: DB Client
+        list[dict]: Aggregation pipeline
     """
 
-    # Make client connection to database and return it
-    return MongoClient(f"mongodb://{username}:{password}@{host}:27017/")
+    # Limit before the join when no ap_data_frames are dropped by it
+    limit_first = bool(limit) and frame_match is None
+
+    return [
+        {"$match": match},
+        *([{"$sort": {"_id": 1}}] if limit else []),
+        *([{"$limit": limit}] if limit_first else []),
+        {"$lookup": {
+            "from": "data_frames",
+            "localField": "_id",
+            "foreignField": "ap_data_frames",
+            "pipeline": [
+                {"$match": frame_match or {}},
+                {"$limit": 1},
+                {"$project": projections["data_frame_datapoint"]}
+            ],
+            "as": "data_frame"
+        }},
+        {"$unwind": "$data_frame"},
+        *([{"$limit": limit}] if limit and not limit_first else []),
+        {"$project": {
+            "_id": int(keep_id),
+            **({"bssid": 1} if keep_bssid else {}),
+            "rssi": 1,
+            "location": "$data_frame.location",
+            "number": "$data_frame.number",
+            "time": "$data_frame.time"
+        }}
+    ]
 
-def generate_ssid_overview(
+def get_rssi_location_datapoints(
     client: MongoClient,
-    filterstr: str,
-    filtertype: int
-) -> dict:
-    """Get an overview of the ssid-bssid connections.
+    bssid: str
+) -> Datapoints:
+    """Get datapoints of the rssi and location of chosen mac address.
 
     Args:
         client (MongoClient): DB Client
-        filterstr (str): String to filter by
-        filtertype (int): Type of filter, 0 = ssid, 1 = bssid, 2 = no filter
+        bssid (str): Mac Address to get datapoints for
 
     Returns:
-        dict: Overview of ssid-bssid connections
+        Datapoints: RSSI, location, number and time datapoints
     """
-
-    # Get Collections from database
+   
+    # Get database
     db = client["scandata"]
-    ap_data_frames, bssid_pool, ssid_pool = (db["ap_data_frames"],
-                                             db["bssid_pool"],
-                                             db["ssid_pool"])
-
-    # Instantiate empty dictionary for storing return data
-    ssid_bssid = {}
-
-    # Loop over all ssids
-    for ssid in ssid_pool.find():
-
-        # Filter by ssid name (or dont if filter is set to bssid)
-        if (filtertype == 2 or
-            (filterstr in ssid['name'] and filtertype == 0) or
-            filtertype == 1):
-            
-            # Instantiate empty list for the ssids mac addresses name
-            ssid_bssid[ssid['name']] = []
-            
-            # Get id of ssid document
-            ssid_id = ssid['_id']
-
-            # Loop over all mac address for ssid
-            for bssid in bssid_pool.find({'ssid': ssid_id}):
-
-                # Filter by bssid (or dont if filter is set ssid)
-                if (filtertype == 2 or
-                    (filterstr in bssid['name'] and filtertype == 1) or
-                    filtertype == 0):
-
-                    # Find the number of scans the bssid is in
-                    num_of_scans = len(
-                        list(
-                            ap_data_frames.find(
-                                {"bssid": bssid["_id"]}
-                            )
-                        )
-                    )
-
-                    # Append mac address and number of scanes to the list
-                    ssid_bssid[ssid['name']].append(
-                        (bssid['name'], num_of_scans)
-                    )
     
-    # Remove all ssids that doesn't have at least one mac address
-    keys = [k for k, v in ssid_bssid.items() if v == []]
-
-    for key in keys:
-        del ssid_bssid[key]
+    # Grab id of the requested bssid
+    bssid_id = _bssid_id(db, bssid)
 
-    # Return dictionary
-    return ssid_bssid
+    # Fill the datapoints straight from the ap_data_frames of the bssid
+    # joined with their data frame and return them
+    return Datapoints.from_cursor(
+        db["ap_data_frames"].aggregate(datapoints_pipeline({"bssid": bssid_id}))
+    )
 
-def generate_datapoint_overview(
+def get_ssid_datapoints(
     client: MongoClient,
-    bssid: str
-) -> list[dict]:
-    """Generate a table of datapoints.
+    ssid: str
+) -> tuple[list[str], np.ndarray, Datapoints]:
+    """Get the datapoints of every mac address of a network in one query.
 
     Args:
-        client (MongoClient): Client to connect to the DB
-        bssid (str): The BSSID to generate datapoints for
+        client (MongoClient): DB Client
+        ssid (str): Name of the network
 
     Returns:
-        list[dict]: List of dictionarys containing location, rssi and time
+        tuple[list[str], np.ndarray, Datapoints]: Mac addresses, the index
+            in the mac addresses of each datapoint and the datapoints of all
+            mac addresses
     """
 
-    # Get Collections from database
+    # Get database
     db = client["scandata"]
-    data_frames, ap_data_frames, bssid_pool = (db["data_frames"],
-                                              db["ap_data_frames"],
-                                              db["bssid_pool"])
 
-    # Get DB id of the bssid
-    bssid_id = bssid_pool.find_one({"name": bssid})["_id"]
-
-    # Instantiate empty list to contain the datapoints
-    datapoints = []
-
-    # Extract datapoints
-    for ap_data_frame in ap_data_frames.find({"bssid": bssid_id}):
-        ap_data_frame_id = ap_data_frame["_id"]
-        
-        # Make temporary dictionary
-        temp_dict = {"location": (), "rssi": 0, "time": 0}
-        
-        # Find the data frame in the database
-        data_frame = data_frames.find_one({"ap_data_frames": ap_data_frame_id})
-        
-        # Populate the temporary dictionary with location, rssi and time from
-        # the data frame
-        temp_dict["location"] = (
-            data_frame["location"][0],
-            data_frame["location"][1]
-        )
-        temp_dict["rssi"] = ap_data_frame["rssi"]
-        temp_dict["time"] = data_frame["time"]
-        
-        # Added the datapoints to the datapoints list
-        datapoints.append(temp_dict)
+    # Grab the ids and names of the mac addresses of the network
+    ssid_document = db["ssid_pool"].find_one(
+        {"name": ssid}, projections["ssid_id"]
+    )
+    bssids = list(db["bssid_pool"].find(
+        {"ssid": ssid_document and ssid_document["_id"]},
+        projections["bssid_id_name"]
+    ))
 
-    # Return the datapoints
-    return datapoints
+    # Fetch the datapoints of all the mac addresses in one aggregation and
+    # keep which mac address each of them belongs to
+    documents = list(db["ap_data_frames"].aggregate(
+        ssid_datapoints_pipeline(bssids)
+    ))
 
-def generate_bssid_graph(
+    return group_ssid_datapoints(bssids, documents)
+
+def ssid_datapoints_pipeline(bssids: list[dict]) -> list[dict]:
+    """Make the pipeline for the datapoints of the mac addresses of a network.
+
+    Args:
+        bssids (list[dict]): bssid_pool documents with the bssid_id_name
+            projection
+
+    Returns:
+        list[dict]: Aggregation pipeline for the ap_data_frames collection
+    """
+
+    return datapoints_pipeline(
+        {"bssid": {"$in": [bssid["_id"] for bssid in bssids]}}, keep_bssid=True
+    )
+
+def group_ssid_datapoints(
+    bssids: list[dict],
+    documents: list[dict]
+) -> tuple[list[str], np.ndarray, Datapoints]:
+    """Split the datapoints of a network by mac address.
+
+    Args:
+        bssids (list[dict]): bssid_pool documents with the bssid_id_name
+            projection
+        documents (list[dict]): Documents from ssid_datapoints_pipeline
+
+    Returns:
+        tuple[list[str], np.ndarray, Datapoints]: Mac addresses, the index
+            in the mac addresses of each datapoint and the datapoints of all
+            mac addresses
+    """
+
+    group_of = {bssid["_id"]: i for i, bssid in enumerate(bssids)}
+    groups = np.fromiter(
+        (group_of[document["bssid"]] for document in documents),
+        dtype=np.intp,
+        count=len(documents)
+    )
+
+    return [bssid["name"] for bssid in bssids], groups, Datapoints.from_cursor(documents)
+
+def iter_bssid_datapoints(
     client: MongoClient,
-    bssid: str
-) -> plt.Figure:
-    """Make a graph of bssid rssi and time.
+    batch_size: int = 10000
+) -> Iterator[tuple[ObjectId, Datapoints]]:
+    """Stream the datapoints of every mac address from one aggregation.
+
+    The ap_data_frames are read in mac address order along the bssid index
+    and joined with their data frames, so the datapoints of each mac address
+    arrive together and only one of them is held in memory at a time.
 
     Args:
         client (MongoClient): DB Client
-        bssid (str): Mac Address to graph
+        batch_size (int): Number of documents per cursor batch
 
     Returns:
-        plt.Figure: Graph
+        Iterator[tuple[ObjectId, Datapoints]]: Id of each mac address with
+            its datapoints
     """
 
-    # Get Collections from database
+    # Get database
     db = client["scandata"]
-    data_frames, ap_data_frames, bssid_pool = (db["data_frames"],
-                                               db["ap_data_frames"],
-                                               db["bssid_pool"])
 
-    # Get DB id of the bssid
-    bssid_id = bssid_pool.find_one({"name": bssid})["_id"]
+    # Join every ap_data_frame with its data frame, sorted by mac address
+    cursor = db["ap_data_frames"].aggregate(
+        [{"$sort": {"bssid": 1}}, *datapoints_pipeline({}, keep_bssid=True)],
+        batchSize=batch_size
+    )
+
+    # Cut the stream into the runs of each mac address
+    with cursor:
+        for bssid_id, documents in groupby(cursor, key=itemgetter("bssid")):
+            yield bssid_id, Datapoints.from_cursor(documents)
+
+def estimate_accesspoint_location(
+    rssi_list: np.ndarray,
+    locations_list: np.ndarray
+) -> tuple[float, float]:
+    """Estimate the location of the access point using trilateration.
+
+    Args:
+        rssi_list (np.ndarray): List of rssi measurements
+        locations_list (np.ndarray): List of locations as an (n, 2) array
 
-    # Instantiate empty list to hold ap_data_frames ids
-    ap_data_frames_ids = []
+    Returns:
+        tuple[float, float]: Estimated longitude and latitude
+
+    Raises:
+        ValueError: If there are no scans or every scan is at -100 dBm, so
+            the weights sum to zero
+    """
 
-    # Loop over all data_frames that reference the bssid
-    # and append their ids to the list
-    for ap_data_frame in ap_data_frames.find({'bssid': bssid_id}):
-        ap_data_frames_ids.append(ap_data_frame["_id"])
+    # Convert the rssis to positive signal strengths by 100 + rssi
+    # (rssi is negative)
+    signal_strengths = 100 + np.asarray(rssi_list, dtype=np.float64)
+
+    # Convert the locations to an (n, 2) array of latitude and longitude
+    locations = np.asarray(locations_list, dtype=np.float64)
+
+    # Without any weight the centroid is undefined
+    weight = signal_strengths.sum()
+    if not weight > 0:
+        raise ValueError("No scan has a signal above -100 dBm")
+
+    # Calculate the location weighted by how big a part of the sum of
+    # signal strengths each signal strength is, the sum is only
+    # calculated once
+    latitude, longitude = signal_strengths @ locations / weight
     
-    # Instantiate empty list to contain the datapoints to plot
-    datapoints = []
+    # Return the location estimation
+    return (round(float(latitude), 6), round(float(longitude), 6))
+
+def _pathloss_fit(
+    x: np.ndarray,
+    y: np.ndarray,
+    rssi: np.ndarray,
+    params: np.ndarray,
+    max_iterations: int,
+    deadline: float,
+    huber: float
+) -> tuple[np.ndarray, np.ndarray]:
+    """Fit the log-distance path-loss model with Levenberg-Marquardt.
+
+    The model is rssi = P0 - 10 * n * log10(d) where d is the distance in
+    meters from the access point at (ax, ay). Residuals are weighted with
+    the Huber loss so single bad scans don't pull the fit.
 
-    # Loop over all ap_data_frame ids
-    # and find the rssi and time for each ap_data_frame
-    # adding them to the datapoints as an tuple
-    for ap_data_frames_id in ap_data_frames_ids:
-        y = ap_data_frames.find_one({"_id": ap_data_frames_id})['rssi']
-        x = data_frames.find_one({"ap_data_frames": ap_data_frames_id})['time']
-        datapoints.append((x,y))
+    Args:
+        x (np.ndarray): Scan x coordinates in meters
+        y (np.ndarray): Scan y coordinates in meters
+        rssi (np.ndarray): Measured rssi of the scans
+        params (np.ndarray): Start parameters [ax, ay, P0, n]
+        max_iterations (int): Maximum number of iterations
+        deadline (float): time.perf_counter value to stop at
+        huber (float): Huber threshold in units of the robust residual scale
 
-    # Make plotable datapoints by splitting it into two lists
-    # of x and y values
-    x, y = zip(*datapoints)
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Fitted parameters and their residuals
+    """
 
-    # Make scatter plot of the values
-    fig, ax = plt.subplots()
-    ax.plot(x, y, label="Measured RSSI")
+    def residuals(params):
+        # Distance to the access point, at least one meter so the
+        # logarithm stays finite
+        dx, dy = params[0] - x, params[1] - y
+        d2 = np.maximum(dx*dx + dy*dy, 1.0)
+        return rssi - (params[2] - 5 * params[3] * np.log10(d2)), dx, dy, d2
+
+    r, dx, dy, d2 = residuals(params)
+    damping = 1e-3
+
+    for _ in range(max_iterations):
+        if time.perf_counter() > deadline:
+            break
+
+        # Huber weights from the median absolute deviation of the residuals
+        scale = max(1.4826 * np.median(np.abs(r - np.median(r))), 1e-6)
+        weights = np.minimum(1.0, huber * scale / np.maximum(np.abs(r), 1e-12))
+
+        # Jacobian of the predicted rssi with respect to the parameters
+        k = -10 * params[3] / np.log(10)
+        jacobian = np.column_stack((
+            k * dx / d2,
+            k * dy / d2,
+            np.ones_like(r),
+            -5 * np.log10(d2)
+        ))
 
-    # Setup legends
-    ax.legend()
-    ax.set_title("RSSI over Time")
-    ax.set_xlabel("Time")
-    ax.set_ylabel("RSSI")
-   
-    # Return Figure
-    return fig
+        # Solve the damped normal equations for the parameter step
+        jtw = jacobian.T * weights
+        jtj = jtw @ jacobian
+        gradient = jtw @ r
+        cost = np.sum(weights * r * r)
+
+        try:
+            step = np.linalg.solve(
+                jtj + damping * np.diag(np.diag(jtj) + 1e-9), gradient
+            )
+        except np.linalg.LinAlgError:
+            break
+
+        # Keep the path-loss exponent physically plausible
+        candidate = params + step
+        candidate[3] = np.clip(candidate[3], 1.5, 6.0)
+        new_r, new_dx, new_dy, new_d2 = residuals(candidate)
+
+        # Accept the step if it lowers the weighted cost, otherwise increase
+        # the damping and try again
+        if np.sum(weights * new_r * new_r) < cost:
+            converged = np.max(np.abs(step[:2])) < 1e-3
+            params, r, dx, dy, d2 = candidate, new_r, new_dx, new_dy, new_d2
+            damping = max(damping / 3, 1e-9)
+            if converged:
+                break
+        else:
+            damping *= 4
+
+    return params, r
+
+def estimate_accesspoint_location_pathloss(
+    rssi_list: np.ndarray,
+    locations_list: np.ndarray,
+    max_points: int = 20000,
+    max_iterations: int = 50,
+    time_budget: float = 0.25,
+    huber: float = 1.345,
+    outlier_threshold: float = 3.0
+) -> tuple[float, float]:
+    """Estimate the location of the access point with a path-loss model.
 
-def generate_graph_of_aps(
-    client: MongoClient
-):
-    """Generate a graph of the number of access points scanned over time.
+    Fits the log-distance path-loss model to the scans with robust nonlinear
+    least squares, drops scans whose residual is more than outlier_threshold
+    robust deviations off and refits. Large point sets are subsampled and
+    the fit stops at the iteration cap or time budget, so the latency stays
+    bounded. Falls back to the weighted centroid with fewer than 4 scans.
 
     Args:
-        client (MongoClient): Client to connect to DB
+        rssi_list (np.ndarray): List of rssi measurements
+        locations_list (np.ndarray): List of locations as an (n, 2) array
+        max_points (int): Maximum number of scans used in the fit
+        max_iterations (int): Maximum number of iterations per fit
+        time_budget (float): Time budget for the fit in seconds
+        huber (float): Huber loss threshold in robust deviations
+        outlier_threshold (float): Residual in robust deviations to reject at
+
+    Returns:
+        tuple[float, float]: Estimated latitude and longitude
+
+    Raises:
+        ValueError: If there are no scans or every scan is at -100 dBm
     """
-    # Get Collections from database
-    db = client["scandata"]
-    data_frames = db["data_frames"]
 
-    # Instantiate empty list to contain the datapoints to plot
-    datapoints = []
+    deadline = time.perf_counter() + time_budget
 
-    for data_frame in data_frames.find({}):
-        y = len(data_frame["ap_data_frames"])
-        x = data_frame["time"]
-        datapoints.append((x, y))
+    # Use the weighted centroid as the starting point of the fit
+    centroid = estimate_accesspoint_location(rssi_list, locations_list)
 
-    # plotable datapoints by splitting it into two lists
-    # of x and y values
-    x, y = zip(*datapoints)
+    rssi = np.asarray(rssi_list, dtype=np.float64)
+    locations = np.asarray(locations_list, dtype=np.float64)
 
-    # Make scatter plot of the values
-    fig, ax = plt.subplots()
-    ax.plot(x, y, label="Number of Access Points")
+    # We need at least as many scans as parameters to fit the model
+    if len(rssi) < 4:
+        return centroid
 
-    # Setup legends
-    ax.legend()
-    ax.set_title("Access Point scans over Time")
-    ax.set_xlabel("Time")
-    ax.set_ylabel("Access Point Scans")
+    # Subsample large point sets to bound the cost of each iteration
+    if len(rssi) > max_points:
+        sample = np.random.default_rng(0).choice(
+            len(rssi), max_points, replace=False
+        )
+        rssi, locations = rssi[sample], locations[sample]
+
+    # Project the locations to meters on a plane around the centroid
+    meters_per_latitude = 110540.0
+    meters_per_longitude = 111320.0 * np.cos(np.radians(centroid[0]))
+    y = (locations[:, 0] - centroid[0]) * meters_per_latitude
+    x = (locations[:, 1] - centroid[1]) * meters_per_longitude
+
+    # Fit from the centroid with a free space like path-loss exponent
+    params = np.array([0.0, 0.0, rssi.max(), 2.0])
+    params, r = _pathloss_fit(
+        x, y, rssi, params, max_iterations, deadline, huber
+    )
 
-    # Return Figure
-    return fig
+    # Reject outliers and refit with the remaining scans
+    scale = max(1.4826 * np.median(np.abs(r - np.median(r))), 1e-6)
+    inliers = np.abs(r) <= outlier_threshold * scale
+    if 4 <= inliers.sum() < len(r):
+        params, r = _pathloss_fit(
+            x[inliers], y[inliers], rssi[inliers], params,
+            max_iterations, deadline, huber
+        )
 
-def get_rssi_location_datapoints(
-    client: MongoClient,
-    bssid: str
-) -> dict:
-    """Get datapoints of the rssi and location of chosen mac address.
+    # Give up on fits that diverged and use the centroid instead
+    if not np.all(np.isfinite(params)):
+        return centroid
+
+    # Convert the fitted location back to latitude and longitude
+    return (
+        round(float(centroid[0] + params[1] / meters_per_latitude), 6),
+        round(float(centroid[1] + params[0] / meters_per_longitude), 6)
+    )
+
+# Access point locators that can be selected by name
+locators = {
+    "centroid": estimate_accesspoint_location,
+    "pathloss": estimate_accesspoint_location_pathloss
+}
+
+def locate_accesspoint(
+    datapoints: Datapoints,
+    locator: str = "centroid"
+) -> tuple[float, float]:
+    """Estimate the location of the access point with the chosen locator.
 
     Args:
-        client (MongoClient): DB Client
-        bssid (str): Mac Address to get datapoints for
+        datapoints (Datapoints): Data points from get_rssi_location_datapoints
+        locator (str): Name of the locator in locators
+
+    Raises:
+        ValueError: If the locator doesn't exist, or no scan has a signal
+            above -100 dBm
 
     Returns:
-        dict: RSSI and Location datapoints
+        tuple[float, float]: Estimated latitude and longitude
     """
-   
-    # Get Collections from database
-    db = client["scandata"]
-    data_frames, ap_data_frames, bssid_pool = (db["data_frames"],
-                                               db["ap_data_frames"],
-                                               db["bssid_pool"])
-    
-    # Grab id of the requested bssid
-    bssid_id = bssid_pool.find_one({"name": bssid})["_id"]
-
-    # Instantiate empty list of ap_data_frame ids
-    ap_data_frames_ids = []
-
-    # Loop over all ap_data_frames that reference the bssid
-    # and add the ap_data_frames' id to the list
-    for ap_data_frames_id in ap_data_frames.find({"bssid": bssid_id}):
-        ap_data_frames_ids.append(ap_data_frames_id["_id"])
-
-    # Instantiate dictionary to hold the datapoints
-    datapoints = {"rssi": [], "location": [], "number": [], "time": []}
-
-    # Loop over all the ap_data_frames ids and append
-    # the measured rssi and location to the dictionary
-    for ap_data_frames_id in ap_data_frames_ids:
-        datapoints["rssi"].append(
-            ap_data_frames.find_one(
-                {"_id": ap_data_frames_id}
-            )["rssi"]
-        )
-        datapoints["location"].append(
-            data_frames.find_one(
-                {"ap_data_frames": ap_data_frames_id}
-            )["location"]
-        )
-        datapoints["number"].append(
-            data_frames.find_one(
-                {"ap_data_frames": ap_data_frames_id}
-            )["number"]
-        )
-        datapoints["time"].append(
-            data_frames.find_one(
-                {"ap_data_frames": ap_data_frames_id}
-            )["time"]
-        )
 
-    # Return the dictionary of datapoints
-    return datapoints
+    if locator not in locators:
+        raise ValueError(f"Unknown locator {locator}")
 
-def estimate_accesspoint_location(
-    rssi_list: list[int],
-    locations_list: list[tuple[float, float]]
-) -> tuple[float, float]:
-    """Estimate the location of the access point using trilateration.
+    return locators[locator](datapoints.rssi, datapoints.location)
+
+def estimate_accesspoint_locations(
+    groups: np.ndarray,
+    count: int,
+    rssi_list: np.ndarray,
+    locations_list: np.ndarray
+) -> np.ndarray:
+    """Estimate the location of several access points at once.
+
+    This is the weighted centroid of estimate_accesspoint_location for every
+    access point, summed per access point in one pass over the datapoints.
 
     Args:
-        rssi_list (list[int]): List of rssi measurements
-        locations_list (list[tuple[float, float]]): List of locations
+        groups (np.ndarray): Index of the access point of each rssi
+        count (int): Number of access points
+        rssi_list (np.ndarray): List of rssi measurements
+        locations_list (np.ndarray): List of locations as an (n, 2) array
 
     Returns:
-        tuple[float, float]: Estimated longitude and latitude
+        np.ndarray: Estimated latitude and longitude of each access point as
+            a (count, 2) array, NaN for access points without datapoints
     """
 
-    # Instantiate empty list to hold signal strengths
-    signal_strengths = []
+    # Convert the rssis to positive signal strengths like the single
+    # access point estimate
+    signal_strengths = 100 + np.asarray(rssi_list, dtype=np.float64)
+    locations = np.asarray(locations_list, dtype=np.float64).reshape(-1, 2)
 
-    # Loop over all rssis, convert them signal positive signal strength by
-    # 100 + rssi (rssi is negative)
-    for rssi in rssi_list:
-        signal_strengths.append(100+rssi)
-    
-    # Instantiate empty list to hold signal ratios
-    signal_ratios = []
-
-    # Loop over all signal strengths and convert them to signal ratios by
-    # calculation how big a part of the sum of signal strengths each
-    # signal strength is
-    for signal_strength in signal_strengths:
-        signal_ratios.append(signal_strength/sum(signal_strengths))
-
-    # Variables to hold the calculated longitude and latitude
-    longitude = 0
-    latitude = 0
-
-    # Loop over all the locations and signal_ratios and add the
-    # location longitude sized by the signal_ratio to the longitude variable
-    # and the same with the latitude
-    for location, signal_ratio in zip(locations_list, signal_ratios):
-        longitude += location[1] * signal_ratio
-        latitude += location[0] * signal_ratio
-    
-    # Return the location estimation
-    return (round(latitude,6), round(longitude, 6))
+    # Sum the signal strengths and the weighted locations per access point
+    total = np.bincount(groups, signal_strengths, count)
+    latitude = np.bincount(groups, signal_strengths * locations[:, 0], count)
+    longitude = np.bincount(groups, signal_strengths * locations[:, 1], count)
+
+    # Divide by the sums, access points without any weight get NaN
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.round(np.column_stack((latitude, longitude)) / total[:, None], 6)
+
+def locate_accesspoints(
+    datapoints: Datapoints,
+    groups: np.ndarray,
+    count: int,
+    locator: str = "centroid"
+) -> np.ndarray:
+    """Estimate the location of several access points with the chosen locator.
+
+    The centroid locator estimates all access points in one vectorized
+    pass, other locators are run for each access point.
+
+    Args:
+        datapoints (Datapoints): Data points of all access points
+        groups (np.ndarray): Index of the access point of each datapoint
+        count (int): Number of access points
+        locator (str): Name of the locator in locators
+
+    Raises:
+        ValueError: If the locator doesn't exist
+
+    Returns:
+        np.ndarray: Estimated latitude and longitude of each access point as
+            a (count, 2) array, NaN for access points without datapoints
+    """
+
+    if locator not in locators:
+        raise ValueError(f"Unknown locator {locator}")
+
+    # Estimate every weighted centroid at once
+    if locator == "centroid":
+        return estimate_accesspoint_locations(
+            groups, count, datapoints.rssi, datapoints.location
+        )
+
+    # Run the locator on the datapoints of each access point
+    locations = np.full((count, 2), np.nan)
+    for group in range(count):
+        selected = datapoints.take(np.flatnonzero(groups == group))
+        try:
+            locations[group] = locate_accesspoint(selected, locator)
+        except ValueError:
+            # No scan with any weight, the location stays NaN
+            continue
+    return locations
 
 def convert_locations_to_grid( 
     ap_location: tuple[float, float],
-    scan_locations: list[list[float, float]],
+    scan_locations: np.ndarray,
     isize: int,
     buffer: int
-) -> tuple[tuple[int, int], list[tuple[int, int]]]:
+) -> tuple[tuple[float, float], np.ndarray]:
     """Convert real world coordinates to locations on an image grid.
 
+    The projection fits the scans and the access point on the image, use
+    GridProjection directly to reuse it for more locations.
+
     Args:
         ap_location (tuple[float, float]): Location of Access Point
-        scan_locations (list[list[float, float]]): Locations of scans
+        scan_locations (np.ndarray): Locations of scans as an (n, 2) array
         isize (int): Size of image in pixels
         buffer (int): Size of outer buffer
 
     Returns:
-        tuple[tuple[int, int], list[tuple[int, int]]]: Grid coordinates of access point and scans
+        tuple[tuple[float, float], np.ndarray]: Grid coordinates of access point and scans
     """
 
-    # Calculate size without the buffers
-    size = isize-buffer*2
+    # Make the projection from the bounds and project all locations at once
+    projection = GridProjection.from_locations(
+        scan_locations, isize, buffer, ap_location
+    )
+    return projection.project_point(ap_location), projection.project(scan_locations)
 
-    # Get the minimum and maximum longitude 
-    min_longitude = min(min(scan_locations, key = lambda x: x[1])[1], ap_location[1])
-    max_longitude = max(max(scan_locations, key = lambda x: x[1])[1], ap_location[1])
+def heatmap_accesspoint(
+    ap_location: tuple[float, float],
+    ap_grid_location: tuple[float, float]
+) -> dict:
+    """Make the access point node of a heatmap.
 
-    # Get the minimum and maximum latitude
-    # Technically inversed since the image will have (0,0) in the top left,
-    # But the gps has it in the bottom left, so flipping the latitude around will
-    # avoid a y-axis flip.
-    min_latitude = max(max(scan_locations, key = lambda x: x[0])[0], ap_location[0])
-    max_latitude = min(min(scan_locations, key = lambda x: x[0])[0], ap_location[0])
-    
-    # Calculate the aspcet ratio between the x- and y-axis
-    aspect_ratio = abs((max_longitude-min_longitude)/(max_latitude-min_latitude))
+    Args:
+        ap_location (tuple[float, float]): Location of the access point
+        ap_grid_location (tuple[float, float]): Grid location of the access
+            point
 
-    # Set the x- and y-axis size based on the aspect_ratio
-    if aspect_ratio > 1:
-        x_axis = size 
-        y_axis = size * aspect_ratio**(-1)
-    else:
-        y_axis = size
-        x_axis = size * aspect_ratio
+    Returns:
+        dict: Node with coords and label
+    """
 
-    # Calculate extra padding space to center the data when one axis is smaller
-    x_padding = (y_axis - x_axis) / 2
-    if x_padding < 0: x_padding = 0
-    
-    y_padding = (x_axis - y_axis) / 2
-    if y_padding < 0: y_padding = 0
-
-    # Tuple of access point grid location
-    ap_grid_location = (
-        int(
-            abs(
-                (ap_location[1] - min_longitude)/(max_longitude-min_longitude)
-            )*x_axis
-        ) + buffer + x_padding,
-        int(
-            abs(
-                (ap_location[0] - min_latitude)/(max_latitude-min_latitude)
-            )*y_axis
-        ) + buffer + y_padding
-    )
+    return {
+        'coords': ap_grid_location,
+        'label': f'Access Point\n{ap_location}'
+    }
 
-    # Instantiate empty list for scan grid locations
-    scan_grid_locations = []
-
-    # Loop over all scan locations and append a tuple of grid location
-    for location in scan_locations:
-        scan_grid_locations.append((
-            int(
-                abs(
-                    (location[1] - min_longitude)/(max_longitude-min_longitude)
-                )*x_axis 
-            ) + buffer + x_padding,
-            int(
-                abs(
-                    (location[0] - min_latitude)/(max_latitude-min_latitude)
-                )*y_axis
-            ) + buffer + y_padding
-        ))
-    
-    # Return grid locations
-    return ap_grid_location, scan_grid_locations
+def heatmap_scans(
+    scan_grid_locations: np.ndarray,
+    datapoints: Datapoints
+) -> list[dict]:
+    """Make the scan nodes of a heatmap.
+
+    Args:
+        scan_grid_locations (np.ndarray): Grid locations of the scans
+        datapoints (Datapoints): Data points of the scans
+
+    Returns:
+        list[dict]: Nodes with coords, rssi and label
+    """
+
+    # Instantiate empty list to hold scan nodes
+    scans = []
+
+    # Loop over all scan grid locations, rssi and real locations
+    # then append a node to the list for each, the columns are converted
+    # to Python values in one go instead of per element
+    for grid_location, rssi, real_location, number, time in zip(
+        map(tuple, scan_grid_locations.tolist()),
+        datapoints.rssi.tolist(),
+        datapoints.location.tolist(),
+        datapoints.number.tolist(),
+        datapoints.time.tolist()
+    ):
+        scans.append(
+            {
+                'coords': grid_location,
+                'rssi': rssi,
+                'label': f"{real_location}\n({number}) ({time})"
+            }
+        )
+
+    return scans
 
 def generate_heatmap(
     ap_location: tuple[float, float],
-    rssi_location_datapoints: dict,
+    rssi_location_datapoints: Datapoints,
     size: int,
     buffer: int
 ) -> Image.Image:
@@ -455,7 +2336,7 @@ def generate_heatmap(
 
     Args:
         ap_location (tuple[float, float]): Location of the access point
-        rssi_location_datapoints (dict): Data points from get_rssi_location_datapoints
+        rssi_location_datapoints (Datapoints): Data points from get_rssi_location_datapoints
         size (int): Size of the image
         buffer (int): Outer buffer on the image
 
@@ -487,30 +2368,10 @@ def generate_heatmap(
         return im
 
     # Make dict to describe the access point node
-    ap = {
-        'coords': ap_grid_location,
-        'label': f'Access Point\n{ap_location}'
-    }
-
-    # Instantiate empty list to hold scan nodes
-    scans = []
+    ap = heatmap_accesspoint(ap_location, ap_grid_location)
 
-    # Loop over all scan grid locations, rssi and real locations
-    # then append a node to the list for each
-    for grid_location, rssi, real_location, number, time in zip(
-        scan_grid_locations,
-        rssi_location_datapoints["rssi"],
-        rssi_location_datapoints["location"],
-        rssi_location_datapoints["number"],
-        rssi_location_datapoints["time"]
-    ):
-        scans.append(
-            {
-                'coords': grid_location,
-                'rssi': rssi,
-                'label': f"{real_location}\n({number}) ({time})"
-            }
-        )
+    # Make the scan nodes
+    scans = heatmap_scans(scan_grid_locations, rssi_location_datapoints)
 
     # Make the image and draw the heat circles and nodes
     im = hu.make_image(size, size)
@@ -521,3 +2382,128 @@ def generate_heatmap(
 
     # Return the generated image
     return im
+
+# Ways to combine the heat fields of the access points of a network
+coverage_modes = ("max", "server")
+
+def generate_coverage_heatmap(
+    names: list[str],
+    ap_locations: np.ndarray,
+    datapoints: Datapoints,
+    groups: np.ndarray,
+    size: int,
+    buffer: int,
+    mode: str = "max"
+) -> Image.Image:
+    """Generate a combined heatmap of all access points of a network.
+
+    Args:
+        names (list[str]): Mac addresses of the access points
+        ap_locations (np.ndarray): Locations of the access points as a
+            (k, 2) array from locate_accesspoints
+        datapoints (Datapoints): Data points of all access points
+        groups (np.ndarray): Index of the access point of each datapoint
+        size (int): Size of the image
+        buffer (int): Outer buffer on the image
+        mode (str): "max" colors each pixel by the strongest signal, "server"
+            by which access point has the strongest signal
+
+    Raises:
+        ValueError: If the mode doesn't exist
+
+    Returns:
+        Image.Image:
+    """
+
+    if mode not in coverage_modes:
+        raise ValueError(f"Unknown coverage mode {mode}")
+
+    # Like generate_heatmap there is no heatmap with fewer than 2 scans
+    if len(datapoints) < 2:
+        im = hu.make_image(500, 500)
+        draw = ImageDraw.ImageDraw(im)
+        draw.text(
+            (250, 250),
+            "Not Enough Data to Generate Heatmap",
+            fill=(0, 0, 0),
+            font=hu.fnt,
+            anchor="mm"
+        )
+        return im
+
+    # Project the scans and the located access points onto one grid
+    ap_locations = np.asarray(ap_locations, dtype=np.float64).reshape(-1, 2)
+    located = ~np.isnan(ap_locations).any(axis=1)
+    projection = GridProjection.from_locations(
+        np.vstack((datapoints.location, ap_locations[located])), size, buffer
+    )
+    scan_grid_locations = projection.project(datapoints.location)
+    ap_grid_locations = np.full_like(ap_locations, np.nan)
+    ap_grid_locations[located] = projection.project(ap_locations[located])
+
+    # Make the image and draw the combined field
+    im = hu.make_image(size, size)
+    best, server = hu.coverage_field(
+        (size, size),
+        ap_grid_locations,
+        scan_grid_locations,
+        datapoints.rssi,
+        groups
+    )
+    if mode == "max":
+        hu.paste_heat_field(im, best)
+    else:
+        hu.paste_server_field(im, server)
+
+    # Draw the scans without labels, there are too many on a whole network
+    hu.draw_scanning_points(im, [
+        {"coords": coords, "label": None}
+        for coords in map(tuple, scan_grid_locations.tolist())
+    ])
+
+    # Draw the located access points
+    for name, location, coords in zip(
+        names, ap_locations.tolist(), ap_grid_locations.tolist()
+    ):
+        if not np.isnan(coords[0]):
+            hu.draw_accesspoint(im, {
+                "coords": tuple(coords),
+                "label": f"{name}\n{tuple(location)}"
+            })
+
+    # The scale only applies to the signal strength field
+    if mode == "max":
+        hu.draw_scale_guide(im)
+
+    # Return the generated image
+    return im
+
+if __name__ == "__main__":
+    # Create the indexes and verify the query plans when this file is run,
+    # add the GeoJSON locations and rebuild the bssid statistics if requested
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default="localhost")
+    parser.add_argument('--username', default="root")
+    parser.add_argument('--password', default="password")
+    parser.add_argument('--rebuild-stats', action="store_true", default=False,
+                        dest="rebuild_stats",
+                        help="Aggregate the bssid statistics from scratch")
+    parser.add_argument('--rebuild-geo', action="store_true", default=False,
+                        dest="rebuild_geo",
+                        help="Store the location of every data frame as GeoJSON again")
+    args = parser.parse_args()
+
+    db_client = client(args.username, args.password, args.host)
+    for index in ensure_indexes(db_client):
+        print(f"Index {index}")
+    for pattern, stages in verify_query_plans(db_client).items():
+        print(f"{pattern}: {' -> '.join(stages)}")
+    if args.rebuild_stats:
+        print(f"Statistics of {rebuild_bssid_stats(db_client)} bssids rebuilt")
+    if args.rebuild_geo:
+        print(f"GeoJSON locations of {rebuild_geo_locations(db_client)} data frames rebuilt")
+    else:
+        print(f"GeoJSON locations of {update_geo_locations(db_client)} data frames added")
+    close_clients()
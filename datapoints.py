@@ -0,0 +1,149 @@
+"""Columnar container for rssi and location datapoints
+
+The datapoints of a mac address are stored as one NumPy array per field
+instead of lists of Python objects, so they take up less memory and can be
+processed without Python loops.
+"""
+
+# Import Modules
+import numpy as np
+
+# Import the spatial index
+from spatial_index import GeoIndex
+
+# Record layout used when filling the columns from a database cursor
+datapoint_dtype = np.dtype([
+    ("latitude", np.float64),
+    ("longitude", np.float64),
+    ("rssi", np.int8),
+    ("number", np.int32),
+    ("time", "datetime64[ms]")
+])
+
+class Datapoints:
+    """RSSI, location, number and time of scans stored as NumPy columns.
+
+    The columns can also be read like the old dictionary of lists, so
+    datapoints["rssi"] and datapoints["location"] still work.
+    """
+
+    def __init__(
+        self,
+        latitude: np.ndarray,
+        longitude: np.ndarray,
+        rssi: np.ndarray,
+        number: np.ndarray,
+        time: np.ndarray
+    ):
+        """Make a datapoint container from columns of equal length.
+
+        Args:
+            latitude (np.ndarray): Latitudes of the scans
+            longitude (np.ndarray): Longitudes of the scans
+            rssi (np.ndarray): Measured rssi in dBm
+            number (np.ndarray): Data frame numbers
+            time (np.ndarray): Times of the scans
+        """
+
+        self.latitude = np.ascontiguousarray(latitude, dtype=np.float64)
+        self.longitude = np.ascontiguousarray(longitude, dtype=np.float64)
+        self.rssi = np.ascontiguousarray(rssi, dtype=np.int8)
+        self.number = np.ascontiguousarray(number, dtype=np.int32)
+        self.time = np.ascontiguousarray(time, dtype="datetime64[ms]")
+        self._geo_index = None
+
+    @classmethod
+    def from_records(cls, records: np.ndarray) -> "Datapoints":
+        """Make a datapoint container from a structured array.
+
+        Args:
+            records (np.ndarray): Array with the datapoint_dtype layout
+
+        Returns:
+            Datapoints: The datapoints
+        """
+
+        return cls(
+            records["latitude"],
+            records["longitude"],
+            records["rssi"],
+            records["number"],
+            records["time"]
+        )
+
+    @classmethod
+    def from_cursor(cls, cursor) -> "Datapoints":
+        """Fill a datapoint container straight from a database cursor.
+
+        Args:
+            cursor: Documents with rssi, location, number and time
+
+        Returns:
+            Datapoints: The datapoints
+        """
+
+        # Read the documents into one structured array without building
+        # intermediate lists and split it into columns
+        return cls.from_records(np.fromiter(
+            (
+                (
+                    document["location"][0],
+                    document["location"][1],
+                    document["rssi"],
+                    document["number"],
+                    document["time"]
+                )
+                for document in cursor
+            ),
+            dtype=datapoint_dtype
+        ))
+
+    @property
+    def location(self) -> np.ndarray:
+        """np.ndarray: Locations as an (n, 2) array of latitude, longitude"""
+        return np.column_stack((self.latitude, self.longitude))
+
+    @property
+    def geo_index(self) -> GeoIndex:
+        """GeoIndex: Spatial index of the locations, built on first use"""
+        if self._geo_index is None:
+            self._geo_index = GeoIndex(self.latitude, self.longitude)
+        return self._geo_index
+
+    @property
+    def nbytes(self) -> int:
+        """int: Memory used by the columns in bytes"""
+        return sum(
+            column.nbytes for column in (
+                self.latitude, self.longitude, self.rssi, self.number,
+                self.time
+            )
+        )
+
+    def take(self, indexes: np.ndarray) -> "Datapoints":
+        """Get a subset of the datapoints.
+
+        Args:
+            indexes (np.ndarray): Indexes of the datapoints to keep
+
+        Returns:
+            Datapoints: The datapoints at the indexes
+        """
+
+        return Datapoints(
+            self.latitude[indexes],
+            self.longitude[indexes],
+            self.rssi[indexes],
+            self.number[indexes],
+            self.time[indexes]
+        )
+
+    def __len__(self) -> int:
+        return len(self.rssi)
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        # Read a column by name like the old dictionary of lists
+        if key not in ("latitude", "longitude", "location", "rssi", "number",
+                       "time"):
+            raise KeyError(key)
+        return getattr(self, key)
@@ -0,0 +1,232 @@
+"""Projection of real world coordinates onto the heatmap image grid
+
+The heatmaps map the bounds of the scans and the access point onto a square
+image with an outer buffer, keeping the aspect ratio of the longitude and
+latitude spans and centering the shorter axis. A projection is built once
+from the bounds and projects whole arrays of locations at a time, so tiles,
+caches and several renders of the same access point can share it. It only
+holds numbers, so it pickles for the render workers and converts to and
+from a json friendly dict.
+
+Locations where all scans share a latitude or a longitude have no span on
+that axis, those axes get no length and their points land on the middle
+line of the image.
+"""
+
+# Import Modules
+import numpy as np
+
+def grid_bounds(
+    scan_locations: np.ndarray,
+    ap_location: tuple[float, float] | None = None
+) -> tuple[float, float, float, float]:
+    """Get the bounds of locations on the image grid.
+
+    Args:
+        scan_locations (np.ndarray): Locations of scans as an (n, 2) array
+            of latitude and longitude
+        ap_location (tuple[float, float] | None): Location of the access
+            point to include, None for only the scans
+
+    Returns:
+        tuple[float, float, float, float]: Minimum and maximum longitude,
+            then the latitude of the top and bottom of the image
+    """
+
+    # Split the scan locations into latitude and longitude columns
+    scan_locations = np.asarray(scan_locations, dtype=np.float64).reshape(-1, 2)
+    latitudes, longitudes = scan_locations[:, 0], scan_locations[:, 1]
+
+    # Get the minimum and maximum longitude
+    min_longitude = longitudes.min()
+    max_longitude = longitudes.max()
+
+    # Get the minimum and maximum latitude
+    # Technically inversed since the image will have (0,0) in the top left,
+    # But the gps has it in the bottom left, so flipping the latitude around will
+    # avoid a y-axis flip.
+    min_latitude = latitudes.max()
+    max_latitude = latitudes.min()
+
+    # Include the access point
+    if ap_location is not None:
+        min_longitude = min(min_longitude, ap_location[1])
+        max_longitude = max(max_longitude, ap_location[1])
+        min_latitude = max(min_latitude, ap_location[0])
+        max_latitude = min(max_latitude, ap_location[0])
+
+    return (
+        float(min_longitude),
+        float(max_longitude),
+        float(min_latitude),
+        float(max_latitude)
+    )
+
+class GridProjection:
+    """Projection of latitude and longitude bounds onto a square image."""
+
+    def __init__(
+        self,
+        bounds: tuple[float, float, float, float],
+        isize: int,
+        buffer: int
+    ):
+        """Make a projection.
+
+        Args:
+            bounds (tuple[float, float, float, float]): Bounds from
+                grid_bounds
+            isize (int): Size of image in pixels
+            buffer (int): Size of outer buffer
+        """
+
+        self.bounds = tuple(float(bound) for bound in bounds)
+        self.isize = isize
+        self.buffer = buffer
+
+        # Calculate size without the buffers
+        size = isize - buffer * 2
+
+        # Get the spans, an axis without span is divided by 1 instead so
+        # all its points are at 0
+        min_longitude, max_longitude, min_latitude, max_latitude = self.bounds
+        longitude_span = max_longitude - min_longitude
+        latitude_span = max_latitude - min_latitude
+        self._origin = (min_longitude, min_latitude)
+        self._spans = (longitude_span or 1.0, latitude_span or 1.0)
+
+        # Calculate the aspect ratio between the x- and y-axis, an axis
+        # without span gets no length
+        if latitude_span:
+            aspect_ratio = abs(longitude_span / latitude_span)
+        else:
+            aspect_ratio = np.inf if longitude_span else 0.0
+
+        # Set the x- and y-axis size based on the aspect_ratio
+        if aspect_ratio > 1:
+            x_axis = size
+            y_axis = size * aspect_ratio**(-1)
+        else:
+            y_axis = size if latitude_span else 0.0
+            x_axis = size * aspect_ratio
+
+        # Calculate extra padding space to center the data when one axis is
+        # smaller
+        self._axes = (x_axis, y_axis)
+        self._paddings = ((size - x_axis) / 2, (size - y_axis) / 2)
+
+    @classmethod
+    def from_locations(
+        cls,
+        scan_locations: np.ndarray,
+        isize: int,
+        buffer: int,
+        ap_location: tuple[float, float] | None = None
+    ) -> "GridProjection":
+        """Make the projection fitting the scans and access point on the image.
+
+        Args:
+            scan_locations (np.ndarray): Locations of scans as an (n, 2)
+                array of latitude and longitude
+            isize (int): Size of image in pixels
+            buffer (int): Size of outer buffer
+            ap_location (tuple[float, float] | None): Location of the access
+                point to include, None for only the scans
+
+        Returns:
+            GridProjection: The projection
+        """
+
+        return cls(grid_bounds(scan_locations, ap_location), isize, buffer)
+
+    def resized(self, isize: int, buffer: int) -> "GridProjection":
+        """Get the projection of the same bounds onto another image size.
+
+        Args:
+            isize (int): Size of image in pixels
+            buffer (int): Size of outer buffer
+
+        Returns:
+            GridProjection: The projection
+        """
+
+        return GridProjection(self.bounds, isize, buffer)
+
+    def project(self, locations: np.ndarray) -> np.ndarray:
+        """Project locations onto whole pixels of the image grid.
+
+        Args:
+            locations (np.ndarray): Locations as an (n, 2) array of latitude
+                and longitude
+
+        Returns:
+            np.ndarray: Grid locations as an (n, 2) array of x and y
+        """
+
+        locations = np.asarray(locations, dtype=np.float64).reshape(-1, 2)
+        return np.column_stack((
+            np.trunc(
+                np.abs((locations[:, 1] - self._origin[0]) / self._spans[0])
+                * self._axes[0]
+            ) + self.buffer + self._paddings[0],
+            np.trunc(
+                np.abs((locations[:, 0] - self._origin[1]) / self._spans[1])
+                * self._axes[1]
+            ) + self.buffer + self._paddings[1]
+        ))
+
+    def project_point(self, location: tuple[float, float]) -> tuple[float, float]:
+        """Project one location onto a whole pixel of the image grid.
+
+        Args:
+            location (tuple[float, float]): Latitude and longitude
+
+        Returns:
+            tuple[float, float]: Grid location as x and y
+        """
+
+        x, y = self.project(location)[0].tolist()
+        return x, y
+
+    def to_dict(self) -> dict:
+        """Get the projection as a json friendly dict.
+
+        Returns:
+            dict: Bounds, image size and buffer
+        """
+
+        return {
+            "bounds": list(self.bounds),
+            "isize": self.isize,
+            "buffer": self.buffer
+        }
+
+    @classmethod
+    def from_dict(cls, projection: dict) -> "GridProjection":
+        """Make a projection from the dict of to_dict.
+
+        Args:
+            projection (dict): Bounds, image size and buffer
+
+        Returns:
+            GridProjection: The projection
+        """
+
+        return cls(projection["bounds"], projection["isize"], projection["buffer"])
+
+    def _key(self) -> tuple:
+        return (self.bounds, self.isize, self.buffer)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, GridProjection):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __hash__(self) -> int:
+        return hash(self._key())
+
+    def __repr__(self) -> str:
+        return (
+            f"GridProjection(bounds={self.bounds}, isize={self.isize}, "
+            f"buffer={self.buffer})"
+        )
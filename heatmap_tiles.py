@@ -0,0 +1,223 @@
+"""XYZ tiles of the access point heatmaps
+
+Instead of one fixed size image the heatmap is split into 256 pixel tiles,
+so a zoomable frontend only fetches the visible tiles at the zoom it shows.
+At zoom z the heatmap is projected with the grid projection of the scans and
+access point onto a square of 256 * 2^z pixels, which is split into 2^z by 2^z tiles numbered
+from the top left like XYZ map tiles.
+
+The projection, the heat profile and a spatial index of the scan points are
+built once per access point and zoom, so a tile only computes its own pixels
+and draws the scan points near it.
+"""
+
+# Import Modules
+from PIL import Image, ImageDraw
+import numpy as np
+import threading
+
+# Import heatmap utilities, datapoint container, grid projection and spatial
+# index
+import heatmap_utils as hu
+from datapoints import Datapoints
+from grid_projection import GridProjection
+from spatial_index import GridIndex
+
+# Width and height of a tile in pixels
+tile_size = 256
+
+# Deepest zoom level served, where the heatmap is 65536 pixels wide
+max_zoom = 8
+
+# Scan labels are drawn from this zoom level, where the heatmap is about as
+# large as the single image heatmap, below it they would cover everything
+label_zoom = 3
+
+# Radius of the dots drawn for the access point and scans
+dot_radius = 5
+
+class TileLayer:
+    """Projection, heat profile and scan index of a heatmap at one zoom."""
+
+    def __init__(
+        self,
+        ap_location: tuple[float, float],
+        datapoints: Datapoints,
+        zoom: int,
+        projection: GridProjection
+    ):
+        """Project the datapoints for a zoom level.
+
+        Args:
+            ap_location (tuple[float, float]): Location of the access point
+            datapoints (Datapoints): Data points of the access point
+            zoom (int): Zoom level
+            projection (GridProjection): Projection of the scans and access
+                point at any size
+        """
+
+        self.zoom = zoom
+
+        # Project onto the whole heatmap at this zoom with the same relative
+        # buffer as the single image heatmap
+        self.world_size = tile_size * 2**zoom
+        projection = projection.resized(self.world_size, self.world_size // 100)
+        self.ap_coords = projection.project_point(ap_location)
+        self.scan_coords = projection.project(datapoints.location)
+
+        # Get the heat field value by distance up to the farthest corner
+        self.profile = hu.heat_profile(
+            self.ap_coords,
+            self.scan_coords,
+            datapoints.rssi,
+            int(np.ceil(np.sqrt(2) * self.world_size)) + 1
+        )
+
+        # Index the scan points by tile
+        self.index = GridIndex(self.scan_coords, tile_size)
+
+class HeatmapTiles:
+    """Tile renderer for the heatmap of one access point."""
+
+    def __init__(self, ap_location: tuple[float, float], datapoints: Datapoints):
+        """Make a tile renderer.
+
+        Args:
+            ap_location (tuple[float, float]): Location of the access point
+            datapoints (Datapoints): Data points of the access point
+
+        Raises:
+            ValueError: If there are fewer than 2 datapoints
+        """
+
+        # A heatmap needs at least 2 scans, like generate_heatmap
+        if len(datapoints) < 2:
+            raise ValueError("Not Enough Data to Generate Heatmap")
+
+        self.ap_location = ap_location
+        self.datapoints = datapoints
+        self._layers = {}
+
+        # Find the bounds of the scans and access point once for all zoom
+        # levels
+        self.projection = GridProjection.from_locations(
+            datapoints.location, tile_size, tile_size // 100, ap_location
+        )
+        self._lock = threading.Lock()
+
+        # Make the labels of the scans like generate_heatmap
+        self.labels = [
+            f"{real_location}\n({number}) ({time})"
+            for real_location, number, time in zip(
+                datapoints.location.tolist(),
+                datapoints.number.tolist(),
+                datapoints.time.tolist()
+            )
+        ]
+
+        # Find how far right, up and down the widest label reaches from its
+        # dot, so tiles also draw the scans next to them whose labels reach
+        # into the tile
+        widest = max(
+            self.labels, key=lambda label: max(map(len, label.split("\n")))
+        )
+        _, top, right, bottom = ImageDraw.Draw(Image.new("1", (1, 1))).multiline_textbbox(
+            (10, 0), widest, font=hu.fnt, anchor="ls"
+        )
+        self.label_reach = (int(np.ceil(right)), -int(top), int(np.ceil(bottom)))
+
+    def layer(self, zoom: int) -> TileLayer:
+        """Get the layer of a zoom level, building it on first use.
+
+        Args:
+            zoom (int): Zoom level
+
+        Returns:
+            TileLayer: The layer
+        """
+
+        with self._lock:
+            if zoom not in self._layers:
+                self._layers[zoom] = TileLayer(
+                    self.ap_location, self.datapoints, zoom, self.projection
+                )
+            return self._layers[zoom]
+
+    def render_tile(self, zoom: int, x: int, y: int) -> Image.Image:
+        """Render a tile of the heatmap.
+
+        Args:
+            zoom (int): Zoom level from 0 to max_zoom
+            x (int): Column of the tile from the left
+            y (int): Row of the tile from the top
+
+        Raises:
+            ValueError: If the tile is outside the heatmap
+
+        Returns:
+            Image.Image: The tile
+        """
+
+        # Check that the tile exists
+        if not 0 <= zoom <= max_zoom:
+            raise ValueError(f"Zoom must be from 0 to {max_zoom}")
+        if not (0 <= x < 2**zoom and 0 <= y < 2**zoom):
+            raise ValueError(f"Tile {x}/{y} is outside zoom level {zoom}")
+
+        layer = self.layer(zoom)
+        origin = (x * tile_size, y * tile_size)
+
+        # Get how far left and up of the tile the scans whose dot or label
+        # reaches into it can be
+        labelled = zoom >= label_zoom
+        right, up, down = self.label_reach if labelled else (0, 0, 0)
+        left, top = max(right, dot_radius), max(down, dot_radius)
+
+        # Make the tile with room on the left and top, so the dots and
+        # labels reaching into it are drawn at positive coordinates like on
+        # the single image heatmap, and paste the part of the heat field it
+        # covers
+        im = Image.new(
+            "RGB", (left + tile_size, top + tile_size), color=(255, 255, 255)
+        )
+        hu.paste_heat_field(im, hu.heat_field(
+            (tile_size, tile_size),
+            layer.ap_coords,
+            layer.scan_coords,
+            self.datapoints.rssi,
+            origin,
+            layer.profile
+        ), (left, top))
+        shift = (origin[0] - left, origin[1] - top)
+
+        # Draw the access point, moved into tile coordinates
+        hu.draw_accesspoint(im, {
+            "coords": (
+                layer.ap_coords[0] - shift[0],
+                layer.ap_coords[1] - shift[1]
+            ),
+            "label": f"Access Point\n{self.ap_location}"
+        })
+
+        # Find the scans whose dot or label reaches into the tile
+        indexes = layer.index.query(
+            origin[0] - left,
+            origin[1] - top,
+            origin[0] + tile_size + dot_radius,
+            origin[1] + tile_size + max(up, dot_radius)
+        )
+
+        # Draw the scans, moved into tile coordinates
+        hu.draw_scanning_points(im, [
+            {
+                "coords": (
+                    layer.scan_coords[i, 0] - shift[0],
+                    layer.scan_coords[i, 1] - shift[1]
+                ),
+                "label": self.labels[i] if labelled else None
+            }
+            for i in indexes.tolist()
+        ])
+
+        # Cut the tile out of the room around it
+        return im.crop((left, top, left + tile_size, top + tile_size))
@@ -3,7 +3,8 @@
 
 # Import Modules
 from PIL import Image, ImageDraw, ImageFont
-from math import sqrt
+from functools import lru_cache
+import numpy as np
 
 # Make font object to use for text
 fnt = ImageFont.truetype("LiberationMono-Regular.ttf", 20)
@@ -58,6 +59,70 @@ def getcolor(color_gradient: list[list], percent: int) -> tuple[int, int, int]:
         int(lower[3] * percent_lower + upper[3] * percent_upper)
     )
 
+def compile_gradient(
+    color_gradient: list[list],
+    resolution: int = 10
+) -> np.ndarray:
+    """Compile the color gradient into an RGB lookup table.
+
+    Entry i of the table is the color of percent i / resolution, so every
+    whole percent maps to the same color as getcolor gives.
+
+    Args:
+        color_gradient (list[list]): The color gradient
+        resolution (int): Number of table entries per percent
+
+    Returns:
+        np.ndarray: Lookup table of (100 * resolution + 1, 3) colors
+    """
+
+    # Calculate the color of every table entry once
+    return np.array(
+        [
+            getcolor(color_gradient, i / resolution)
+            for i in range(100 * resolution + 1)
+        ],
+        dtype=np.uint8
+    )
+
+# Number of lookup table entries per percent and the compiled lookup table
+# of the heatmap color gradient
+lut_resolution = 10
+color_lut = compile_gradient(color_gradient, lut_resolution)
+
+# Palette with the color of every whole percent for palette images
+heat_palette = color_lut[::lut_resolution].flatten().tolist()
+
+# Colors of the access points on best server coverage maps, repeated when
+# there are more access points
+server_colors = [
+    (31, 119, 180), (255, 127, 14), (44, 160, 44), (214, 39, 40),
+    (148, 103, 189), (140, 86, 75), (227, 119, 194), (127, 127, 127),
+    (188, 189, 34), (23, 190, 207)
+]
+
+# Royal purple of the scan dots and labels
+scan_color = (102, 51, 153)
+
+# Heatmaps with at most this many scans draw one ellipse per scan, which is
+# faster than rasterising a heat field that covers most of the image
+ellipse_scans = 64
+
+def map_colors(percent: np.ndarray) -> np.ndarray:
+    """Get the gradient colors of an array of percents.
+
+    Args:
+        percent (np.ndarray): Percents from 0 to 100, values outside are
+            clipped
+
+    Returns:
+        np.ndarray: Array of the same shape with an extra axis of (R, G, B)
+    """
+
+    # Convert the percents to table indexes and look them all up at once
+    index = np.rint(np.asarray(percent, dtype=np.float64) * lut_resolution)
+    return color_lut[np.clip(index, 0, len(color_lut) - 1).astype(np.intp)]
+
 def make_image(width: int, height: int) -> Image.Image:
     """Make a new pillow image.
 
@@ -73,64 +138,354 @@ def make_image(width: int, height: int) -> Image.Image:
     # so we have space for a gradient bar the bottom
     return Image.new("RGB", (width, height+100), color=(255, 255, 255))
 
-def draw_heat_circles(im: Image.Image, ap: dict, scans: list[dict]) -> None:
-    """Draw the heatmap circles.
+def heat_profile(
+    ap_coords: tuple[float, float],
+    scan_coords: np.ndarray,
+    scan_rssi: np.ndarray,
+    radius: int
+) -> np.ndarray:
+    """Get the heat field value at every whole pixel distance from the access point.
+
+    Every scan covers a circle around the access point with the radius of
+    its distance to the access point, so the field only depends on the
+    distance, and each distance gets the best rssi of the scans at least
+    that far away.
+
+    Args:
+        ap_coords (tuple[float, float]): Grid location of the access point
+        scan_coords (np.ndarray): Grid locations of scans as an (n, 2) array
+        scan_rssi (np.ndarray): Measured rssi of the scans
+        radius (int): Largest distance the profile must cover
+
+    Returns:
+        np.ndarray: Negated rssi (percent) by distance, -1 where no scan
+            reaches
+    """
+
+    scan_coords = np.asarray(scan_coords, dtype=np.float64).reshape(-1, 2)
+    percent = -np.asarray(scan_rssi, dtype=np.int16)
+
+    # Calculate the whole pixel distance from the access point to each scan
+    dists = np.trunc(np.hypot(
+        ap_coords[0] - scan_coords[:, 0],
+        ap_coords[1] - scan_coords[:, 1]
+    )).astype(np.int64)
+
+    # Find the best signal strength of the scans at each distance, then the
+    # best of all scans at least that far away by a reversed running minimum
+    radius = max(int(dists.max()), radius) + 1
+    by_distance = np.full(radius + 1, np.iinfo(np.int16).max, dtype=np.int16)
+    np.minimum.at(by_distance, dists, percent)
+    by_radius = np.minimum.accumulate(by_distance[::-1])[::-1]
+
+    # Mark the distances no scan reaches with -1
+    by_radius[by_radius == np.iinfo(np.int16).max] = -1
+
+    return by_radius
+
+def scan_reach(ap_coords: tuple[float, float], scan_coords: np.ndarray) -> int:
+    """Get the whole pixel distance of the farthest scan from the access point.
+
+    Args:
+        ap_coords (tuple[float, float]): Grid location of the access point
+        scan_coords (np.ndarray): Grid locations of scans as an (n, 2) array
+
+    Returns:
+        int: Distance of the farthest scan, -1 without scans
+    """
+
+    scan_coords = np.asarray(scan_coords, dtype=np.float64).reshape(-1, 2)
+    if not len(scan_coords):
+        return -1
+    return int(np.hypot(
+        ap_coords[0] - scan_coords[:, 0],
+        ap_coords[1] - scan_coords[:, 1]
+    ).max())
+
+def reach_window(
+    shape: tuple[int, int],
+    ap_coords: tuple[float, float],
+    reach: int,
+    origin: tuple[int, int] = (0, 0)
+) -> tuple[int, int, int, int] | None:
+    """Get the part of a field that scans up to a distance can reach.
+
+    A scan covers the pixels at most as far from the access point as the
+    scan, so only the square around the access point out to the farthest
+    scan can get a value.
+
+    Args:
+        shape (tuple[int, int]): Height and width of the field
+        ap_coords (tuple[float, float]): Grid location of the access point
+        reach (int): Distance from scan_reach
+        origin (tuple[int, int]): Grid location of the top left pixel of
+            the field
+
+    Returns:
+        tuple[int, int, int, int] | None: Left, top, right and bottom of the
+            part in field pixels, right and bottom exclusive, None if no
+            pixel can be reached
+    """
+
+    if reach < 0:
+        return None
+
+    height, width = shape
+    x, y = ap_coords[0] - origin[0], ap_coords[1] - origin[1]
+    left = min(max(int(np.floor(x)) - reach, 0), width)
+    right = min(max(int(np.ceil(x)) + reach + 1, 0), width)
+    top = min(max(int(np.floor(y)) - reach, 0), height)
+    bottom = min(max(int(np.ceil(y)) + reach + 1, 0), height)
+    if left >= right or top >= bottom:
+        return None
+
+    return left, top, right, bottom
+
+def heat_field(
+    shape: tuple[int, int],
+    ap_coords: tuple[float, float],
+    scan_coords: np.ndarray,
+    scan_rssi: np.ndarray,
+    origin: tuple[int, int] = (0, 0),
+    profile: np.ndarray | None = None
+) -> np.ndarray:
+    """Rasterise the heat field of an access point as an array.
+
+    Each pixel gets the best rssi of the scans whose circle around the
+    access point covers it. This is the same field the heat circles used to
+    be painted as, but computed per distance instead of per circle. Only the
+    pixels within reach of the farthest scan are computed.
+
+    Args:
+        shape (tuple[int, int]): Height and width of the field
+        ap_coords (tuple[float, float]): Grid location of the access point
+        scan_coords (np.ndarray): Grid locations of scans as an (n, 2) array
+        scan_rssi (np.ndarray): Measured rssi of the scans
+        origin (tuple[int, int]): Grid location of the top left pixel of
+            the field, for rendering a part of a larger image
+        profile (np.ndarray | None): Profile from heat_profile to reuse, it
+            is computed from the scans if None
+
+    Returns:
+        np.ndarray: Field of negated rssi (percent), -1 where no scan reaches
+    """
+
+    # Get the field value at every distance and the distance of the
+    # farthest scan, the distances scans reach are the start of a profile
+    if profile is None:
+        reach = scan_reach(ap_coords, scan_coords)
+        profile = heat_profile(ap_coords, scan_coords, scan_rssi, reach)
+    else:
+        reach = int(np.count_nonzero(profile >= 0)) - 1
+
+    # Only the square around the access point out to the farthest scan can
+    # be reached
+    field = np.full(shape, -1, dtype=profile.dtype)
+    window = reach_window(shape, ap_coords, reach, origin)
+    if window is None:
+        return field
+    left, top, right, bottom = window
+
+    # Calculate the distance from the access point to every pixel of the
+    # square, rounded up so a pixel is reached by a scan when its distance is
+    # at most the distance of the scan
+    rows = np.arange(top, bottom, dtype=np.float64) + origin[1] - ap_coords[1]
+    cols = np.arange(left, right, dtype=np.float64) + origin[0] - ap_coords[0]
+    pixel_dists = np.ceil(
+        np.sqrt(rows[:, None]**2 + cols[None, :]**2)
+    ).astype(np.int32)
+
+    # Look up the field value of every pixel by its distance, pixels past
+    # the end of the profile aren't reached by any scan
+    field[top:bottom, left:right] = profile[
+        np.minimum(pixel_dists, len(profile) - 1)
+    ]
+    return field
+
+def paste_heat_field(
+    im: Image.Image,
+    field: np.ndarray,
+    offset: tuple[int, int] = (0, 0)
+) -> None:
+    """Color a heat field and paste it on the image where the scans reach.
 
     Args:
         im (Image.Image): Image to draw on
-        ap (dict): Access Point data
-        scans (list[dict]): List of scan data
+        field (np.ndarray): Field from heat_field
+        offset (tuple[int, int]): Location on the image of the top left
+            pixel of the field
 
     Returns:
         None:
     """
 
-    # Initiate a list for the distances of scans
-    scan_dists = []
+    # Color the field with one lookup by making it a palette image with
+    # the gradient color of every percent as the palette
+    palette = Image.fromarray(
+        np.clip(field, 0, 100).astype(np.uint8), "P"
+    )
+    palette.putpalette(heat_palette)
 
-    # Loop over all scans
-    for scan in scans:
+    # Paste the colored field on the image where the scans reach
+    im.paste(
+        palette.convert("RGB"),
+        offset,
+        Image.fromarray((field >= 0).view(np.uint8) * np.uint8(255), "L")
+    )
 
-        # Calculate the distance from the access point to the
-        # scan location
-        dist = int(
-            sqrt(
-                (ap["coords"][0] - scan["coords"][0])**2 +
-                (ap["coords"][1] - scan["coords"][1])**2
-            )
+def coverage_field(
+    shape: tuple[int, int],
+    ap_coords: np.ndarray,
+    scan_coords: np.ndarray,
+    scan_rssi: np.ndarray,
+    groups: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """Rasterise the combined heat field of several access points.
+
+    Each access point gets its own heat field from its own scans like
+    heat_field, computed only within reach of its farthest scan, and each
+    pixel keeps the best of them and which access point it came from.
+
+    Args:
+        shape (tuple[int, int]): Height and width of the field
+        ap_coords (np.ndarray): Grid locations of the access points as a
+            (k, 2) array
+        scan_coords (np.ndarray): Grid locations of scans as an (n, 2) array
+        scan_rssi (np.ndarray): Measured rssi of the scans
+        groups (np.ndarray): Index of the access point of each scan
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Field of the best negated rssi
+            (percent) and field of the index of the best access point, both
+            -1 where no scan reaches
+    """
+
+    scan_coords = np.asarray(scan_coords, dtype=np.float64).reshape(-1, 2)
+    scan_rssi = np.asarray(scan_rssi, dtype=np.int16)
+    best = np.full(shape, -1, dtype=np.int16)
+    server = np.full(shape, -1, dtype=np.int16)
+
+    for group, ap in enumerate(np.asarray(ap_coords, dtype=np.float64)):
+        # Skip the access points without scans or location
+        selected = groups == group
+        if not selected.any() or np.isnan(ap).any():
+            continue
+
+        # Make the heat field of the access point where its scans reach
+        coords = scan_coords[selected]
+        window = reach_window(shape, ap, scan_reach(ap, coords))
+        if window is None:
+            continue
+        left, top, right, bottom = window
+        field = heat_field(
+            (bottom - top, right - left), ap, coords, scan_rssi[selected],
+            origin=(left, top)
         )
 
-        # Append the calculated distance to the scan distance list
-        # And mark the negated (-(-dBm)) signal strengh with it
-        scan_dists.append((dist, -scan["rssi"]))
+        # Keep the pixels where it is the first or strongest signal
+        best_window = best[top:bottom, left:right]
+        better = (field >= 0) & ((best_window < 0) | (field < best_window))
+        best_window[better] = field[better]
+        server[top:bottom, left:right][better] = group
 
-    # Sort the distances from worst signal strengh (dBm) to best
-    scan_dists.sort(key=lambda x: x[1], reverse=True)
+    return best, server
 
-    # Make pillow image drawing tool
-    draw = ImageDraw.Draw(im)
+def paste_server_field(im: Image.Image, server: np.ndarray) -> None:
+    """Color each pixel by its best access point and paste it on the image.
 
-    # Loop over the scan distances
-    for dist in scan_dists:
+    Args:
+        im (Image.Image): Image to draw on
+        server (np.ndarray): Field of access point indexes from
+            coverage_field
 
-        # Get the color based on the signal strengh
-        color = getcolor(color_gradient, dist[1])
+    Returns:
+        None:
+    """
 
-        # Draw the heat circle
-        draw.ellipse(
-            [
-                (ap["coords"][0] - dist[0], ap["coords"][1] - dist[0]),
-                (ap["coords"][0] + dist[0], ap["coords"][1] + dist[0])
-            ],
-            fill=color
-        )
+    # Color the field with a palette of the access point colors
+    palette = Image.fromarray(
+        (np.maximum(server, 0) % len(server_colors)).astype(np.uint8), "P"
+    )
+    palette.putpalette([value for color in server_colors for value in color])
+
+    # Paste the colored field on the image where the scans reach
+    im.paste(
+        palette.convert("RGB"),
+        (0, 0),
+        Image.fromarray(np.where(server >= 0, 255, 0).astype(np.uint8), "L")
+    )
+
+def draw_heat_circles(im: Image.Image, ap: dict, scans: list[dict]) -> None:
+    """Draw the heatmap circles.
+
+    With up to ellipse_scans scans each circle is drawn as an ellipse, worst
+    signal first. With more scans the heat field is rasterised as an array
+    with heat_field where the scans reach, colored with one lookup and
+    pasted on the image in one go.
+
+    Args:
+        im (Image.Image): Image to draw on
+        ap (dict): Access Point data
+        scans (list[dict]): List of scan data
+
+    Returns:
+        None:
+    """
+
+    # Nothing to draw without scans
+    if not scans:
+        return
+
+    ap_coords = ap["coords"]
+    scan_coords = np.array([scan["coords"] for scan in scans], dtype=np.float64)
+    scan_rssi = np.array([scan["rssi"] for scan in scans], dtype=np.int16)
+
+    # Draw few scans as ellipses, the best signal is drawn last so it ends
+    # up on top
+    if len(scans) <= ellipse_scans:
+        dists = np.trunc(np.hypot(
+            ap_coords[0] - scan_coords[:, 0],
+            ap_coords[1] - scan_coords[:, 1]
+        )).tolist()
+        colors = [tuple(color) for color in map_colors(-scan_rssi).tolist()]
+        draw = ImageDraw.Draw(im)
+        for i in np.argsort(scan_rssi, kind="stable").tolist():
+            draw.ellipse(
+                [
+                    (ap_coords[0] - dists[i], ap_coords[1] - dists[i]),
+                    (ap_coords[0] + dists[i], ap_coords[1] + dists[i])
+                ],
+                fill=colors[i]
+            )
+        return
 
-def draw_scanning_points(im: Image.Image, scans: list[dict]) -> None:
+    # Build the heat field of the part of the image the scans reach and
+    # paste it
+    window = reach_window(
+        (im.height, im.width), ap_coords, scan_reach(ap_coords, scan_coords)
+    )
+    if window is None:
+        return
+    left, top, right, bottom = window
+    paste_heat_field(im, heat_field(
+        (bottom - top, right - left),
+        ap_coords,
+        scan_coords,
+        scan_rssi,
+        origin=(left, top)
+    ), (left, top))
+
+def draw_scanning_points(
+    im: Image.Image,
+    scans: list[dict],
+    fill=scan_color
+) -> None:
     """Draw the scanning points and write a label for them.
 
     Args:
         im (Image.Image): The image to draw on
         scans (list[dict]): List of scan data
+        fill: Color of the dots and labels, 255 to draw them on an L mask
 
     Returns:
         None:
@@ -148,17 +503,18 @@ def draw_scanning_points(im: Image.Image, scans: list[dict]) -> None:
                 (scan["coords"][0] - 5, scan["coords"][1] - 5),
                 (scan["coords"][0] + 5, scan["coords"][1] + 5)
             ],
-            fill=(102, 51, 153)
+            fill=fill
         )
 
-        # Write caption for dot
-        draw.multiline_text(
-            (scan["coords"][0] + 10, scan["coords"][1]),
-            scan["label"],
-            fill=(102, 51, 153),
-            font=fnt,
-            anchor="ls"
-        )
+        # Write caption for dot, scans without a label only get the dot
+        if scan["label"]:
+            draw.multiline_text(
+                (scan["coords"][0] + 10, scan["coords"][1]),
+                scan["label"],
+                fill=fill,
+                font=fnt,
+                anchor="ls"
+            )
 
 def draw_accesspoint(im: Image.Image, ap: dict) -> None:
     """Draw the access point on the heatmap with a label.
@@ -192,41 +548,34 @@ def draw_accesspoint(im: Image.Image, ap: dict) -> None:
         anchor="ls"
     )
 
-def draw_scale_guide(im: Image.Image) -> None:
-    """Draw a scale gradient guide bar at the bottom.
+@lru_cache(maxsize=16)
+def render_scale_guide(width: int) -> Image.Image:
+    """Render the 100 pixel high scale gradient guide bar for a width.
+
+    The result is cached per width, so it is only rendered once.
 
     Args:
-        im (Image.Image): Image to draw on
+        width (int): Width of the image the guide is for
 
     Returns:
-        None:
+        Image.Image: The guide bar
     """
 
-    # Make pillow image drawing tool
-    draw = ImageDraw.Draw(im)
-
     # Make white backdrop
-    draw.rectangle(
-        [(0, im.height-100), (im.width, im.height)],
-        fill=(255, 255, 255)
-    )
-    
-    # Loop over all pixels in width from 40 to width - 40
-    for i in range(im.width - 40):
-
-        # Calculate percentage
-        percent = int((i/(im.width - 40)) * 100)
-        
-        # Draw a line which color based on gradient and percentage
-        draw.line(
-            [(i+20, im.height-80), (i+20, im.height-30)],
-            fill=getcolor(color_gradient, percent),
-            width=1
-        )
+    guide = Image.new("RGB", (width, 100), color=(255, 255, 255))
+
+    # Make the gradient bar from 20 to width - 20 pixels as one array, where
+    # every column gets the color of its whole percentage
+    percent = (np.arange(width - 40) / (width - 40) * 100).astype(np.int64)
+    bar = np.broadcast_to(map_colors(percent), (51, width - 40, 3))
+    guide.paste(Image.fromarray(np.ascontiguousarray(bar), "RGB"), (20, 20))
+
+    # Make pillow image drawing tool
+    draw = ImageDraw.Draw(guide)
 
     # Draw text to mark 0, -50 and -100 dBm
     draw.text(
-        (40, im.height-25),
+        (40, 75),
         "0 dBm",
         fill=(50, 50, 50),
         font=fnt,
@@ -234,7 +583,7 @@ def draw_scale_guide(im: Image.Image) -> None:
     )
     
     draw.text(
-        (int(im.width/2), im.height-25),
+        (int(width/2), 75),
         "-50 dBm",
         fill=(50, 50, 50),
         font=fnt,
@@ -242,9 +591,24 @@ def draw_scale_guide(im: Image.Image) -> None:
     )
     
     draw.text(
-        (im.width-40, im.height-25),
+        (width-40, 75),
         "-100 dBm",
         fill=(50, 50, 50),
         font=fnt,
         anchor="mt"
     )
+
+    return guide
+
+def draw_scale_guide(im: Image.Image) -> None:
+    """Draw a scale gradient guide bar at the bottom.
+
+    Args:
+        im (Image.Image): Image to draw on
+
+    Returns:
+        None:
+    """
+
+    # Paste the cached guide bar over the bottom 100 pixels
+    im.paste(render_scale_guide(im.width), (0, im.height-100))
@@ -0,0 +1,164 @@
+"""Encoding of the rendered images
+
+The images are encoded as PNG, WebP or JPEG, picked from the Accept header
+of the request, and clients that don't ask for a format get PNG. Heatmaps
+are mostly the 101 colors of the heat gradient, so they can be written as
+palette PNGs, which are smaller and faster to compress than RGB PNGs. The
+encoder settings are module level and changed with configure.
+
+Each thread reuses one output buffer instead of making a new one for every
+image.
+"""
+
+# Import Modules
+from PIL import Image
+from io import BytesIO
+import threading
+
+# Mimetype of each format, when a client accepts several formats equally
+# the first one is used. Palette PNGs of the heatmaps are smaller than WebP
+# and JPEG, so the other formats are only used when the client prefers them.
+image_formats = {
+    "png": "image/png",
+    "webp": "image/webp",
+    "jpeg": "image/jpeg"
+}
+
+# Encoder settings, the defaults are picked from benchmark.py encode
+settings = {
+    # zlib level from 0 (none) to 9 (smallest), 6 is the Pillow default but
+    # takes over twice as long as 3 for a few percent smaller heatmaps
+    "png_compress_level": 3,
+    # Write images with palette=True as palette PNGs
+    "png_palette": True,
+    # How images with more than 256 colors are reduced, median cut keeps
+    # the colors closer but is several times slower than the octree
+    "png_quantize": Image.Quantize.FASTOCTREE,
+    # WebP quality, ignored when lossless
+    "webp_quality": 80,
+    "webp_lossless": False,
+    # WebP effort from 0 (fastest) to 6 (smallest)
+    "webp_method": 0,
+    "jpeg_quality": 90
+}
+
+# Output buffer of each thread
+_local = threading.local()
+
+def configure(**changes) -> None:
+    """Change the encoder settings.
+
+    Args:
+        **changes: New values of the settings
+
+    Raises:
+        ValueError: If a setting doesn't exist
+    """
+
+    unknown = set(changes) - set(settings)
+    if unknown:
+        raise ValueError(f"Unknown encoder settings {', '.join(sorted(unknown))}")
+
+    settings.update(changes)
+
+def negotiate_format(accept) -> str:
+    """Pick the image format from the Accept header.
+
+    Args:
+        accept: Parsed Accept header, request.accept_mimetypes
+
+    Returns:
+        str: Name of the format in image_formats
+    """
+
+    # Take the format with the highest quality, counting wildcards, browsers
+    # accept image/* as much as image/webp so they get PNG
+    name = max(image_formats, key=lambda name: accept.quality(image_formats[name]))
+    return name if accept.quality(image_formats[name]) > 0 else "png"
+
+def output_buffer() -> BytesIO:
+    """Get the emptied output buffer of this thread.
+
+    Returns:
+        BytesIO: The buffer
+    """
+
+    if not hasattr(_local, "buffer"):
+        _local.buffer = BytesIO()
+
+    buffer = _local.buffer
+    buffer.seek(0)
+    buffer.truncate()
+    return buffer
+
+def to_palette(im: Image.Image) -> Image.Image:
+    """Convert an image to a palette image.
+
+    Images with at most 256 colors keep their exact colors, others are
+    reduced to 256 colors with the png_quantize method. The anti-aliased
+    labels give heatmaps a few thousand colors, which the octree reduces
+    with at most a small shift of each color.
+
+    Args:
+        im (Image.Image): RGB image
+
+    Returns:
+        Image.Image: The palette image
+    """
+
+    # Use the colors of the image as the palette if they fit
+    colors = im.getcolors(256)
+    if colors is not None:
+        palette = Image.new("P", (1, 1))
+        palette.putpalette([value for _, color in colors for value in color])
+        return im.quantize(palette=palette, dither=Image.Dither.NONE)
+
+    return im.quantize(
+        256, method=settings["png_quantize"], dither=Image.Dither.NONE
+    )
+
+def encode_image(
+    im: Image.Image,
+    image_format: str = "png",
+    palette: bool = False
+) -> bytes:
+    """Encode an image with the current encoder settings.
+
+    Args:
+        im (Image.Image): Image to encode
+        image_format (str): Name of the format in image_formats
+        palette (bool): Whether the image has few enough colors to be
+            written as a palette PNG
+
+    Raises:
+        ValueError: If the format doesn't exist
+
+    Returns:
+        bytes: The encoded image
+    """
+
+    output = output_buffer()
+
+    if image_format == "png":
+        if palette and settings["png_palette"] and im.mode == "RGB":
+            im = to_palette(im)
+        im.save(
+            output, format="png",
+            compress_level=settings["png_compress_level"]
+        )
+    elif image_format == "webp":
+        im.save(
+            output, format="webp",
+            quality=settings["webp_quality"],
+            lossless=settings["webp_lossless"],
+            method=settings["webp_method"]
+        )
+    elif image_format == "jpeg":
+        # JPEG has no transparency
+        im.convert("RGB").save(
+            output, format="jpeg", quality=settings["jpeg_quality"]
+        )
+    else:
+        raise ValueError(f"Unknown image format {image_format}")
+
+    return output.getvalue()
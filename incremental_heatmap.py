@@ -0,0 +1,168 @@
+"""Incremental re-rendering of the access point heatmaps
+
+Most of the time of generate_heatmap goes into writing the label of every
+scan, and a bssid usually gains a few scans between renders. An incremental
+heatmap keeps the heat field array and a mask of the drawn scan dots and
+labels, and on the next render only adds the new scans to them:
+
+- the scan mask gets the dots and labels of the new scans, all scans have
+  the same color so the mask can be drawn in any order
+- the heat field keeps the best rssi of each pixel, so the field of the new
+  scans is merged into it around the access point as far as they reach
+
+Both are only valid for the projection they were drawn with. When the
+bounds of the scans and the access point change, the projection changes and
+everything is drawn again. When only the estimated access point moves to
+another pixel, the heat field is computed again and the scan mask is kept.
+"""
+
+# Import Modules
+from PIL import Image
+import numpy as np
+
+# Import data analysis module, heatmap utilities, the datapoint container
+# and grid projection
+import data_analysis as da
+import heatmap_utils as hu
+from datapoints import Datapoints
+from grid_projection import GridProjection
+
+class IncrementalHeatmap:
+    """Heat field and scan mask of a heatmap, updated with new scans."""
+
+    def __init__(self, size: int, buffer: int):
+        """Make an empty incremental heatmap.
+
+        Args:
+            size (int): Size of the image
+            buffer (int): Outer buffer on the image
+        """
+
+        self.size = size
+        self.buffer = buffer
+
+        # Projection, access point grid location, scans drawn so far and the
+        # latest data frame number among them
+        self.projection = None
+        self.ap_coords = None
+        self.count = 0
+        self.last_number = None
+
+        self.field = None
+        self.scan_mask = None
+        self.counters = {"full": 0, "incremental": 0}
+
+    def render(
+        self,
+        ap_location: tuple[float, float],
+        datapoints: Datapoints
+    ) -> Image.Image:
+        """Render the heatmap, drawing only the scans added since the last render.
+
+        The image is the same as generate_heatmap gives for the same access
+        point location and datapoints, except for a color level or two of
+        rounding where labels overlap.
+
+        Args:
+            ap_location (tuple[float, float]): Location of the access point
+            datapoints (Datapoints): All data points of the access point
+
+        Returns:
+            Image.Image: The heatmap
+        """
+
+        # Without 2 scans there is no heatmap, only the message, and up to
+        # hu.ellipse_scans scans are drawn from scratch as ellipses like
+        # generate_heatmap does
+        if len(datapoints) <= hu.ellipse_scans:
+            self.projection = None
+            return da.generate_heatmap(ap_location, datapoints, self.size, self.buffer)
+
+        projection = GridProjection.from_locations(
+            datapoints.location, self.size, self.buffer, ap_location
+        )
+        ap_coords = projection.project_point(ap_location)
+        scan_coords = projection.project(datapoints.location)
+
+        # The scans after the last one drawn are new, if the others are
+        # exactly the ones drawn before
+        new = (
+            datapoints.number > self.last_number
+            if self.last_number is not None
+            else np.ones(len(datapoints), dtype=bool)
+        )
+        unchanged = (
+            projection == self.projection
+            and self.count + int(new.sum()) == len(datapoints)
+        )
+
+        if not unchanged:
+            # Draw everything again for the new projection
+            self.counters["full"] += 1
+            self.scan_mask = Image.new("L", (self.size, self.size + 100))
+            self._draw_scans(datapoints, scan_coords)
+            self.field = self._field(ap_coords, scan_coords, datapoints.rssi)
+        elif new.any():
+            self.counters["incremental"] += 1
+            self._draw_scans(datapoints.take(np.flatnonzero(new)), scan_coords[new])
+            if ap_coords == self.ap_coords:
+                self._merge_field(ap_coords, scan_coords[new], datapoints.rssi[new])
+            else:
+                self.field = self._field(ap_coords, scan_coords, datapoints.rssi)
+
+        self.projection = projection
+        self.ap_coords = ap_coords
+        self.count = len(datapoints)
+        self.last_number = datapoints.number.max()
+
+        # Compose the heatmap in the order of generate_heatmap
+        im = hu.make_image(self.size, self.size)
+        hu.paste_heat_field(im, self.field)
+        hu.draw_accesspoint(im, da.heatmap_accesspoint(ap_location, ap_coords))
+        im.paste(hu.scan_color, (0, 0), self.scan_mask)
+        hu.draw_scale_guide(im)
+
+        return im
+
+    def _draw_scans(self, datapoints: Datapoints, scan_coords: np.ndarray) -> None:
+        # Draw the dots and labels of the scans on the mask
+        hu.draw_scanning_points(
+            self.scan_mask, da.heatmap_scans(scan_coords, datapoints), 255
+        )
+
+    def _field(
+        self,
+        ap_coords: tuple[float, float],
+        scan_coords: np.ndarray,
+        rssi: np.ndarray
+    ) -> np.ndarray:
+        # Compute the heat field of the whole image
+        return hu.heat_field(
+            (self.scan_mask.height, self.scan_mask.width),
+            ap_coords,
+            scan_coords,
+            rssi
+        )
+
+    def _merge_field(
+        self,
+        ap_coords: tuple[float, float],
+        scan_coords: np.ndarray,
+        rssi: np.ndarray
+    ) -> None:
+        # The new scans only reach the pixels at most as far from the access
+        # point as they are, so only the square around it is computed
+        window = hu.reach_window(
+            self.field.shape, ap_coords, hu.scan_reach(ap_coords, scan_coords)
+        )
+        if window is None:
+            return
+        left, top, right, bottom = window
+
+        # Keep the best rssi of each pixel, -1 where no scan reaches
+        window = self.field[top:bottom, left:right]
+        field = hu.heat_field(
+            window.shape, ap_coords, scan_coords, rssi, origin=(left, top)
+        )
+        better = (field >= 0) & ((window < 0) | (field < window))
+        window[better] = field[better]
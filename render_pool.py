@@ -0,0 +1,404 @@
+"""Process pool of warm render workers
+
+Rendering plots with matplotlib and heatmaps with PIL is CPU heavy, and the
+pyplot state isn't thread safe, so the rendering runs in a bounded pool of
+long lived worker processes instead of the request threads or event loop.
+Each worker loads matplotlib, the fonts and one figure per graph style when
+it starts, and reuses the figures for every job by updating the line data.
+The images are encoded in the format the client asked for with the encoder
+settings of the server. Each worker also keeps the incremental heatmaps it
+rendered last, so a heatmap rendered again after new scans only draws the
+new scans if the job lands on the same worker. The pool rejects new jobs
+when too many are already waiting.
+"""
+
+# Import Modules
+from concurrent.futures import Future, ProcessPoolExecutor
+from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
+from matplotlib.figure import Figure
+from matplotlib.patches import Patch
+import matplotlib.dates as mdates
+from PIL import Image
+import asyncio
+import multiprocessing
+import threading
+
+# Import data analysis module, heatmap utilities, image encoding, the
+# datapoint container, object cache and incremental heatmaps
+import data_analysis as da
+import heatmap_utils as hu
+import image_encoding as ie
+from datapoints import Datapoints
+from cache_utils import ObjectCache
+from incremental_heatmap import IncrementalHeatmap
+
+# State of the worker process, filled by warm_worker
+worker_state = {}
+
+class RenderPoolFull(Exception):
+    """Raised when the render pool has too many waiting jobs."""
+
+def make_graph_template(graph: str) -> dict:
+    """Make a reusable figure for a graph style.
+
+    Args:
+        graph (str): Name of the style in da.graph_styles
+
+    Returns:
+        dict: Figure, canvas, axes, mean line, min/max band and legend
+    """
+
+    title, label, ylabel = da.graph_styles[graph]
+
+    # Make the figure with an empty mean line on a time axis
+    fig = Figure()
+    canvas = FigureCanvas(fig)
+    ax = fig.subplots()
+    line, = ax.plot([], [], label=label)
+    ax.xaxis_date()
+
+    # Setup legends, the band is swapped out on every render so the legend
+    # gets a stand-in patch of the same color
+    legend = ax.legend(handles=[
+        line, Patch(facecolor=line.get_color(), alpha=0.3, label="Min/Max")
+    ])
+    ax.set_title(title)
+    ax.set_xlabel("Time")
+    ax.set_ylabel(ylabel)
+
+    return {
+        "fig": fig,
+        "canvas": canvas,
+        "ax": ax,
+        "line": line,
+        "band": None,
+        "legend": legend
+    }
+
+def warm_worker(
+    heatmap_size: int = 2000,
+    encoder_settings: dict | None = None,
+    incremental_heatmaps: int = 4
+) -> None:
+    """Load the render state of a worker process once when it starts.
+
+    Args:
+        heatmap_size (int): Size of the heatmaps to cache the scale guide for
+        encoder_settings (dict | None): Encoder settings of the server, None
+            for the defaults
+        incremental_heatmaps (int): Number of incremental heatmaps to keep,
+            each takes about 6 bytes per pixel, 0 to always render from
+            scratch
+    """
+
+    # Use the same encoder settings as the server
+    if encoder_settings:
+        ie.configure(**encoder_settings)
+
+    # Keep the last incremental heatmaps
+    worker_state["heatmaps"] = (
+        ObjectCache(incremental_heatmaps) if incremental_heatmaps > 0 else None
+    )
+
+    # Make the figure of every graph style and draw them once so the fonts
+    # and text layout caches are loaded
+    worker_state["graphs"] = {}
+    for graph in da.graph_styles:
+        template = make_graph_template(graph)
+        template["canvas"].draw()
+        worker_state["graphs"][graph] = template
+
+    # Render the heatmap scale guide, which also loads the PIL font
+    hu.render_scale_guide(heatmap_size)
+
+def render_graph(
+    buckets: list[dict],
+    graph: str,
+    image_format: str = "png"
+) -> bytes:
+    """Render a time series graph as an image.
+
+    The figure of the graph style is reused, only the line data and the
+    min/max band are replaced.
+
+    Args:
+        buckets (list[dict]): Buckets with _id as time and min, mean and max
+        graph (str): Name of the style in da.graph_styles
+        image_format (str): Name of the format in ie.image_formats
+
+    Returns:
+        bytes: The encoded image
+    """
+
+    # Get the warm figure of the graph style
+    if "graphs" not in worker_state:
+        warm_worker()
+    template = worker_state["graphs"][graph]
+    ax, line = template["ax"], template["line"]
+
+    # Remove the band of the previous render
+    if template["band"] is not None:
+        template["band"].remove()
+        template["band"] = None
+
+    # Update the mean line, an empty time window gives an empty plot
+    x = mdates.date2num([bucket["_id"] for bucket in buckets])
+    line.set_data(x, [bucket["mean"] for bucket in buckets])
+    ax.relim()
+
+    # Draw the new band, which also adds it to the data limits
+    if buckets:
+        template["band"] = ax.fill_between(
+            x,
+            [bucket["min"] for bucket in buckets],
+            [bucket["max"] for bucket in buckets],
+            facecolor=line.get_color(),
+            alpha=0.3
+        )
+    template["legend"].set_visible(bool(buckets))
+
+    # Scale the axes to the new data
+    ax.autoscale_view()
+
+    # Draw the plot and encode the pixels of the canvas
+    canvas = template["canvas"]
+    canvas.draw()
+    return ie.encode_image(
+        Image.frombuffer(
+            "RGBA", canvas.get_width_height(), canvas.buffer_rgba(),
+            "raw", "RGBA", 0, 1
+        ),
+        image_format
+    )
+
+def render_heatmap(
+    datapoints: Datapoints,
+    locator: str,
+    size: int,
+    buffer: int,
+    image_format: str = "png",
+    incremental_key: tuple | None = None
+) -> bytes:
+    """Estimate the access point location and render the heatmap.
+
+    Args:
+        datapoints (Datapoints): Data points of the access point
+        locator (str): Name of the locator in da.locators
+        size (int): Size of the image
+        buffer (int): Outer buffer on the image
+        image_format (str): Name of the format in ie.image_formats
+        incremental_key (tuple | None): Key of the heatmap without the data
+            version, to only draw the scans added since it was last rendered
+            by this worker, None to render from scratch
+
+    Returns:
+        bytes: The encoded image
+    """
+
+    # Estimate the access point location, there is no heatmap to place it
+    # on without at least 2 datapoints
+    ap_location = (
+        da.locate_accesspoint(datapoints, locator)
+        if len(datapoints) > 1 else (0.0, 0.0)
+    )
+
+    # Generate heatmap, from the last render of this worker if there is one
+    heatmaps = worker_state.get("heatmaps")
+    if incremental_key is not None and heatmaps is not None:
+        key = (*incremental_key, locator, size, buffer)
+        heatmap = heatmaps.get(key)
+        if heatmap is None:
+            heatmap = IncrementalHeatmap(size, buffer)
+            heatmaps.put(key, heatmap)
+        im = heatmap.render(ap_location, datapoints)
+    else:
+        im = da.generate_heatmap(ap_location, datapoints, size, buffer)
+
+    # Encode the heatmap, as a palette png by default
+    data = ie.encode_image(im, image_format, palette=True)
+
+    # Free the image right away instead of when the worker gets its next job
+    im.close()
+
+    return data
+
+def render_coverage(
+    names: list[str],
+    groups,
+    datapoints: Datapoints,
+    locator: str,
+    mode: str,
+    size: int,
+    buffer: int,
+    image_format: str = "png"
+) -> bytes:
+    """Estimate the access point locations and render the coverage heatmap.
+
+    Args:
+        names (list[str]): Mac addresses of the access points
+        groups (np.ndarray): Index of the access point of each datapoint
+        datapoints (Datapoints): Data points of all access points
+        locator (str): Name of the locator in da.locators
+        mode (str): Name of the mode in da.coverage_modes
+        size (int): Size of the image
+        buffer (int): Outer buffer on the image
+        image_format (str): Name of the format in ie.image_formats
+
+    Returns:
+        bytes: The encoded image
+    """
+
+    # Estimate all access point locations, then generate the heatmap and
+    # encode it, as a palette png by default
+    ap_locations = da.locate_accesspoints(datapoints, groups, len(names), locator)
+    im = da.generate_coverage_heatmap(
+        names, ap_locations, datapoints, groups, size, buffer, mode
+    )
+    data = ie.encode_image(im, image_format, palette=True)
+
+    # Free the image right away instead of when the worker gets its next job
+    im.close()
+
+    return data
+
+def ping() -> None:
+    """Empty job used to start the worker processes."""
+
+class RenderPool:
+    """Bounded pool of warm render worker processes with backpressure."""
+
+    def __init__(
+        self,
+        workers: int,
+        max_queue: int,
+        heatmap_size: int = 2000,
+        encoder_settings: dict | None = None,
+        incremental_heatmaps: int = 4
+    ):
+        """Make a render pool and start its workers.
+
+        Args:
+            workers (int): Number of worker processes
+            max_queue (int): Number of jobs that may wait for a free worker
+                before new jobs are rejected
+            heatmap_size (int): Size of the heatmaps the workers get ready for
+            encoder_settings (dict | None): Encoder settings for the workers,
+                None for the settings of this process
+            incremental_heatmaps (int): Incremental heatmaps each worker
+                keeps, 0 to always render heatmaps from scratch
+        """
+
+        self.workers = workers
+        self.max_queue = max_queue
+
+        # Start workers from a clean server process instead of forking the
+        # server process with its database threads
+        self._executor = ProcessPoolExecutor(
+            workers,
+            mp_context=multiprocessing.get_context("forkserver"),
+            initializer=warm_worker,
+            initargs=(
+                heatmap_size,
+                encoder_settings or dict(ie.settings),
+                incremental_heatmaps
+            )
+        )
+        self._pending = 0
+        self._lock = threading.Lock()
+        self.counters = {
+            "completed": 0, "failed": 0, "cancelled": 0, "rejected": 0
+        }
+
+        # Start all workers now so the first requests don't wait for them
+        # to load, every job sent to a busy pool starts another worker
+        for _ in range(workers):
+            self._executor.submit(ping)
+
+    def _reserve(self) -> None:
+        # Reject the job if the queue is full so the client can back off
+        with self._lock:
+            if self._pending >= self.workers + self.max_queue:
+                self.counters["rejected"] += 1
+                raise RenderPoolFull(
+                    f"{self._pending} render jobs are already pending"
+                )
+            self._pending += 1
+
+    def _release(self, counter: str) -> None:
+        with self._lock:
+            self._pending -= 1
+            self.counters[counter] += 1
+
+    def _done(self, future: Future) -> None:
+        # Free the slot only once the job has left the worker, a caller that
+        # stops waiting doesn't stop a running job
+        if future.cancelled():
+            self._release("cancelled")
+        elif future.exception() is not None:
+            self._release("failed")
+        else:
+            self._release("completed")
+
+    def _submit(self, func, *args) -> Future:
+        # Reserve a slot that is freed when the job is done
+        self._reserve()
+        try:
+            future = self._executor.submit(func, *args)
+        except BaseException:
+            self._release("failed")
+            raise
+        future.add_done_callback(self._done)
+        return future
+
+    async def render(self, func, *args) -> bytes:
+        """Run a render function in a worker process from the event loop.
+
+        Args:
+            func: Render function, must be importable by the workers
+            *args: Arguments for func, must be picklable
+
+        Raises:
+            RenderPoolFull: If all workers are busy and the queue is full
+
+        Returns:
+            bytes: The rendered image
+        """
+
+        # A cancelled request cancels the job if it is still queued
+        return await asyncio.wrap_future(self._submit(func, *args))
+
+    def submit(self, func, *args) -> bytes:
+        """Run a render function in a worker process and wait for it.
+
+        Args:
+            func: Render function, must be importable by the workers
+            *args: Arguments for func, must be picklable
+
+        Raises:
+            RenderPoolFull: If all workers are busy and the queue is full
+
+        Returns:
+            bytes: The rendered image
+        """
+
+        return self._submit(func, *args).result()
+
+    def metrics(self) -> dict:
+        """Get the render pool metrics.
+
+        Returns:
+            dict: Pool size, pending jobs and job counters
+        """
+
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "pending": self._pending,
+                **self.counters
+            }
+
+    def shutdown(self) -> None:
+        """Stop the worker processes."""
+
+        self._executor.shutdown(cancel_futures=True)
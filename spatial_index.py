@@ -0,0 +1,194 @@
+"""Spatial indexes for looking up points in an area
+
+The points are bucketed into a uniform grid of square cells, so finding the
+points in a rectangle only has to look at the cells it overlaps instead of
+every point. GeoIndex uses the grid for latitude, longitude points with
+bounding box and radius queries.
+"""
+
+# Import Modules
+import numpy as np
+
+# Mean radius of the earth in meters
+earth_radius = 6371008.8
+
+def haversine(
+    latitude: float,
+    longitude: float,
+    latitudes: np.ndarray,
+    longitudes: np.ndarray
+) -> np.ndarray:
+    """Calculate the great circle distance from a point to many points.
+
+    Args:
+        latitude (float): Latitude of the point
+        longitude (float): Longitude of the point
+        latitudes (np.ndarray): Latitudes of the other points
+        longitudes (np.ndarray): Longitudes of the other points
+
+    Returns:
+        np.ndarray: Distances in meters
+    """
+
+    lat1, lon1 = np.radians(latitude), np.radians(longitude)
+    lat2, lon2 = np.radians(latitudes), np.radians(longitudes)
+    a = (
+        np.sin((lat2 - lat1) / 2)**2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+    )
+    return 2 * earth_radius * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+class GridIndex:
+    """Uniform grid index of 2D points."""
+
+    def __init__(self, points: np.ndarray, cell_size: float):
+        """Bucket points into grid cells.
+
+        Args:
+            points (np.ndarray): Points as an (n, 2) array of x, y
+            cell_size (float): Width and height of a grid cell
+        """
+
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        self.cell_size = cell_size
+
+        # Find the cell of every point, numbered row by row from the
+        # smallest occupied cell
+        cells = np.floor(self.points / cell_size).astype(np.int64)
+        self._origin = cells.min(axis=0) if len(cells) else np.zeros(2, np.int64)
+        self._extent = (
+            cells.max(axis=0) - self._origin + 1 if len(cells)
+            else np.zeros(2, np.int64)
+        )
+        keys = (cells[:, 0] - self._origin[0]) * self._extent[1] + (
+            cells[:, 1] - self._origin[1]
+        )
+
+        # Group the point indexes by cell, the indexes stay in ascending
+        # order within a cell
+        order = np.argsort(keys, kind="stable")
+        cell_keys, starts = np.unique(keys[order], return_index=True)
+        self._cells = dict(zip(cell_keys.tolist(), np.split(order, starts[1:])))
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def query(self, x0: float, y0: float, x1: float, y1: float) -> np.ndarray:
+        """Find the points inside a rectangle, edges included.
+
+        Args:
+            x0 (float): Left edge
+            y0 (float): Top edge
+            x1 (float): Right edge
+            y1 (float): Bottom edge
+
+        Returns:
+            np.ndarray: Indexes of the points in ascending order
+        """
+
+        # Get the range of occupied cells the rectangle overlaps
+        (ox, oy), (width, height) = self._origin.tolist(), self._extent.tolist()
+        cx0 = max(int(np.floor(x0 / self.cell_size)) - ox, 0)
+        cy0 = max(int(np.floor(y0 / self.cell_size)) - oy, 0)
+        cx1 = min(int(np.floor(x1 / self.cell_size)) - ox, width - 1)
+        cy1 = min(int(np.floor(y1 / self.cell_size)) - oy, height - 1)
+        if cx0 > cx1 or cy0 > cy1:
+            return np.empty(0, dtype=np.intp)
+
+        # Look up the overlapped cells, or go through the occupied cells if
+        # there are fewer of those
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) <= len(self._cells):
+            candidates = [
+                self._cells[key]
+                for cx in range(cx0, cx1 + 1)
+                for key in range(cx * height + cy0, cx * height + cy1 + 1)
+                if key in self._cells
+            ]
+        else:
+            candidates = [
+                indexes for key, indexes in self._cells.items()
+                if cx0 <= key // height <= cx1 and cy0 <= key % height <= cy1
+            ]
+        if not candidates:
+            return np.empty(0, dtype=np.intp)
+
+        # Keep the points of the cells that are inside the rectangle
+        indexes = np.concatenate(candidates)
+        x, y = self.points[indexes, 0], self.points[indexes, 1]
+        inside = (x >= x0) & (x <= x1) & (y >= y0) & (y <= y1)
+        return np.sort(indexes[inside])
+
+class GeoIndex:
+    """Grid index of latitude, longitude points."""
+
+    def __init__(
+        self,
+        latitudes: np.ndarray,
+        longitudes: np.ndarray,
+        cell_size: float = 0.001
+    ):
+        """Index points by their location.
+
+        Args:
+            latitudes (np.ndarray): Latitudes of the points
+            longitudes (np.ndarray): Longitudes of the points
+            cell_size (float): Size of a grid cell in degrees, 0.001 is
+                about 111 meters of latitude
+        """
+
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self._grid = GridIndex(
+            np.column_stack((self.longitudes, self.latitudes)), cell_size
+        )
+
+    def __len__(self) -> int:
+        return len(self.latitudes)
+
+    def bbox(self, south: float, west: float, north: float, east: float) -> np.ndarray:
+        """Find the points inside a bounding box, edges included.
+
+        Args:
+            south (float): Southern latitude
+            west (float): Western longitude
+            north (float): Northern latitude
+            east (float): Eastern longitude
+
+        Returns:
+            np.ndarray: Indexes of the points in ascending order
+        """
+
+        return self._grid.query(west, south, east, north)
+
+    def radius(self, latitude: float, longitude: float, radius: float) -> np.ndarray:
+        """Find the points within a distance of a location.
+
+        Args:
+            latitude (float): Latitude of the center
+            longitude (float): Longitude of the center
+            radius (float): Distance in meters
+
+        Returns:
+            np.ndarray: Indexes of the points in ascending order
+        """
+
+        # Find the points in the bounding box of the circle, the longitude
+        # span grows towards the poles
+        span = np.degrees(radius / earth_radius)
+        cos_latitude = np.cos(np.radians(latitude))
+        longitude_span = span / cos_latitude if cos_latitude > 1e-9 else 360
+        candidates = self.bbox(
+            latitude - span,
+            longitude - longitude_span,
+            latitude + span,
+            longitude + longitude_span
+        )
+
+        # Keep the points that are within the distance
+        distances = haversine(
+            latitude,
+            longitude,
+            self.latitudes[candidates],
+            self.longitudes[candidates]
+        )
+        return candidates[distances <= radius]